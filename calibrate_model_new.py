@@ -1,11 +1,15 @@
 from functions.indirect_calibration import *
 import time
-from multiprocessing import Pool
+from multiprocessing import Pool, cpu_count
 import json
 import numpy as np
-from functions.stylizedfacts import autocorrelation_returns
+from functions.stylizedfacts import stylized_moments
+from functions.helpers import hurst_rs, quadratic_loss_lower_bound
+from functions.cache import SimulationCache
+from functions.journal import EvaluationJournal
+from objects.config import ModelConfig
+from objects.monitor import CheckpointMonitor
 import math
-from hurst import compute_Hc
 
 np.seterr(all='ignore')
 
@@ -13,9 +17,18 @@ start_time = time.time()
 
 # INPUT PARAMETERS
 LATIN_NUMBER = 0
+MULTI_START = False # if True, start from all points of the latin hypercube at the same time instead of LATIN_NUMBER
+SURROGATE = False # if True, emulate the cost with a Gaussian process fitted to the latin hypercube instead of Nelder-Mead
+SURROGATE_EVALUATIONS = 40 # parameter sets simulated by the surrogate calibration, including the latin hypercube
 NRUNS = 4
 BURN_IN = 0
-CORES = NRUNS # set the amount of cores equal to the amount of runs
+CORES = max(NRUNS, cpu_count()) # all seeds of the simplex points of an iteration are simulated at the same time
+REPLICATES = False # if True, simulate the seeds of a point in lockstep with batch order submission, see exuberance_inequality_replicates
+EARLY_STOPPING = True # stop simulations of points which are certain enough to be worse than the worst simplex vertex
+CHECKPOINT_EVERY = 50 # ticks between the checks of a simulation which may be stopped early
+CONFIDENCE_Z = 2.0 # standard errors of the partial stylized facts by which the cost of a stopped simulation is bounded
+BOOTSTRAP_SAMPLES = 50 # block bootstrap samples of the partial returns from which the standard errors of the partial stylized facts are estimated
+STANDARD_DEVIATIONS = None # if given, the standard errors of the partial stylized facts are these divided by the square root of the number of returns instead, e.g. [1., 1., 24 ** 0.5, 1.] for independent normal returns
 
 problem = {
   'num_vars': 3,
@@ -32,87 +45,263 @@ UB = [x[1] for x in problem['bounds']]
 
 init_parameters = latin_hyper_cube[LATIN_NUMBER]
 
+# simulated runs are stored here, so that restarts and reruns do not simulate the same parameters and seed again
+CACHE = SimulationCache('simulation_cache')
+
 params = {'trader_sample_size': 10, 'n_traders': 1000, 'init_stocks': 81, 'ticks': 604,
               'fundamental_value': 1101.1096156039398, 'std_fundamental': 0.0,
               'base_risk_aversion': 0.7, 'spread_max': 0.004087, 'horizon': 211, 'std_noise': 0.01,
               'w_random': 1.0, 'mean_reversion': 0.0, 'fundamentalist_horizon_multiplier': 1.0,
               'strat_share_chartists': 0.0, 'mutation_intensity': 0.0, 'average_learning_ability': 0.0,
               'trades_per_tick': 1}
+# fail on invalid parameters before any simulation is started
+params = ModelConfig.from_dict(params)
 
 
 def simulate_a_seed(seed_params):
     """Simulates the model for a single seed and outputs the associated cost"""
+    W = np.load('distr_weighting_matrix.npy')  # if this doesn't work, use: np.identity(len(stylized_facts_sim))
+
+    empirical_moments = np.load('emp_moments.npy')
+
+    stylized_facts_sim, seconds, censored_cost = simulate_seed_moments(seed_params)
+    if stylized_facts_sim is None:
+        return censored_cost
+
+    # calculate the cost
+    cost = quadratic_loss_function(stylized_facts_sim, empirical_moments, W)
+    return cost
+
+
+def simulate_seed_moments(seed_params):
+    """
+    Simulates the model for a single seed and outputs the simulated moments, the seconds it took and the censored cost.
+    If a threshold is given as third element of seed_params, the simulation is stopped early when its cost is
+    certain enough to exceed it, and the moments are None and the censored cost is a lower bound of the cost.
+    """
+    start = time.time()
     seed = seed_params[0]
     params = seed_params[1]
+    threshold = seed_params[2] if len(seed_params) > 2 else np.inf
+
+    # the moments are calculated from the cached close prices, so that changes to the moments never use stale results
+    key = CACHE.key(params, seed, outputs='calibration')
+    cached = CACHE.get(key)
+    if cached is not None:
+        return close_moments(cached['close']), time.time() - start, None
+
+    monitor = None
+    if EARLY_STOPPING and threshold < np.inf:
+        W = np.load('distr_weighting_matrix.npy')
+        empirical_moments = np.load('emp_moments.npy')
+        monitor = CheckpointMonitor(threshold, lambda ob: partial_cost_bound(ob, empirical_moments, W),
+                                    every=CHECKPOINT_EVERY)
 
-    obs = []
     # run model with parameters
     traders, orderbook = init_objects(params, seed)
-    traders, orderbook = exuberance_inequality_model(traders, orderbook, params, seed)
-    obs.append(orderbook)
+    traders, orderbook = exuberance_inequality_model(traders, orderbook, params, seed, monitor=monitor)
+    if monitor is not None and monitor.stopped_at is not None:
+        return None, time.time() - start, monitor.censored_loss()
 
     # store simulated stylized facts
-    mc_prices, mc_returns, mc_autocorr_returns, mc_autocorr_abs_returns, mc_volatility, mc_volume, mc_fundamentals = organise_data(
-        obs, burn_in_period=BURN_IN)
-
-    rets_autocor = []
-    rets_abs_autocors = []
-    kurts = []
-    hursts = []
-    for col in mc_returns:
-        rets_autocor.append(autocorrelation_returns(mc_returns[col][1:], 25))
-        rets_abs_autocors.append(autocorrelation_returns(mc_returns[col][1:].abs(), 25))
-        kurts.append(mc_returns[col][1:].kurtosis())
-        hursts.append(compute_Hc(mc_prices[col][1:], kind='price', simplified=True)[0])
-
-    stylized_facts_sim = np.array([
-        np.mean(rets_autocor),
-        np.mean(rets_abs_autocors),
-        np.mean(kurts),
-        np.mean(hursts)
+    stylized_facts_sim = close_moments(orderbook.tick_close_price)
+
+    CACHE.put(key, {'close': np.array(orderbook.tick_close_price),
+                    'volume': np.array([sum(volumes) for volumes in orderbook.transaction_volumes_history]),
+                    'final_wealth': np.array([x.var.money[-1] + x.var.stocks[-1] * orderbook.tick_close_price[-1]
+                                              for x in traders])})
+
+    return stylized_facts_sim, time.time() - start, None
+
+
+def simulate_replicate_moments(seeds_params):
+    """
+    Simulates the model for all seeds of a parameter set at once as lockstep replicates with batch order submission
+    and outputs for every seed the simulated moments, the seconds it took and the censored cost, which is always None
+    since replicates are not stopped early.
+    """
+    start = time.time()
+    seeds = seeds_params[0]
+    params = seeds_params[1]
+
+    keys = [CACHE.key(params, seed, outputs='calibration', order_submission='batch') for seed in seeds]
+    closes = {}
+    for seed, key in zip(seeds, keys):
+        cached = CACHE.get(key)
+        if cached is not None:
+            closes[seed] = cached['close']
+
+    # run the seeds which are not cached as replicates
+    missing = [seed for seed in seeds if seed not in closes]
+    if missing:
+        replicates = exuberance_inequality_replicates([init_objects(params, seed) for seed in missing], params,
+                                                      missing)
+        for seed, (traders, orderbook) in zip(missing, replicates):
+            closes[seed] = np.array(orderbook.tick_close_price)
+            CACHE.put(keys[seeds.index(seed)], {
+                'close': closes[seed],
+                'volume': np.array([sum(volumes) for volumes in orderbook.transaction_volumes_history]),
+                'final_wealth': np.array([x.var.money[-1] + x.var.stocks[-1] * orderbook.tick_close_price[-1]
+                                          for x in traders])})
+
+    seconds = (time.time() - start) / len(seeds)
+    return [(close_moments(closes[seed]), seconds, None) for seed in seeds]
+
+
+def close_moments(close):
+    """Calculates the simulated stylized facts of a series of close prices"""
+    return price_moments(np.array(close[BURN_IN:], dtype=np.float64)[:, None])[0]
+
+
+def price_moments(prices):
+    """Calculates the stylized facts of every column of a matrix of prices, returns a row of moments per column"""
+    returns = pd.DataFrame(prices).pct_change().values[1:]
+    moments = stylized_moments(returns, ac_lags=(), abs_ac_lags=())
+    hursts, _ = hurst_rs(prices[1:])
+
+    return np.column_stack([
+        moments['autocorrelation'].values,
+        moments['abs_autocorrelation'].values,
+        moments['kurtosis'].values,
+        hursts
     ])
 
-    W = np.load('distr_weighting_matrix.npy')  # if this doesn't work, use: np.identity(len(stylized_facts_sim))
 
-    empirical_moments = np.load('emp_moments.npy')
+def bootstrap_standard_errors(close, samples=BOOTSTRAP_SAMPLES, seed=0):
+    """
+    Standard errors of the stylized facts of a series of close prices, estimated from the stylized facts of price
+    series which are rebuilt from its returns resampled in blocks of the square root of their number. The blocks keep
+    the autocorrelation and volatility clustering of the returns within them. The samples are drawn with a fixed seed,
+    so that the standard errors of a series are always the same.
+    """
+    prices = np.array(close[BURN_IN:], dtype=np.float64)
+    growth = prices[1:] / prices[:-1]
+    block = int(np.sqrt(len(growth)))
+    blocks = -(-len(growth) // block)
+    starts = np.random.default_rng(seed).integers(0, len(growth) - block + 1, size=(blocks, samples))
+    resampled = growth[(starts[:, None, :] + np.arange(block)[None, :, None]).reshape(blocks * block, samples)]
+    resampled = np.vstack([np.full((1, samples), prices[0]), resampled[:len(growth)]])
+    return np.std(price_moments(np.cumprod(resampled, axis=0)), axis=0, ddof=1)
+
+
+def partial_cost_bound(orderbook, empirical_moments, W):
+    """Lower confidence bound of the cost of a simulation, from the stylized facts of the ticks simulated so far"""
+    returns = len(orderbook.tick_close_price) - BURN_IN - 1
+    if returns < 100:
+        return 0.0
+    if STANDARD_DEVIATIONS is not None:
+        standard_errors = np.asarray(STANDARD_DEVIATIONS) / np.sqrt(returns)
+    else:
+        standard_errors = bootstrap_standard_errors(orderbook.tick_close_price)
+    if not np.isfinite(standard_errors).all():
+        # the uncertainty of the stylized facts is unknown, so the cost is not bounded
+        return 0.0
+    return quadratic_loss_lower_bound(close_moments(orderbook.tick_close_price), standard_errors, empirical_moments,
+                                      W, CONFIDENCE_Z)
+
+
+def seed_costs(outputs, empirical_moments, W):
+    """Costs of the seeds of a point from their simulated moments, or their censored costs if they were stopped early"""
+    return [quadratic_loss_function(moments, empirical_moments, W) if moments is not None else censored
+            for moments, _, censored in outputs]
 
-    # calculate the cost
-    cost = quadratic_loss_function(stylized_facts_sim, empirical_moments, W)
-    return cost
+
+def censored_reruns(seed_outputs, thresholds, empirical_moments, W):
+    """
+    Seeds which are simulated again without a threshold. The average cost of a point with stopped seeds is censored,
+    if it is not above the threshold of the point, it is not decided yet whether the point is worse than the threshold,
+    so its stopped seeds are rerun to completion.
+    :param seed_outputs: list per point of a list per seed of tuples of moments, seconds and censored cost
+    :param thresholds: list per point of the cost above which its exact cost is not needed
+    :return: list of tuples of the index of a point and the index of a seed
+    """
+    reruns = []
+    for idx, (outputs, threshold) in enumerate(zip(seed_outputs, thresholds)):
+        if np.mean(seed_costs(outputs, empirical_moments, W)) <= threshold:
+            reruns += [(idx, seed) for seed, (moments, _, _) in enumerate(outputs) if moments is None]
+    return reruns
 
 
 def pool_handler():
     p = Pool(CORES) # argument is how many process happening in parallel
+    # evaluated parameters are appended here, a restarted calibration replays them to continue where it stopped
+    journal = EvaluationJournal('calibration_journal.jsonl')
     list_of_seeds = [x for x in range(NRUNS)]
 
-    def model_performance(input_parameters):
+    W = np.load('distr_weighting_matrix.npy')
+    empirical_moments = np.load('emp_moments.npy')
+
+    def model_performance(list_of_input_parameters, thresholds=None):
         """
         Simple function calibrate uncertain model parameters
-        :param input_parameters: list of input parameters
-        :return: average cost
+        :param list_of_input_parameters: list of lists of input parameters, which are simulated at the same time
+        :param thresholds: list of costs above which the exact cost of a point is not needed, the cost of a point of
+        which the simulations are stopped early is censored: it is at least its threshold
+        :return: list of average costs
         """
-        # convert relevant parameters to integers
-        new_input_params = []
-        for idx, par in enumerate(input_parameters):
-            new_input_params.append(par)
-
-        # update params
-        uncertain_parameters = dict(zip(problem['names'], new_input_params))
-        params = {'trader_sample_size': 10, 'n_traders': 1000, 'init_stocks': 81, 'ticks': 604,
-              'fundamental_value': 1101.1096156039398, 'std_fundamental': 0.0,
-              'base_risk_aversion': 0.7, 'spread_max': 0.004087, 'horizon': 211, 'std_noise': 0.01,
-              'w_random': 1.0, 'mean_reversion': 0.0, 'fundamentalist_horizon_multiplier': 1.0,
-              'strat_share_chartists': 0.0, 'mutation_intensity': 0.0, 'average_learning_ability': 0.0,
-              'trades_per_tick': 1}
-        params.update(uncertain_parameters)
+        if thresholds is None:
+            thresholds = [np.inf] * len(list_of_input_parameters)
+        # replicates follow the path of batch order submission, which differs from the sequential one
+        options = {'order_submission': 'batch'} if REPLICATES else {}
+        evaluations = []
+        for input_parameters, threshold in zip(list_of_input_parameters, thresholds):
+            # update params
+            uncertain_parameters = dict(zip(problem['names'], input_parameters))
+            point_params = params.replace(**uncertain_parameters)
+            key = journal.key(point_params, list_of_seeds, burn_in=BURN_IN, outputs='calibration', **options)
+            evaluations.append((input_parameters, point_params, key, threshold))
+
+        # parameters which were evaluated before the calibration was interrupted are replayed from the journal, a
+        # censored cost only if it was censored at a threshold of at least the one that is asked for now
+        new_evaluations = [evaluation for evaluation in evaluations
+                           if not journal.replayable(evaluation[2], evaluation[3])]
+        if REPLICATES:
+            outputs = p.map(simulate_replicate_moments, [[list_of_seeds, point_params]
+                                                         for _, point_params, _, _ in new_evaluations])
+            seed_outputs = [list(output) for output in outputs]
+        else:
+            list_of_seeds_params = [[seed, point_params, threshold] for _, point_params, _, threshold in new_evaluations
+                                    for seed in list_of_seeds]
+
+            outputs = p.map(simulate_seed_moments, list_of_seeds_params) # first argument is function to execute, second argument is tuple of all inputs
+            seed_outputs = [outputs[idx * NRUNS:(idx + 1) * NRUNS] for idx in range(len(new_evaluations))]
+
+        reruns = censored_reruns(seed_outputs, [threshold for _, _, _, threshold in new_evaluations],
+                                 empirical_moments, W)
+        if reruns:
+            rerun_outputs = p.map(simulate_seed_moments, [[list_of_seeds[seed], new_evaluations[idx][1]]
+                                                          for idx, seed in reruns])
+            for (idx, seed), (moments, seconds, _) in zip(reruns, rerun_outputs):
+                seconds += seed_outputs[idx][seed][1]
+                seed_outputs[idx][seed] = (moments, seconds, None)
 
-        list_of_seeds_params = [[seed, params] for seed in list_of_seeds]
+        for idx, (input_parameters, point_params, key, threshold) in enumerate(new_evaluations):
+            costs = seed_costs(seed_outputs[idx], empirical_moments, W)
+            journal.record(key, point_params, list_of_seeds, point=list(input_parameters), cost=np.mean(costs),
+                           censored=any(moments is None for moments, _, _ in seed_outputs[idx]), threshold=threshold,
+                           seed_costs=costs, moments=[moments for moments, _, _ in seed_outputs[idx]],
+                           seconds=[seconds for _, seconds, _ in seed_outputs[idx]])
 
-        costs = p.map(simulate_a_seed, list_of_seeds_params) # first argument is function to execute, second argument is tuple of all inputs TODO uncomment this
+        return [journal.get(key)['cost'] for _, _, key, _ in evaluations]
 
-        return np.mean(costs)
+    def checkpoint(xk):
+        """Write the best parameters after every iteration"""
+        with open('estimated_params.json', 'w') as f:
+            json.dump(list(xk), f)
 
-    output = constrNM(model_performance, init_parameters, LB, UB, maxiter=4, full_output=True)
+    if SURROGATE:
+        output = surrogateCalibration(model_performance, latin_hyper_cube, LB, UB, maxfun=SURROGATE_EVALUATIONS,
+                                      batch_size=max(1, CORES // NRUNS), full_output=True, batch=True,
+                                      callback=checkpoint)
+    elif MULTI_START:
+        outputs = multistartConstrNM(model_performance, latin_hyper_cube, LB, UB, maxiter=4, full_output=True,
+                                     batch=True, thresholds=EARLY_STOPPING)
+        output = min(outputs, key=lambda x: x['fopt'])
+        with open('multistart_params.json', 'w') as f:
+            json.dump([[list(x['xopt']), x['fopt']] for x in outputs], f)
+    else:
+        output = parallelConstrNM(model_performance, init_parameters, LB, UB, maxiter=4, full_output=True, batch=True,
+                                  thresholds=EARLY_STOPPING, callback=checkpoint)
 
     with open('estimated_params.json', 'w') as f:
         json.dump(list(output['xopt']), f)
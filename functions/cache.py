@@ -0,0 +1,125 @@
+"""Persistent on-disk cache of simulation results, addressed by the content of the simulated configuration"""
+
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+
+from model import MODEL_VERSION
+from objects.config import ModelConfig
+
+
+def json_default(value):
+    """
+    Convert numpy scalars and arrays in a configuration to json
+    :param value: object which json cannot serialize
+    :return: json serializable object
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError('cannot hash configuration value {!r}'.format(value))
+
+
+class SimulationCache:
+    """
+    Stores the compact outputs of simulation runs as .npz files named after the sha256 hash of the full parameter
+    dictionary, the seed, the model version and the engine. When the files exceed the size cap the least recently
+    used are evicted. Files are written atomically, so that several processes can share a cache directory.
+    """
+    def __init__(self, directory='simulation_cache', max_bytes=2 * 1024 ** 3):
+        """
+        Initialize the cache, its directory is created when the first result is stored
+        :param directory: string directory in which the results are stored
+        :param max_bytes: integer maximum total size of the cached results
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, params, seed, engine='python', **options):
+        """
+        Stable hash of a simulation configuration
+        :param params: dictionary of parameters or ModelConfig, which is validated and completed with defaults
+        :param seed: integer seed
+        :param engine: string simulation engine
+        :param options: further keyword arguments which change the simulated outputs
+        :return: string hexadecimal sha256 hash
+        """
+        configuration = {'params': ModelConfig.from_dict(params).to_dict(), 'seed': seed,
+                         'model_version': MODEL_VERSION, 'engine': engine, 'options': options}
+        encoded = json.dumps(configuration, sort_keys=True, default=json_default)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def path(self, key):
+        """
+        :param key: string hash of the run configuration
+        :return: string file name of the cached outputs
+        """
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """
+        Look up the outputs of a run and mark them as recently used
+        :param key: string hash of the run configuration
+        :return: dictionary of numpy arrays, or None if the run is not cached
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as archive:
+                outputs = {name: archive[name] for name in archive.files}
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return outputs
+
+    def put(self, key, outputs):
+        """
+        Store the outputs of a run and evict the least recently used runs if the cache is too large
+        :param key: string hash of the run configuration
+        :param outputs: dictionary of numpy arrays or scalars
+        :return: None
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, **outputs)
+        os.replace(temporary, self.path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used results until the cache fits within max_bytes
+        :return: None
+        """
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Delete all cached results
+        :return: None
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                os.remove(entry.path)
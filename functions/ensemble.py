@@ -0,0 +1,378 @@
+"""Monte Carlo ensembles of model runs on a persistent process pool, with results written to shared memory"""
+
+import multiprocessing as mp
+import time
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+import init_objects
+from model import exuberance_inequality_model
+from functions.inequality import inequality_panel
+from objects.config import ModelConfig
+
+INEQUALITY_SERIES = ['gini', 'real_gini', 'palma', 'real_palma']
+
+# increase when a change alters the statistics that run_statistics derives from a run, such as the inequality measures
+# or the profit, so that cached statistics are no longer used
+STATISTICS_VERSION = '1'
+
+
+def ensemble_layout(param_sets, seeds):
+    """
+    Shapes and types of the result arrays of an ensemble, with a row per parameter set and a column per seed.
+    Series of parameter sets with fewer ticks than the longest are padded with nan.
+    :param param_sets: list of parameter dictionaries
+    :param seeds: list of integer seeds
+    :return: dictionary of result name to (shape, dtype string)
+    """
+    runs = (len(param_sets), len(seeds))
+    ticks = max(params['ticks'] for params in param_sets)
+    layout = {'close': (runs + (ticks + 2,), 'float64'),
+              'close_length': (runs, 'int64'),
+              'volume': (runs + (ticks,), 'float64'),
+              'profit': (runs, 'float64')}
+    for name in INEQUALITY_SERIES:
+        layout[name] = (runs + (ticks - 1,), 'float64')
+    return layout
+
+
+class SharedResults:
+    """
+    Result arrays of an ensemble in multiprocessing.shared_memory blocks, created by the parent process and
+    written to by the workers
+    """
+    def __init__(self, layout):
+        """
+        Create a shared memory block for every result array and fill it with nan
+        :param layout: dictionary of result name to (shape, dtype string), see ensemble_layout
+        """
+        self.blocks = {}
+        self.arrays = {}
+        for name, (shape, dtype) in layout.items():
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            block = shared_memory.SharedMemory(create=True, size=size)
+            self.blocks[name] = block
+            self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            self.arrays[name].fill(np.nan if np.dtype(dtype).kind == 'f' else 0)
+
+    def handles(self):
+        """
+        :return: dictionary of result name to (block name, shape, dtype string) with which workers attach to the blocks
+        """
+        return {name: (self.blocks[name].name, array.shape, array.dtype.str) for name, array in self.arrays.items()}
+
+    def copy(self):
+        """
+        :return: dictionary of private copies of the result arrays
+        """
+        return {name: array.copy() for name, array in self.arrays.items()}
+
+    def release(self):
+        """
+        Close and unlink all shared memory blocks
+        :return: None
+        """
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+
+def run_statistics(traders, orderbook, params):
+    """
+    Extract the series which are kept of a single simulation
+    :param traders: list of simulated Agent objects
+    :param orderbook: object simulated Order book
+    :param params: dictionary of parameters with which the run was simulated
+    :return: dictionary of close prices, volume, final wealth vector, average relative profit and per tick
+    inequality series
+    """
+    if getattr(orderbook, 'retention', 'full') == 'bounded':
+        # bounded order books only keep tick summaries and the initial close prices
+        volume = orderbook.tick_summaries()['volume']
+    else:
+        volume = np.array([sum(volumes) for volumes in orderbook.transaction_volumes_history])
+    close = np.array(orderbook.close_prices())
+    tick_close_price = close
+
+    money = np.array([x.var.money for x in traders]).T
+    stocks = np.array([x.var.stocks for x in traders]).T
+    wealth_start = money[0] + stocks[0] * tick_close_price[0]
+    wealth_end = money[-1] + stocks[-1] * tick_close_price[-1]
+
+    # wealth panels of shape (ticks - 1, n_traders)
+    periods = params['ticks'] - 1
+    wealth = money[:periods] + stocks[:periods] * tick_close_price[:periods, None]
+    real_wealth = np.array([x.var.real_wealth[:periods] for x in traders]).T
+    wealth_inequality = inequality_panel(wealth)
+    real_wealth_inequality = inequality_panel(real_wealth)
+
+    return {'close': close, 'close_length': len(close), 'volume': volume, 'final_wealth': wealth_end,
+            'profit': np.mean((wealth_end - wealth_start) / wealth_start),
+            'gini': wealth_inequality['gini'], 'palma': wealth_inequality['palma'],
+            'real_gini': real_wealth_inequality['gini'], 'real_palma': real_wealth_inequality['palma']}
+
+
+def write_statistics(arrays, p_idx, s_idx, statistics):
+    """
+    Write the statistics of a single run into its row and column of the result arrays
+    :param arrays: dictionary of result arrays
+    :param p_idx: integer index of the parameter set
+    :param s_idx: integer index of the seed
+    :param statistics: dictionary of statistics, see run_statistics
+    :return: None
+    """
+    for name, values in statistics.items():
+        if name not in arrays:
+            continue
+        if np.ndim(values):
+            arrays[name][p_idx, s_idx, :len(values)] = values
+        else:
+            arrays[name][p_idx, s_idx] = values
+
+
+def run_key(cache, params, seed, model_kwargs, init_kwargs):
+    """
+    Cache key of a single run of an ensemble, the statistics of a run are cached rather than the run itself, so the key
+    includes the STATISTICS_VERSION
+    :param cache: object SimulationCache
+    :param params: dictionary of parameters
+    :param seed: integer seed
+    :param model_kwargs: dictionary of keyword arguments of exuberance_inequality_model
+    :param init_kwargs: dictionary of keyword arguments of init_objects
+    :return: string hash of the run configuration
+    """
+    model_options = {name: value for name, value in model_kwargs.items() if name != 'engine'}
+    return cache.key(params, seed, model_kwargs.get('engine', 'python'), model_kwargs=model_options,
+                     init_kwargs=init_kwargs, outputs='ensemble', statistics_version=STATISTICS_VERSION)
+
+
+def simulate_statistics(job):
+    """
+    Simulate a single (parameter set, seed) pair, or look it up in the cache, and return its statistics. The traders
+    and order book of the run are freed before the statistics are returned.
+    :param job: tuple of parameter set index, seed index, parameters, seed, model keyword arguments, init_objects
+    keyword arguments, SimulationCache in which the statistics are stored (or None) and the cache key of the run (or
+    None to calculate it)
+    :return: tuple of the parameter set and seed indices, dictionary of statistics and the seconds the run took
+    """
+    p_idx, s_idx, params, seed, model_kwargs, init_kwargs, cache, key = job
+    start = time.time()
+    if cache is not None:
+        if key is None:
+            key = run_key(cache, params, seed, model_kwargs, init_kwargs)
+        cached = cache.get(key)
+        if cached is not None:
+            return p_idx, s_idx, cached, time.time() - start
+    traders, orderbook = init_objects.init_objects(params, seed, **init_kwargs)
+    traders, orderbook = exuberance_inequality_model(traders, orderbook, params, seed=seed, **model_kwargs)
+    statistics = run_statistics(traders, orderbook, params)
+    del traders, orderbook
+    if cache is not None:
+        cache.put(key, statistics)
+    return p_idx, s_idx, statistics, time.time() - start
+
+
+def simulate_run(job):
+    """
+    Simulate a single (parameter set, seed) pair and write its statistics into the shared result blocks
+    :param job: tuple of shared block handles, parameter set index, seed index, parameters, seed, model keyword
+    arguments, init_objects keyword arguments, SimulationCache in which the statistics are stored (or None) and the
+    cache key of the run
+    :return: tuple of the parameter set and seed indices
+    """
+    handles = job[0]
+    p_idx, s_idx, statistics, _ = simulate_statistics(job[1:])
+
+    blocks = {name: shared_memory.SharedMemory(name=block_name) for name, (block_name, _, _) in handles.items()}
+    try:
+        arrays = {name: np.ndarray(shape, dtype=dtype, buffer=blocks[name].buf)
+                  for name, (_, shape, dtype) in handles.items()}
+        write_statistics(arrays, p_idx, s_idx, statistics)
+        del arrays
+    finally:
+        for block in blocks.values():
+            block.close()
+    return p_idx, s_idx
+
+
+class EnsembleRunner:
+    """
+    Persistent process pool which can run several ensembles without restarting its workers
+    """
+    def __init__(self, workers=None):
+        """
+        Start the pool
+        :param workers: integer number of worker processes, defaults to the number of cpus. With 1 worker all runs
+        are simulated in the current process.
+        """
+        self.workers = workers or mp.cpu_count()
+        self.pool = mp.Pool(self.workers) if self.workers > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Stop the worker processes
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def run(self, param_sets, seeds, chunksize=None, model_kwargs=None, init_kwargs=None, cache=None):
+        """
+        Simulate every (parameter set, seed) pair
+        :param param_sets: list of parameter dictionaries
+        :param seeds: list of integer seeds
+        :param chunksize: integer number of runs sent to a worker at once, by default about four chunks per worker
+        :param model_kwargs: dictionary of keyword arguments of exuberance_inequality_model
+        :param init_kwargs: dictionary of keyword arguments of init_objects
+        :param cache: object SimulationCache of which cached runs are used and to which new runs are added
+        :return: dictionary of result arrays with a row per parameter set and a column per seed, see ensemble_layout
+        """
+        # invalid parameters fail here, before any run is sent to the workers
+        param_sets = [ModelConfig.from_dict(params) for params in param_sets]
+        model_kwargs = model_kwargs or {}
+        init_kwargs = init_kwargs or {}
+        results = SharedResults(ensemble_layout(param_sets, seeds))
+        try:
+            handles = results.handles()
+            jobs = []
+            for p_idx, params in enumerate(param_sets):
+                for s_idx, seed in enumerate(seeds):
+                    key = None
+                    if cache is not None:
+                        key = run_key(cache, params, seed, model_kwargs, init_kwargs)
+                        cached = cache.get(key)
+                        if cached is not None:
+                            write_statistics(results.arrays, p_idx, s_idx, cached)
+                            continue
+                    jobs.append((handles, p_idx, s_idx, params, seed, model_kwargs, init_kwargs, cache, key))
+            if self.pool is None:
+                for job in jobs:
+                    simulate_run(job)
+            else:
+                if chunksize is None:
+                    chunksize = max(1, len(jobs) // (4 * self.workers))
+                for _ in self.pool.imap_unordered(simulate_run, jobs, chunksize):
+                    pass
+            return results.copy()
+        finally:
+            results.release()
+
+    def stream(self, param_sets, seeds, chunksize=1, model_kwargs=None, init_kwargs=None, cache=None):
+        """
+        Simulate every (parameter set, seed) pair, and generate the results of a parameter set as soon as all its
+        seeds are simulated. Runs of several parameter sets are simulated at the same time, but only the results of
+        parameter sets of which runs are underway are kept in memory.
+        :param param_sets: list of parameter dictionaries
+        :param seeds: list of integer seeds
+        :param chunksize: integer number of runs sent to a worker at once
+        :param model_kwargs: dictionary of keyword arguments of exuberance_inequality_model
+        :param init_kwargs: dictionary of keyword arguments of init_objects
+        :param cache: object SimulationCache of which cached runs are used and to which new runs are added
+        :return: generator of tuples of the index of a parameter set and a dictionary of its result arrays, with a
+        single row, see ensemble_layout, and the seconds that every run took
+        """
+        param_sets = [ModelConfig.from_dict(params) for params in param_sets]
+        model_kwargs = model_kwargs or {}
+        init_kwargs = init_kwargs or {}
+        jobs = ((p_idx, s_idx, params, seed, model_kwargs, init_kwargs, cache, None)
+                for p_idx, params in enumerate(param_sets) for s_idx, seed in enumerate(seeds))
+        if self.pool is None:
+            completed = map(simulate_statistics, jobs)
+        else:
+            completed = self.pool.imap_unordered(simulate_statistics, jobs, chunksize)
+
+        underway = {}
+        for p_idx, s_idx, statistics, seconds in completed:
+            if p_idx not in underway:
+                arrays = {name: np.full(shape, np.nan if np.dtype(dtype).kind == 'f' else 0, dtype=dtype)
+                          for name, (shape, dtype) in ensemble_layout([param_sets[p_idx]], seeds).items()}
+                arrays['seconds'] = np.zeros(len(seeds))
+                underway[p_idx] = [arrays, 0]
+            arrays = underway[p_idx][0]
+            write_statistics(arrays, 0, s_idx, statistics)
+            arrays['seconds'][s_idx] = seconds
+            underway[p_idx][1] += 1
+            if underway[p_idx][1] == len(seeds):
+                del underway[p_idx]
+                yield p_idx, arrays
+
+
+def run_ensemble(param_sets, seeds, workers=None, runner=None, chunksize=None, model_kwargs=None, init_kwargs=None,
+                 cache=None):
+    """
+    Simulate every (parameter set, seed) pair on a process pool
+    :param param_sets: list of parameter dictionaries or ModelConfig objects
+    :param seeds: list of integer seeds
+    :param workers: integer number of worker processes, used if no runner is given
+    :param runner: object EnsembleRunner of which the pool is reused
+    :param chunksize: integer number of runs sent to a worker at once
+    :param model_kwargs: dictionary of keyword arguments of exuberance_inequality_model
+    :param init_kwargs: dictionary of keyword arguments of init_objects
+    :param cache: object SimulationCache of which cached runs are used and to which new runs are added
+    :return: dictionary of result arrays with a row per parameter set and a column per seed, see ensemble_layout
+    """
+    # invalid parameters fail here, before the pool is started
+    param_sets = [ModelConfig.from_dict(params) for params in param_sets]
+    if runner is not None:
+        return runner.run(param_sets, seeds, chunksize, model_kwargs, init_kwargs, cache)
+    with EnsembleRunner(workers) as runner:
+        return runner.run(param_sets, seeds, chunksize, model_kwargs, init_kwargs, cache)
+
+
+def stream_ensemble(param_sets, seeds, workers=None, runner=None, chunksize=1, model_kwargs=None, init_kwargs=None,
+                    cache=None):
+    """
+    Simulate every (parameter set, seed) pair on a process pool, and generate the results of every parameter set as
+    soon as all its seeds are simulated, see EnsembleRunner.stream
+    :param param_sets: list of parameter dictionaries or ModelConfig objects
+    :param seeds: list of integer seeds
+    :param workers: integer number of worker processes, used if no runner is given
+    :param runner: object EnsembleRunner of which the pool is reused
+    :param chunksize: integer number of runs sent to a worker at once
+    :param model_kwargs: dictionary of keyword arguments of exuberance_inequality_model
+    :param init_kwargs: dictionary of keyword arguments of init_objects
+    :param cache: object SimulationCache of which cached runs are used and to which new runs are added
+    :return: generator of tuples of the index of a parameter set and a dictionary of its result arrays
+    """
+    # invalid parameters fail here, before the pool is started
+    param_sets = [ModelConfig.from_dict(params) for params in param_sets]
+    if runner is not None:
+        for outcome in runner.stream(param_sets, seeds, chunksize, model_kwargs, init_kwargs, cache):
+            yield outcome
+        return
+    with EnsembleRunner(workers) as runner:
+        for outcome in runner.stream(param_sets, seeds, chunksize, model_kwargs, init_kwargs, cache):
+            yield outcome
+
+
+def reduce_ensemble(results, param_sets, window=20):
+    """
+    Average the results of an ensemble over seeds and ticks for every parameter set
+    :param results: dictionary of result arrays, see run_ensemble
+    :param param_sets: list of parameter dictionaries in the order in which they were simulated
+    :param window: integer window of the rolling volatility of returns
+    :return: dictionary of numpy arrays with an average per parameter set of the inequality series, profit and volatility
+    """
+    reduced = {name: np.zeros(len(param_sets)) for name in INEQUALITY_SERIES + ['profit', 'volatility']}
+    for p_idx, params in enumerate(param_sets):
+        periods = params['ticks'] - 1
+        for name in INEQUALITY_SERIES:
+            reduced[name][p_idx] = np.mean(results[name][p_idx, :, :periods])
+        reduced['profit'][p_idx] = np.mean(results['profit'][p_idx])
+        volatilities = []
+        for s_idx, length in enumerate(results['close_length'][p_idx]):
+            returns = pd.Series(results['close'][p_idx, s_idx, :length]).pct_change()
+            volatilities.append(returns.rolling(window).std(ddof=0))
+        reduced['volatility'][p_idx] = pd.DataFrame(volatilities).transpose().mean().mean()
+    return reduced
@@ -1,9 +1,12 @@
 import numpy as np
-from numpy import log, polyfit, sqrt, std, subtract
 import pandas as pd
 import math
+import scipy.optimize as sciopt
 import scipy.stats as stats
 
+# independent random number streams of a single run, see random_streams
+RANDOM_STREAMS = ['init', 'activation', 'noise', 'pricing']
+
 
 def calculate_covariance_matrix(historical_stock_returns, base_historical_variance):
     """
@@ -20,6 +23,16 @@ def calculate_covariance_matrix(historical_stock_returns, base_historical_varian
     return pd.DataFrame(covariances, index=assets, columns=assets)
 
 
+def covariance_matrix_from_variance(stock_variance):
+    """
+    Build the covariance matrix of stocks and a safe asset (money) from the variance of stock returns
+    :param stock_variance: float variance of stock returns
+    :return: DataFrame of the covariance matrix of stocks and money
+    """
+    assets = ['stocks', 'money']
+    return pd.DataFrame([[stock_variance, 0.], [0., 0.]], index=assets, columns=assets)
+
+
 def div0(numerator, denominator):
     """
     ignore / 0, and return 0 div0( [-1, 0, 1], 0 ) -> [0, 0, 0]
@@ -35,6 +48,18 @@ def div0(numerator, denominator):
     return answer
 
 
+def div0_array(numerator, denominator):
+    """
+    Element-wise version of div0, non-finite results are replaced by 0
+    :param numerator: np.Array numerator
+    :param denominator: np.Array denominator
+    :return: np.Array answer
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        answer = np.true_divide(numerator, denominator)
+    return np.where(np.isfinite(answer), answer, 0.)
+
+
 def div_by_hundred(x):
     """
     Divivde input by 100
@@ -78,22 +103,116 @@ def calculate_npv(dividends, discount_rates):
         return np.nan
 
 
+def lagged_products(x_spectrum, y_spectrum, n_fft, length, max_lag):
+    """
+    Sums of lagged products of the columns of two matrices, computed for all lags at once from their spectra
+    :param x_spectrum: np.rfft of a (T, runs) matrix x zero padded to n_fft rows
+    :param y_spectrum: np.rfft of a (T, runs) matrix y zero padded to n_fft rows
+    :param n_fft: integer, at least T + max_lag so that the products do not wrap around
+    :param length: integer T
+    :param max_lag: integer largest lag
+    :return: np.Array of shape (max_lag + 1, runs) with in row k the sums over t of x[t + k] * y[t]
+    """
+    products = np.fft.irfft(x_spectrum * np.conj(y_spectrum), n_fft, axis=0)
+    lagged = np.zeros((max_lag + 1,) + products.shape[1:])
+    lags = min(max_lag + 1, length)
+    lagged[:lags] = products[:lags]
+    return lagged
+
+
 def hurst(ts):
     """
     source: https://www.quantstart.com/articles/Basics-of-Statistical-Mean-Reversion-Testing
     Returns the Hurst Exponent of the time series vector ts
     """
-    # Create the range of lag values
-    lags = range(2, 100)
+    return hurst_exponents(ts)
 
-    # Calculate the array of the variances of the lagged differences
-    tau = [sqrt(std(subtract(ts[lag:], ts[:-lag]))) for lag in lags]
 
-    # Use a linear fit to estimate the Hurst Exponent
-    poly = polyfit(log(lags), log(tau), 1)
-
-    # Return the Hurst exponent from the polyfit output
-    return poly[0]*2.0
+def hurst_exponents(series, lags=range(2, 100)):
+    """
+    Hurst exponents estimated from the variances of lagged differences, for a batch of time series at once
+    :param series: np.Array or DataFrame of shape (T, runs), or a single time series
+    :param lags: list of lags of the differences
+    :return: np.Array of shape (runs,) of Hurst exponents, or a float for a single time series
+    """
+    x = np.asarray(series, dtype=np.float64)
+    single = x.ndim == 1
+    if single:
+        x = x[:, None]
+    lags = np.asarray(lags, dtype=np.int64)
+    length = x.shape[0]
+    max_lag = int(lags.max())
+    n_fft = 1 << int(np.ceil(np.log2(length + max_lag)))
+    # the differences do not change by centering, which keeps the sums of squares small
+    x = x - x.mean(axis=0)
+    spectrum = np.fft.rfft(x, n_fft, axis=0)
+    products = lagged_products(spectrum, spectrum, n_fft, length, max_lag)[lags]
+    sums = np.cumsum(np.concatenate([np.zeros((1, x.shape[1])), x]), axis=0)
+    squares = np.cumsum(np.concatenate([np.zeros((1, x.shape[1])), x ** 2]), axis=0)
+
+    # sums of the differences x[t + lag] - x[t] and of their squares
+    n = (length - lags)[:, None]
+    differences = (sums[-1] - sums[lags]) - sums[length - lags]
+    squared_differences = (squares[-1] - squares[lags]) + squares[length - lags] - 2 * products
+    variances = np.maximum(squared_differences / n - (differences / n) ** 2, 0.)
+    tau = np.sqrt(np.sqrt(variances))
+
+    poly = np.polyfit(np.log(lags), np.log(tau), 1)
+    exponents = poly[0] * 2.0
+    return exponents[0] if single else exponents
+
+
+def hurst_rs(prices, min_window=10, max_window=None):
+    """
+    Hurst exponents estimated with the simplified rescaled range of price series, for a batch of price series at once.
+    Gives the same results as hurst.compute_Hc(series, kind='price', simplified=True)
+    :param prices: np.Array or DataFrame of shape (T, runs), or a single price series, of at least 100 prices
+    :param min_window: integer minimal window size
+    :param max_window: integer maximal window size, default is the length of the series minus 1
+    :return: np.Array H of shape (runs,), np.Array c of shape (runs,) of the Hurst equation R/S = c * window ^ H
+    """
+    x = np.asarray(prices, dtype=np.float64)
+    single = x.ndim == 1
+    if single:
+        x = x[:, None]
+    length = x.shape[0]
+    if length < 100:
+        raise ValueError("Series length must be greater or equal to 100")
+    if np.isnan(x).any():
+        raise ValueError("Series contains NaNs")
+
+    max_window = max_window or length - 1
+    window_sizes = [int(10 ** exponent) for exponent in np.arange(math.log10(min_window), math.log10(max_window), 0.25)]
+    window_sizes.append(length)
+
+    # cumulative sums of the percentage changes are shared by all window sizes
+    pcts = x[1:] / x[:-1] - 1.
+    pcts = pcts - pcts.mean(axis=0)
+    sums = np.cumsum(np.concatenate([np.zeros((1, x.shape[1])), pcts]), axis=0)
+    squares = np.cumsum(np.concatenate([np.zeros((1, x.shape[1])), pcts ** 2]), axis=0)
+
+    rescaled_ranges = []
+    for window in window_sizes:
+        windows = length // window
+        chunks = x[:windows * window].reshape(windows, window, x.shape[1])
+        ranges = chunks.max(axis=1) / chunks.min(axis=1) - 1.
+        # the percentage changes within a window of prices
+        starts = np.arange(windows) * window
+        ends = starts + window - 1
+        total = sums[ends] - sums[starts]
+        variances = (squares[ends] - squares[starts] - total ** 2 / (window - 1)) / (window - 2)
+        deviations = np.sqrt(np.maximum(variances, 0.))
+        # windows with an undefined rescaled range are skipped
+        defined = (ranges != 0) & (deviations != 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rescaled_ranges.append(np.where(defined, ranges / deviations, 0.).sum(axis=0) / defined.sum(axis=0))
+
+    A = np.vstack([np.log10(window_sizes), np.ones(len(window_sizes))]).T
+    H, c = np.linalg.lstsq(A, np.log10(np.array(rescaled_ranges)), rcond=-1)[0]
+    c = 10 ** c
+    if single:
+        return H[0], c[0]
+    return H, c
 
 
 def organise_data(obs, burn_in_period=0):
@@ -103,38 +222,36 @@ def organise_data(obs, burn_in_period=0):
     :param burn_in_period: integer period of observations which is discarded
     :return: Pandas DataFrames of prices, returns, autocorrelation in returns, autocorr_abs_returns, volatility, volume, fundamentals
     """
+    # stylizedfacts imports from this module
+    from functions.stylizedfacts import autocorrelation_matrix, rolling_volatility_matrix
     window = 20
     close_price = []
     returns = []
-    autocorr_returns = []
-    autocorr_abs_returns = []
-    returns_volatility = []
     volume = []
     fundamentals = []
     for ob in obs:  # record
+        if getattr(ob, 'retention', 'full') == 'bounded':
+            # order books with bounded history only keep tick summaries and the initial close prices
+            tick_close_price = ob.close_prices()
+            tick_volumes = ob.tick_summaries()['volume'].tolist()
+        else:
+            tick_close_price = ob.tick_close_price
+            tick_volumes = [sum(volumes) for volumes in ob.transaction_volumes_history]
         # close price
-        close_price.append(ob.tick_close_price[burn_in_period:])
+        close_price.append(tick_close_price[burn_in_period:])
         # returns
-        r = pd.Series(np.array(ob.tick_close_price[burn_in_period:])).pct_change()
+        r = pd.Series(np.array(tick_close_price[burn_in_period:])).pct_change()
         returns.append(r)
-        # autocorrelation returns
-        ac_r = [r.autocorr(lag=lag) for lag in range(25)]
-        autocorr_returns.append(ac_r)
-        # autocorrelation absolute returns
-        absolute_returns = pd.Series(r).abs()
-        autocorr_abs_returns.append([absolute_returns.autocorr(lag=lag) for lag in range(25)])
-        # volatility of returns
-        roller_returns = r.rolling(window)
-        returns_volatility.append(roller_returns.std(ddof=0))
         # volume
-        volume.append([sum(volumes) for volumes in ob.transaction_volumes_history][burn_in_period:])
+        volume.append(tick_volumes[burn_in_period:])
         # fundamentals
         fundamentals.append(ob.fundamental[burn_in_period:])
     mc_prices = pd.DataFrame(close_price).transpose()
     mc_returns = pd.DataFrame(returns).transpose()
-    mc_autocorr_returns = pd.DataFrame(autocorr_returns).transpose()
-    mc_autocorr_abs_returns = pd.DataFrame(autocorr_abs_returns).transpose()
-    mc_volatility = pd.DataFrame(returns_volatility).transpose()
+    # autocorrelations and volatility of all runs at once, runs shorter than the longest run are padded with nan
+    mc_autocorr_returns = pd.DataFrame(autocorrelation_matrix(mc_returns.values, range(25)))
+    mc_autocorr_abs_returns = pd.DataFrame(autocorrelation_matrix(mc_returns.abs().values, range(25)))
+    mc_volatility = pd.DataFrame(rolling_volatility_matrix(mc_returns.values, window), index=mc_returns.index)
     mc_volume = pd.DataFrame(volume).transpose()
     mc_fundamentals = pd.DataFrame(fundamentals).transpose()
 
@@ -164,6 +281,34 @@ def confidence_interval(data, av):
     return stats.t.interval(alpha = 0.95, df= 24, loc=av, scale=sigma)
 
 
+def random_streams(seed):
+    """
+    Independent random number generators for every component of a single run, spawned from one
+    np.random.SeedSequence so that results do not depend on the order in which components draw numbers
+    :param seed: integer seed of the run
+    :return: dictionary of component name (RANDOM_STREAMS) to np.random.Generator
+    """
+    children = np.random.SeedSequence(seed).spawn(len(RANDOM_STREAMS))
+    return {name: np.random.default_rng(child) for name, child in zip(RANDOM_STREAMS, children)}
+
+
+def draw_random_blocks(streams, ticks, n_traders, sample_size):
+    """
+    Draw the active traders, expectation noise and price shocks of all ticks of a run up front
+    :param streams: dictionary of np.random.Generator per component, see random_streams
+    :param ticks: integer number of ticks
+    :param n_traders: integer number of traders
+    :param sample_size: integer number of active traders per tick
+    :return: np.Arrays of shape (ticks, sample_size) of active trader indices, standard normal noise and standard
+    normal price shocks
+    """
+    active = np.array([streams['activation'].choice(n_traders, sample_size, replace=False) for tick in range(ticks)],
+                      dtype=np.int64).reshape(ticks, sample_size)
+    noise = streams['noise'].standard_normal((ticks, sample_size))
+    price_shocks = streams['pricing'].standard_normal((ticks, sample_size))
+    return active, noise, price_shocks
+
+
 def ornstein_uhlenbeck_evolve(init_level, previous_level, sigma, mean_reversion, seed):
     fundamental_value = [previous_level]
 
@@ -189,3 +334,33 @@ def quadratic_loss_function(m_sim, m_emp, weights):
         return np.inf
     else:
         return score
+
+
+def quadratic_loss_lower_bound(m_sim, standard_errors, m_emp, weights, z=2.0):
+    """
+    Lower confidence bound of the quadratic loss: the lowest loss of any moments within z standard errors of the
+    simulated moments. With a weighting matrix which is not diagonal, moving every moment towards its observed value
+    does not give the lowest loss, so the loss is minimized over the box of moments as a bounded quadratic program.
+    :param m_sim: np.Array of simulated moments
+    :param standard_errors: np.Array of standard errors of the simulated moments
+    :param m_emp: np.Array of observed moments
+    :param weights: np.Array positive semi-definite weighting matrix
+    :param z: float number of standard errors
+    :return: float lower bound of the loss, inf if the simulated moments or their standard errors are not finite
+    """
+    m_sim, m_emp = np.asarray(m_sim, dtype=np.float64), np.asarray(m_emp, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    lower = m_sim - z * np.asarray(standard_errors, dtype=np.float64)
+    upper = m_sim + z * np.asarray(standard_errors, dtype=np.float64)
+    if not (np.isfinite(lower).all() and np.isfinite(upper).all()):
+        return np.inf
+    # the loss is the squared norm of root @ (moments - m_emp), so minimizing it over the box is a bounded linear
+    # least squares problem, which the bounded-variable least squares method solves exactly
+    eigenvalues, eigenvectors = np.linalg.eigh((weights + weights.T) / 2.)
+    root = np.sqrt(np.maximum(eigenvalues, 0.))[:, None] * eigenvectors.T
+    # moments without a standard error are fixed at their simulated value
+    moments, free = m_sim.copy(), lower < upper
+    if free.any():
+        target = root @ m_emp - root[:, ~free] @ m_sim[~free]
+        moments[free] = sciopt.lsq_linear(root[:, free], target, bounds=(lower[free], upper[free]), method='bvls').x
+    return quadratic_loss_function(moments, m_emp, weights)
@@ -1,6 +1,7 @@
 from model import *
 from init_objects import init_objects
 from functions.helpers import organise_data, quadratic_loss_function
+from objects.config import ModelConfig
 
 
 def model_performance(input_parameters):
@@ -22,6 +23,7 @@ def model_performance(input_parameters):
               'strat_share_chartists': 0.0, 'mutation_intensity': 0.0, 'average_learning_ability': 0.0,
               'trades_per_tick': 1}
     params.update(uncertain_parameters)
+    params = ModelConfig.from_dict(params)
 
     empirical_moments = np.array([0.00283408, 0.03613833, 0.00952201])
 
@@ -79,9 +81,12 @@ def model_performance(input_parameters):
 # ===========================================================================================================================================================================
 
 # Numpy/Scipy
+import functools
 import numpy as np
 import scipy.optimize as sciopt
 
+from functions.surrogate import GaussianProcess, propose_batch
+
 
 # ===========================================================================================================================================================================
 # Module Functions
@@ -108,22 +113,7 @@ def constrNM(func, x0, LB, UB, args=(), xtol=0.0001, ftol=0.0001, maxiter=None,
         callback(callable) : Called after each iteration, as ``callback(xk)``, where xk is the current parameter vector.
     """
 
-    # Check input
-    if len(LB) != len(UB) or len(LB) != len(x0):
-        raise ValueError('Input arrays have unequal size.')
-
-    # Check if x0 is within bounds
-    for i, x in enumerate(x0):
-
-        if LB[i] is not None:
-            if x < LB[i]:
-                errStr = 'Initial guess x0[' + str(i) + ']=' + str(x) + ' out of bounds.'
-                raise ValueError(errStr)
-
-        if UB[i] is not None:
-            if x > UB[i]:
-                errStr = 'Initial guess x0[' + str(i) + ']=' + str(x) + ' out of bounds.'
-                raise ValueError(errStr)
+    checkBounds(x0, LB, UB)
 
     # Transform x0
     x0 = transformX0(x0, LB, UB)
@@ -165,6 +155,444 @@ def constrNM(func, x0, LB, UB, args=(), xtol=0.0001, ftol=0.0001, maxiter=None,
     return rDict
 
 
+def parallelConstrNM(func, x0, LB, UB, args=(), xtol=0.0001, ftol=0.0001, maxiter=None, maxfun=None, full_output=0,
+                     disp=0, retall=0, callback=None, pool=None, batch=False, speculative=True, thresholds=False):
+    """Constrained Nelder-Mead optimizer which evaluates points of the simplex concurrently.
+    Follows the same path as :py:func:`constrNM`, but evaluates the initial simplex, the points of a shrink step and,
+    if ``speculative``, the reflection, expansion and both contraction points of an iteration as one batch.
+    Args:
+        func (function): Objective function.
+        x0 (numpy.ndarray): Initial guess.
+        LB (numpy.ndarray): Lower bounds.
+        UB (numpy.ndarray): Upper bounds.
+    Keyword Args:
+        args (tuple): Extra arguments passed to func, i.e. ``func(x,*args).``
+        xtol (float) :Absolute error in xopt between iterations that is acceptable for convergence.
+        ftol(float) : Absolute error in ``func(xopt)`` between iterations that is acceptable for convergence.
+        maxiter(int) : Maximum number of iterations to perform.
+        maxfun(int) : Maximum number of function evaluations that a sequential Nelder-Mead would make.
+        full_output(bool) : Set to True if fopt and warnflag outputs are desired.
+        disp(bool) : Set to True to print convergence messages.
+        retall(bool): Set to True to return list of solutions at each iteration.
+        callback(callable) : Called after each iteration, as ``callback(xk)``, where xk is the current parameter vector.
+        pool (multiprocessing.Pool): Pool of which the map evaluates a batch, func must be picklable.
+        batch (bool): Set to True if func evaluates a list of parameter vectors, i.e. ``func([x1, x2],*args)``.
+        speculative (bool): Set to False to only evaluate the points that a sequential Nelder-Mead would evaluate.
+        thresholds (bool): Set to True if func, which evaluates a batch, also takes a list with for every point the
+            value of the worst vertex of the simplex, i.e. ``func([x1, x2], [t1, t2],*args)``. If the value of a point
+            exceeds its threshold, it only needs to be known to do so: func may return any value of at least the
+            threshold, such as a censored value of an evaluation that was stopped early. Points of which the exact
+            value is needed have an infinite threshold.
+    Returns:
+        dict: Results as returned by :py:func:`constrNM`, funcalls counts all evaluations.
+    """
+    return multistartConstrNM(func, [x0], LB, UB, args=args, xtol=xtol, ftol=ftol, maxiter=maxiter, maxfun=maxfun,
+                              full_output=full_output, disp=disp, retall=retall, callback=callback, pool=pool,
+                              batch=batch, speculative=speculative, thresholds=thresholds)[0]
+
+
+def multistartConstrNM(func, starts, LB, UB, args=(), xtol=0.0001, ftol=0.0001, maxiter=None, maxfun=None,
+                       full_output=0, disp=0, retall=0, callback=None, pool=None, batch=False, speculative=True,
+                       thresholds=False):
+    """Runs a constrained Nelder-Mead optimization from every starting point at the same time.
+    The points that all optimizations need to evaluate next are evaluated as one batch.
+    Args:
+        func (function): Objective function.
+        starts (list): Initial guesses.
+        LB (numpy.ndarray): Lower bounds.
+        UB (numpy.ndarray): Upper bounds.
+    Keyword Args:
+        See :py:func:`parallelConstrNM`, ``callback`` is called as ``callback(xk, start)`` with the index of the
+        starting point.
+    Returns:
+        list: Result dictionaries as returned by :py:func:`constrNM` for every starting point.
+    """
+
+    for x0 in starts:
+        checkBounds(x0, LB, UB)
+
+    evaluate = batchEvaluator(func, args, pool, batch, thresholds)
+
+    def iterationCallback(start):
+        if callback is None:
+            return None
+        if len(starts) > 1:
+            return lambda xk: callback(transformX(xk, LB, UB), start)
+        return lambda xk: callback(transformX(xk, LB, UB))
+
+    searches = [simplexSearch(transformX0(x0, LB, UB), xtol, ftol, maxiter, maxfun, speculative, iterationCallback(i))
+                for i, x0 in enumerate(starts)]
+
+    # Points that every search waits for
+    pending = {}
+    results = {}
+    for i, search in enumerate(searches):
+        try:
+            pending[i] = next(search)
+        except StopIteration as stop:
+            results[i] = stop.value
+
+    while pending:
+        order = sorted(pending)
+        points = [transformX(x, LB, UB) for i in order for x in pending[i][0]]
+        worst = [pending[i][1] for i in order for x in pending[i][0]]
+        values = list(evaluate(points, worst))
+        position = 0
+        for i in order:
+            n = len(pending[i][0])
+            try:
+                pending[i] = searches[i].send(values[position:position + n])
+            except StopIteration as stop:
+                del pending[i]
+                results[i] = stop.value
+            position += n
+
+    rDicts = []
+    for i in range(len(starts)):
+        res = results[i]
+        rDict = {'fopt': None, 'iter': None, 'funcalls': None, 'warnflag': None, 'xopt': transformX(res['xopt'], LB, UB),
+                 'allvecs': None}
+        if full_output:
+            for k in ['fopt', 'iter', 'funcalls', 'warnflag']:
+                rDict[k] = res[k]
+        if retall:
+            rDict['allvecs'] = [transformX(r, LB, UB) for r in res['allvecs']]
+        if disp:
+            messages = ['Optimization terminated successfully.',
+                        'Maximum number of function evaluations has been exceeded.',
+                        'Maximum number of iterations has been exceeded.']
+            print(messages[res['warnflag']])
+            print("         Current function value: %f" % res['fopt'])
+            print("         Iterations: %d" % res['iter'])
+            print("         Function evaluations: %d" % res['funcalls'])
+        rDicts.append(rDict)
+
+    return rDicts
+
+
+def surrogateCalibration(func, design, LB, UB, args=(), maxfun=40, batch_size=4, maxiter=None, eitol=0.0,
+                         log_transform=True, candidates=2000, seed=0, full_output=0, disp=0, retall=0,
+                         callback=None, pool=None, batch=False):
+    """Surrogate-assisted optimizer, which emulates the objective function with a Gaussian process.
+    The points of the design are evaluated first. Every iteration, the Gaussian process is fitted to all values so far
+    and a batch of points which maximize the expected improvement is proposed and evaluated at the same time. Given
+    the values of the evaluations, the proposals are deterministic.
+    Args:
+        func (function): Objective function.
+        design (list): Initial points, such as a latin hypercube sample within the bounds.
+        LB (numpy.ndarray): Lower bounds.
+        UB (numpy.ndarray): Upper bounds.
+    Keyword Args:
+        args (tuple): Extra arguments passed to func, i.e. ``func(x,*args).``
+        maxfun(int) : Maximum number of function evaluations to make, including the design.
+        batch_size(int) : Number of points proposed and evaluated per iteration.
+        maxiter(int) : Maximum number of iterations to perform.
+        eitol(float) : Stop when the largest expected improvement of a batch is not above this value.
+        log_transform(bool) : Set to True to emulate the logarithm of the objective function above its lowest value.
+        candidates(int) : Number of random candidate points over which the expected improvement is maximized.
+        seed(int) : Seed of the candidate points and of the fit of the Gaussian process.
+        full_output(bool) : Set to True if fopt and warnflag outputs are desired.
+        disp(bool) : Set to True to print convergence messages.
+        retall(bool): Set to True to return list of best points at each iteration.
+        callback(callable) : Called after each iteration, as ``callback(xk)``, where xk is the best point so far.
+        pool (multiprocessing.Pool): Pool of which the map evaluates a batch, func must be picklable.
+        batch (bool): Set to True if func evaluates a list of parameter vectors, i.e. ``func([x1, x2],*args)``.
+    Returns:
+        dict: Results as returned by :py:func:`constrNM`. xopt is the evaluated point with the lowest value emulated by
+            the Gaussian process and fopt its evaluated value, warnflag is 0 if the expected improvement fell to
+            eitol, 1 if maxfun and 2 if maxiter was reached.
+    """
+
+    for x0 in design:
+        checkBounds(x0, LB, UB)
+
+    LB, UB = np.asarray(LB, dtype=np.float64), np.asarray(UB, dtype=np.float64)
+    evaluate = batchEvaluator(func, args, pool, batch)
+    rng = np.random.default_rng(seed)
+
+    X = np.array([np.asarray(x0, dtype=np.float64) for x0 in design])
+    y = np.array(evaluate(list(X), [np.inf] * len(X)), dtype=np.float64)
+    allvecs = []
+    iterations = 0
+
+    while True:
+        # the best point is the evaluated point with the lowest emulated value, since the lowest evaluated value of a
+        # noisy function is biased towards lucky evaluations
+        unit = (X - LB) / (UB - LB)
+        finite = np.isfinite(y)
+        gp = None
+        if finite.any():
+            # values of diverged simulations are emulated as the worst finite value
+            observed = np.where(finite, y, np.max(y[finite]))
+            if log_transform:
+                # the logarithm of the values above a little less than the lowest value, a hundredth of the range of
+                # the values, so that a value of zero or below does not dominate the fit
+                spread = np.max(observed) - np.min(observed)
+                observed = np.log(observed - np.min(observed) + (0.01 * spread if spread > 0 else 1.))
+            gp = GaussianProcess(seed=seed).fit(unit, observed)
+            best = int(np.argmin(gp.predict(unit)[0]))
+        else:
+            best = 0
+        allvecs.append(X[best])
+        if iterations > 0 and callback is not None:
+            callback(allvecs[-1])
+
+        if len(y) >= maxfun:
+            warnflag = 1
+            break
+        if maxiter is not None and iterations >= maxiter:
+            warnflag = 2
+            break
+
+        size = min(batch_size, maxfun - len(y))
+        if gp is None:
+            # nothing is known yet if no evaluation was finite
+            proposals = rng.random((size, len(LB)))
+        else:
+            proposals, improvements = propose_batch(gp, unit, observed, size, candidates=candidates, rng=rng)
+            if np.max(improvements) <= eitol:
+                warnflag = 0
+                break
+
+        points = LB + proposals * (UB - LB)
+        values = np.array(evaluate(list(points), [np.inf] * len(points)), dtype=np.float64)
+        X = np.vstack([X, points])
+        y = np.append(y, values)
+        iterations += 1
+
+    rDict = {'fopt': None, 'iter': None, 'funcalls': None, 'warnflag': None, 'xopt': X[best], 'allvecs': None}
+    if full_output:
+        rDict['fopt'] = y[best]
+        rDict['iter'] = iterations
+        rDict['funcalls'] = len(y)
+        rDict['warnflag'] = warnflag
+    if retall:
+        rDict['allvecs'] = allvecs
+    if disp:
+        messages = ['Optimization terminated successfully.',
+                    'Maximum number of function evaluations has been exceeded.',
+                    'Maximum number of iterations has been exceeded.']
+        print(messages[warnflag])
+        print("         Current function value: %f" % y[best])
+        print("         Iterations: %d" % iterations)
+        print("         Function evaluations: %d" % len(y))
+
+    return rDict
+
+
+def simplexSearch(x0, xtol, ftol, maxiter, maxfun, speculative, callback=None):
+    """Nelder-Mead search with the coefficients and initial simplex of ``scipy.optimize.fmin``.
+    A generator which yields lists of points it needs evaluated, together with the value above which their exact
+    values are not needed, and is sent lists of their function values.
+    Args:
+        x0 (numpy.ndarray): Initial guess.
+        xtol (float) :Absolute error in xopt between iterations that is acceptable for convergence.
+        ftol(float) : Absolute error in ``func(xopt)`` between iterations that is acceptable for convergence.
+        maxiter(int) : Maximum number of iterations to perform.
+        maxfun(int) : Maximum number of function evaluations of a sequential Nelder-Mead.
+        speculative (bool): Ask for the reflection, expansion and contraction points at once.
+    Keyword Args:
+        callback(callable) : Called after each iteration, as ``callback(xk)``, where xk is the current point.
+    Returns:
+        dict: xopt, fopt, iter, funcalls, warnflag and allvecs.
+    """
+
+    rho, chi, psi, sigma = 1, 2, 0.5, 0.5
+    nonzdelt, zdelt = 0.05, 0.00025
+
+    x0 = np.asarray(x0, dtype=np.float64).flatten()
+    N = len(x0)
+    if maxiter is None and maxfun is None:
+        maxiter = maxfun = N * 200
+    elif maxiter is None:
+        maxiter = N * 200 if maxfun == np.inf else np.inf
+    elif maxfun is None:
+        maxfun = N * 200 if maxiter == np.inf else np.inf
+
+    sim = np.empty((N + 1, N), dtype=x0.dtype)
+    sim[0] = x0
+    for k in range(N):
+        y = np.array(x0, copy=True)
+        if y[k] != 0:
+            y[k] = (1 + nonzdelt) * y[k]
+        else:
+            y[k] = zdelt
+        sim[k + 1] = y
+
+    # like fmin, only the first maxfun vertices are evaluated, the others keep an infinite value
+    evaluations = int(min(N + 1, maxfun))
+    fsim = np.full(N + 1, np.inf, dtype=np.float64)
+    if evaluations > 0:
+        fsim[:evaluations] = yield list(sim[:evaluations]), np.inf
+    # sequential counts the evaluations a sequential Nelder-Mead makes, funcalls all evaluations
+    sequential = funcalls = evaluations
+    allvecs = [x0]
+    ind = np.argsort(fsim)
+    sim = np.take(sim, ind, 0)
+    fsim = np.take(fsim, ind, 0)
+
+    iterations = 1
+    while sequential < maxfun and iterations < maxiter:
+        if (np.max(np.ravel(np.abs(sim[1:] - sim[0]))) <= xtol and
+                np.max(np.abs(fsim[0] - fsim[1:])) <= ftol):
+            break
+
+        xbar = np.add.reduce(sim[:-1], 0) / N
+        xr = (1 + rho) * xbar - rho * sim[-1]
+        xe = (1 + rho * chi) * xbar - rho * chi * sim[-1]
+        xc = (1 + psi * rho) * xbar - psi * rho * sim[-1]
+        xcc = (1 - psi) * xbar + psi * sim[-1]
+
+        if speculative:
+            fxr, fxe, fxc, fxcc = yield [xr, xe, xc, xcc], fsim[-1]
+            funcalls += 4
+            speculate = True
+        else:
+            fxr, = yield [xr], fsim[-1]
+            funcalls += 1
+            speculate = False
+        sequential += 1
+
+        # like fmin, an iteration is abandoned when it would exceed maxfun
+        completed = True
+        if fxr < fsim[0]:
+            if sequential >= maxfun:
+                completed = False
+            else:
+                if not speculate:
+                    fxe, = yield [xe], fsim[-1]
+                    funcalls += 1
+                sequential += 1
+                if fxe < fxr:
+                    sim[-1] = xe
+                    fsim[-1] = fxe
+                else:
+                    sim[-1] = xr
+                    fsim[-1] = fxr
+        elif fxr < fsim[-2]:
+            sim[-1] = xr
+            fsim[-1] = fxr
+        elif sequential >= maxfun:
+            completed = False
+        else:
+            doshrink = 0
+            # Perform contraction
+            if fxr < fsim[-1]:
+                if not speculate:
+                    fxc, = yield [xc], fsim[-1]
+                    funcalls += 1
+                sequential += 1
+                if fxc <= fxr:
+                    sim[-1] = xc
+                    fsim[-1] = fxc
+                else:
+                    doshrink = 1
+            else:
+                # Perform an inside contraction
+                if not speculate:
+                    fxcc, = yield [xcc], fsim[-1]
+                    funcalls += 1
+                sequential += 1
+                if fxcc < fsim[-1]:
+                    sim[-1] = xcc
+                    fsim[-1] = fxcc
+                else:
+                    doshrink = 1
+
+            if doshrink:
+                # fmin shrinks the vertices one by one, and stops after shrinking the first vertex it may not evaluate
+                evaluations = int(min(N, maxfun - sequential))
+                shrunk = min(N, evaluations + 1)
+                sim[1:shrunk + 1] = sim[0] + sigma * (sim[1:shrunk + 1] - sim[0])
+                if evaluations > 0:
+                    fsim[1:evaluations + 1] = yield list(sim[1:evaluations + 1]), np.inf
+                funcalls += evaluations
+                sequential += evaluations
+                completed = evaluations == N
+
+        if completed:
+            iterations += 1
+        ind = np.argsort(fsim)
+        sim = np.take(sim, ind, 0)
+        fsim = np.take(fsim, ind, 0)
+        allvecs.append(sim[0])
+        if callback is not None:
+            callback(sim[0])
+
+    if sequential >= maxfun:
+        warnflag = 1
+    elif iterations >= maxiter:
+        warnflag = 2
+    else:
+        warnflag = 0
+
+    return {'xopt': sim[0], 'fopt': np.min(fsim), 'iter': iterations, 'funcalls': funcalls, 'warnflag': warnflag,
+            'allvecs': allvecs}
+
+
+def batchEvaluator(func, args=(), pool=None, batch=False, thresholds=False):
+    """Returns a function which evaluates a list of parameter vectors, given their thresholds.
+    Args:
+        func (function): Objective function.
+    Keyword Args:
+        args (tuple): Extra arguments passed to func.
+        pool (multiprocessing.Pool): Pool of which the map evaluates the parameter vectors.
+        batch (bool): Set to True if func evaluates a list of parameter vectors itself.
+        thresholds (bool): Set to True if func, which evaluates a batch, also takes a list of thresholds.
+    Returns:
+        function: Evaluates a list of parameter vectors and a list of thresholds and returns a list of function values.
+    """
+
+    if thresholds and not batch:
+        raise ValueError('Thresholds are only passed to an objective function which evaluates a batch.')
+    if thresholds:
+        return lambda points, worst: func(points, worst, *args)
+    if batch:
+        return lambda points, worst: func(points, *args)
+    if pool is not None:
+        return lambda points, worst: pool.map(functools.partial(evaluatePoint, func=func, args=args), points)
+    return lambda points, worst: [func(x, *args) for x in points]
+
+
+def evaluatePoint(x, func, args):
+    """Calls ``func(x,*args)``, a picklable function to map over parameter vectors.
+    Args:
+        x (numpy.ndarray): Input vector.
+        func (function): Objective function.
+        args (tuple): Extra arguments passed to func.
+    Returns:
+         float: Return value of ``func(x,*args)``.
+    """
+
+    return func(x, *args)
+
+
+def checkBounds(x0, LB, UB):
+    """Checks that the initial guess ``x0`` has a bound for every parameter and is within the bounds.
+    Args:
+        x0 (numpy.ndarray): Initial guess.
+        LB (numpy.ndarray): Lower bounds.
+        UB (numpy.ndarray): Upper bounds.
+    """
+
+    # Check input
+    if len(LB) != len(UB) or len(LB) != len(x0):
+        raise ValueError('Input arrays have unequal size.')
+
+    # Check if x0 is within bounds
+    for i, x in enumerate(x0):
+
+        if LB[i] is not None:
+            if x < LB[i]:
+                errStr = 'Initial guess x0[' + str(i) + ']=' + str(x) + ' out of bounds.'
+                raise ValueError(errStr)
+
+        if UB[i] is not None:
+            if x > UB[i]:
+                errStr = 'Initial guess x0[' + str(i) + ']=' + str(x) + ' out of bounds.'
+                raise ValueError(errStr)
+
+
 def constrObjFunc(x, func, LB, UB, args):
     r"""Objective function when using Constrained Nelder-Mead.
     Calls :py:func:`TransformX` to transform ``x`` into
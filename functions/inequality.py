@@ -26,3 +26,91 @@ def gini(array):
     gini_coefficient = ((np.sum((2 * index - n - 1) * array)) / (n * np.sum(array)))
 
     return gini_coefficient
+
+
+def sorted_inequality(sorted_wealth, top_shares=(0.01, 0.1), bottom_share=0.4):
+    """
+    Calculate inequality measures of wealth distributions which are already sorted in ascending order.
+    The Gini coefficient and Theil index are calculated like gini, on wealth shifted to be non-negative and slightly
+    offset from 0. Wealth shares and the Palma ratio (share of the top 10% over the share of the bottom 40%) use the
+    unshifted wealth.
+    :param sorted_wealth: numpy array of shape (..., n_traders) with wealth sorted in ascending order along the last axis
+    :param top_shares: tuple of fractions of the richest traders of which the wealth share is calculated
+    :param bottom_share: fraction of the poorest traders of which the wealth share is calculated
+    :return: dictionary with arrays of shape (...) of the gini, theil, palma, top_<percentage> and bottom_<percentage>
+    """
+    sorted_wealth = np.asarray(sorted_wealth, dtype=np.float64)
+    n = sorted_wealth.shape[-1]
+    total = sorted_wealth.sum(axis=-1)
+    cumulative = np.cumsum(sorted_wealth, axis=-1)
+
+    def share_above(idx):
+        return (total - (cumulative[..., idx - 1] if idx > 0 else 0.0)) / total
+
+    def share_below(idx):
+        return (cumulative[..., idx - 1] if idx > 0 else np.zeros_like(total)) / total
+
+    measures = {}
+    for share in top_shares:
+        measures['top_{:g}'.format(share * 100)] = share_above(int(n * (1 - share)))
+    measures['bottom_{:g}'.format(bottom_share * 100)] = share_below(int(n * bottom_share))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        measures['palma'] = share_above(int(n * 0.9)) / share_below(int(n * 0.4))
+
+    # the minimum is the first value, shifting keeps the order intact
+    minimum = sorted_wealth[..., :1]
+    if np.any(minimum < 0):
+        print('Negative values founds, check calculation')
+    shifted = np.where(minimum < 0, sorted_wealth - minimum, sorted_wealth) + 0.0000001
+    shifted_total = shifted.sum(axis=-1)
+    index = np.arange(1, n + 1)
+    measures['gini'] = np.sum((2 * index - n - 1) * shifted, axis=-1) / (n * shifted_total)
+    relative = shifted / (shifted_total[..., None] / n)
+    measures['theil'] = np.mean(relative * np.log(relative), axis=-1)
+    return measures
+
+
+def inequality_panel(wealth, top_shares=(0.01, 0.1), bottom_share=0.4):
+    """
+    Calculate inequality measures for every row of a wealth panel, sorting every row only once
+    :param wealth: numpy array of shape (ticks, n_traders)
+    :param top_shares: tuple of fractions of the richest traders of which the wealth share is calculated
+    :param bottom_share: fraction of the poorest traders of which the wealth share is calculated
+    :return: dictionary with arrays of shape (ticks,) of the gini, theil, palma, top_<percentage> and bottom_<percentage>
+    """
+    return sorted_inequality(np.sort(wealth, axis=-1), top_shares, bottom_share)
+
+
+class IncrementalInequality:
+    """
+    Calculates inequality measures tick by tick from the rank order of a WealthRanking. Wealth ranks change little
+    from one tick to the next, so the ranking re-ranks the previous order with a stable sort, which is close to linear
+    on nearly sorted data.
+    """
+    def __init__(self, ranking, top_shares=(0.01, 0.1), bottom_share=0.4):
+        """
+        Initialize the measures
+        :param ranking: object WealthRanking of the traders
+        :param top_shares: tuple of fractions of the richest traders of which the wealth share is calculated
+        :param bottom_share: fraction of the poorest traders of which the wealth share is calculated
+        """
+        self.ranking = ranking
+        self.top_shares = top_shares
+        self.bottom_share = bottom_share
+
+    def update(self, wealth=None):
+        """
+        Calculate the inequality measures of the current tick
+        :param wealth: numpy array of shape (n_traders,) of the wealth of every trader, or None for the latest wealth
+        of the traders of the ranking
+        :return: dictionary of float gini, theil, palma, top_<percentage> and bottom_<percentage>
+        """
+        if wealth is None:
+            order = self.ranking.indices()
+            wealth = self.ranking.wealth()
+        else:
+            wealth = np.asarray(wealth, dtype=np.float64)
+            order = self.ranking.rerank(wealth)
+        # the ranking is from the richest to the poorest trader
+        measures = sorted_inequality(wealth[order[::-1]], self.top_shares, self.bottom_share)
+        return {name: float(value) for name, value in measures.items()}
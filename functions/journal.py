@@ -0,0 +1,107 @@
+"""Append-only journal of evaluations, from which interrupted calibration and sensitivity jobs are resumed"""
+
+import hashlib
+import json
+import os
+import time
+
+from functions.cache import json_default
+from model import MODEL_VERSION
+from objects.config import ModelConfig
+
+
+class EvaluationJournal:
+    """
+    Records every completed evaluation, a parameter set simulated for a list of seeds, as a line of json which is
+    appended to a file together with its cost, moments and timings. A job which is restarted with the same journal
+    replays the recorded evaluations instead of simulating them again. Since the Nelder-Mead calibration and the eFAST
+    sweep are deterministic given the values of their evaluations, replaying brings them back to the state in which
+    they were interrupted.
+    """
+    def __init__(self, path):
+        """
+        Open a journal and read the evaluations recorded in it
+        :param path: string file name of the journal, which is created if it does not exist
+        """
+        self.path = path
+        self.entries = {}
+        self.load()
+
+    def key(self, params, seeds, **options):
+        """
+        Stable hash of an evaluation
+        :param params: dictionary of parameters or ModelConfig, which is validated and completed with defaults
+        :param seeds: list of integer seeds
+        :param options: further keyword arguments which change the outcome of the evaluation
+        :return: string hexadecimal sha256 hash
+        """
+        evaluation = {'params': ModelConfig.from_dict(params).to_dict(), 'seeds': list(seeds),
+                      'model_version': MODEL_VERSION, 'options': options}
+        encoded = json.dumps(evaluation, sort_keys=True, default=json_default)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def load(self):
+        """
+        Read the recorded evaluations, a last line which was cut off by a crash is removed
+        :return: None
+        """
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        complete = content.rfind(b'\n') + 1
+        if complete < len(content):
+            with open(self.path, 'r+b') as f:
+                f.truncate(complete)
+        for line in content[:complete].splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line.decode())
+            self.entries[entry['key']] = entry
+
+    def get(self, key):
+        """
+        :param key: string hash of the evaluation
+        :return: dictionary of the recorded evaluation, or None if it has not been recorded
+        """
+        return self.entries.get(key)
+
+    def replayable(self, key, threshold=float('inf')):
+        """
+        Whether an evaluation can be replayed instead of evaluated again. A censored cost, of which the simulations were
+        stopped early because it exceeded its threshold, is only known to exceed that threshold, so it can only be
+        replayed when it is asked for at a threshold that is not above it.
+        :param key: string hash of the evaluation
+        :param threshold: float cost above which the exact cost is not needed
+        :return: True if the evaluation is recorded with a cost that answers the threshold
+        """
+        entry = self.get(key)
+        return entry is not None and (not entry.get('censored') or entry['threshold'] >= threshold)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, key, params, seeds, **outcomes):
+        """
+        Append an evaluation to the journal, it is on disk when this returns
+        :param key: string hash of the evaluation
+        :param params: dictionary of parameters or ModelConfig
+        :param seeds: list of integer seeds
+        :param outcomes: json serializable outcomes of the evaluation such as cost, moments and seconds
+        :return: dictionary of the recorded evaluation
+        """
+        entry = {'key': key, 'params': ModelConfig.from_dict(params).to_dict(), 'seeds': list(seeds),
+                 'recorded': time.time()}
+        entry.update(outcomes)
+        # round trip through json, so that recorded and replayed evaluations are the same
+        line = json.dumps(entry, default=json_default)
+        with open(self.path, 'a') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.entries[key] = json.loads(line)
+        return self.entries[key]
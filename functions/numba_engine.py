@@ -0,0 +1,431 @@
+"""Compiled version of the exuberance inequality model which runs the tick loop over flat arrays with numba"""
+import random
+import numpy as np
+
+from objects.orderbook import Order
+from functions.helpers import draw_random_blocks, random_streams
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def jit(func):
+    """
+    Compile a function in nopython mode if numba is installed
+    :param func: function to compile
+    :return: compiled function, or the function itself if numba is not available
+    """
+    if numba is None:
+        return func
+    return numba.njit(cache=True, error_model='numpy')(func)
+
+
+@jit
+def _insert(book, n, order_prices, order_id, left):
+    """
+    Insert an order id in a price sorted book, before (left) or after (right) orders with the same price
+    :return: integer new number of orders in the book
+    """
+    price = order_prices[order_id]
+    lo = 0
+    hi = n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if left:
+            if order_prices[book[mid]] < price:
+                lo = mid + 1
+            else:
+                hi = mid
+        else:
+            if price < order_prices[book[mid]]:
+                hi = mid
+            else:
+                lo = mid + 1
+    for k in range(n, lo, -1):
+        book[k] = book[k - 1]
+    book[lo] = order_id
+    return n + 1
+
+
+@jit
+def _delete(book, n, idx):
+    """
+    Delete the order at position idx of a book
+    :return: integer new number of orders in the book
+    """
+    for k in range(idx, n - 1):
+        book[k] = book[k + 1]
+    return n - 1
+
+
+@jit
+def _cancel(book, n, order_prices, in_book, order_id):
+    """
+    Remove an order from a price sorted book if it is still in there
+    :return: integer new number of orders in the book
+    """
+    if not in_book[order_id]:
+        return n
+    price = order_prices[order_id]
+    lo = 0
+    hi = n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if order_prices[book[mid]] < price:
+            lo = mid + 1
+        else:
+            hi = mid
+    for idx in range(lo, n):
+        if book[idx] == order_id:
+            in_book[order_id] = False
+            return _delete(book, n, idx)
+    return n
+
+
+@jit
+def simulate_arrays(weight_fundamentalist, weight_chartist, weight_random, horizons, risk_aversions, spreads,
+                    money, stocks, wealth, real_wealth, returns, n_init_returns, close, active, shocks,
+                    fundamental, std_noise, fundamentalist_horizon_multiplier, order_expiration,
+                    highest_bid_price, lowest_ask_price):
+    """
+    Run the exuberance inequality model over flat arrays.
+    The trader arrays money, stocks, wealth and real_wealth of shape (n_traders, ticks + 1) hold the initial values in
+    their first column, returns holds the n_init_returns initial returns and close the initial two close prices.
+    They are filled in place.
+    :param active: np.Array (ticks, trader_sample_size) of indices of the active traders per tick
+    :param shocks: np.Array (ticks, trader_sample_size, 2) of standard normal noise and price shocks
+    :return: tuple of fill, order book and final bid-ask arrays
+    """
+    ticks, sample_size = active.shape
+    n_traders = money.shape[0]
+    capacity = ticks * sample_size
+
+    # order arrays
+    order_prices = np.zeros(capacity)
+    order_volumes = np.zeros(capacity, dtype=np.int64)
+    order_owners = np.zeros(capacity, dtype=np.int64)
+    order_types = np.zeros(capacity, dtype=np.int64)
+    in_book = np.zeros(capacity, dtype=np.bool_)
+    first_order_of_tick = np.zeros(ticks + 1, dtype=np.int64)
+    n_orders = 0
+    bids = np.zeros(capacity, dtype=np.int64)
+    asks = np.zeros(capacity, dtype=np.int64)
+    n_bids = 0
+    n_asks = 0
+    active_order = np.full(n_traders, -1, dtype=np.int64)
+
+    # fill arrays
+    fill_prices = np.zeros(capacity)
+    fill_volumes = np.zeros(capacity, dtype=np.int64)
+    fill_bids = np.zeros(capacity, dtype=np.int64)
+    fill_asks = np.zeros(capacity, dtype=np.int64)
+    fill_ticks = np.zeros(capacity, dtype=np.int64)
+    n_fills = 0
+
+    # best bid and ask at the end of every tick
+    tick_highest_bids = np.zeros(ticks)
+    tick_lowest_asks = np.zeros(ticks)
+
+    # prefix sums of returns and squared returns
+    n_returns = n_init_returns
+    sums = np.zeros(returns.shape[0] + 1)
+    squared_sums = np.zeros(returns.shape[0] + 1)
+    for k in range(n_returns):
+        sums[k + 1] = sums[k] + returns[k]
+        squared_sums[k + 1] = squared_sums[k] + returns[k] * returns[k]
+    n_close = 2
+
+    mid_price = (highest_bid_price + lowest_ask_price) / 2.
+    expected_returns = np.zeros(sample_size)
+    trader_prices = np.zeros(sample_size)
+    variances = np.zeros(sample_size)
+
+    for step in range(ticks):
+        t = step + 1
+        first_order_of_tick[step] = n_orders
+
+        # update money and stocks history for agents
+        for i in range(n_traders):
+            money[i, t] = money[i, t - 1]
+            stocks[i, t] = stocks[i, t - 1]
+            wealth[i, t] = money[i, t] + stocks[i, t] * close[n_close - 1]
+            real_wealth[i, t] = money[i, t] + stocks[i, t] * fundamental
+
+        mid_price = (highest_bid_price + lowest_ask_price) / 2.
+        fundamental_component = np.log(fundamental / mid_price)
+
+        last_return = (mid_price - close[n_close - 2]) / close[n_close - 2]
+        returns[n_returns - 1] = last_return
+        sums[n_returns] = sums[n_returns - 1] + last_return
+        squared_sums[n_returns] = squared_sums[n_returns - 1] + last_return * last_return
+
+        # form expectations and draw order prices for all active traders
+        for j in range(sample_size):
+            i = active[step, j]
+            horizon = horizons[i]
+            noise_component = std_noise * shocks[step, j, 0]
+            n = min(horizon, n_returns)
+            chartist_component = (sums[n_returns] - sums[n_returns - n]) / n
+            expected_returns[j] = (
+                    weight_fundamentalist[i] * (1. / (float(horizon) * fundamentalist_horizon_multiplier)) * fundamental_component +
+                    weight_chartist[i] * chartist_component +
+                    weight_random[i] * noise_component)
+            fcast_price = mid_price * np.exp(expected_returns[j])
+
+            total = sums[n_returns] - sums[n_returns - n]
+            squared_total = squared_sums[n_returns] - squared_sums[n_returns - n]
+            variance = (squared_total - total * total / n) / (n - 1)
+            variances[j] = variance if variance > 0. else std_noise
+
+            trader_prices[j] = fcast_price + spreads[i] * shocks[step, j, 1]
+
+        for j in range(sample_size):
+            i = active[step, j]
+            trader_price = trader_prices[j]
+
+            # employ portfolio optimization algo
+            stock_weight = expected_returns[j] / (risk_aversions[i] * variances[j])
+            if np.isnan(stock_weight):
+                stock_weight = 0.
+            stock_weight = min(max(stock_weight, 0.), 1.)
+
+            # Cancel any active orders
+            if active_order[i] >= 0:
+                if order_types[active_order[i]] == 0:
+                    n_bids = _cancel(bids, n_bids, order_prices, in_book, active_order[i])
+                else:
+                    n_asks = _cancel(asks, n_asks, order_prices, in_book, active_order[i])
+                active_order[i] = -1
+
+            # Determine volume
+            position_change = (stock_weight * (stocks[i, t] * trader_price + money[i, t])
+                               ) - (stocks[i, t] * trader_price)
+            volume = position_change / trader_price
+            if not np.isfinite(volume):
+                volume = 0.
+            volume = int(volume)
+
+            # Trade:
+            if volume != 0:
+                order_prices[n_orders] = trader_price
+                order_volumes[n_orders] = abs(volume)
+                order_owners[n_orders] = i
+                in_book[n_orders] = True
+                active_order[i] = n_orders
+                if volume > 0:
+                    order_types[n_orders] = 0
+                    n_bids = _insert(bids, n_bids, order_prices, n_orders, True)
+                    highest_bid_price = order_prices[bids[n_bids - 1]]
+                else:
+                    order_types[n_orders] = 1
+                    n_asks = _insert(asks, n_asks, order_prices, n_orders, False)
+                    lowest_ask_price = order_prices[asks[0]]
+                n_orders += 1
+
+            # Match orders in the order-book
+            while n_bids > 0 and n_asks > 0:
+                winning_bid = bids[n_bids - 1]
+                winning_ask = asks[0]
+                if order_prices[winning_bid] < order_prices[winning_ask]:
+                    break
+                price = order_prices[winning_ask]
+                fill_volume = min(order_volumes[winning_bid], order_volumes[winning_ask])
+                if order_volumes[winning_bid] == order_volumes[winning_ask]:
+                    active_order[order_owners[winning_bid]] = -1
+                    active_order[order_owners[winning_ask]] = -1
+                    in_book[winning_bid] = False
+                    in_book[winning_ask] = False
+                    n_bids -= 1
+                    n_asks = _delete(asks, n_asks, 0)
+                    if n_bids > 0:
+                        highest_bid_price = order_prices[bids[n_bids - 1]]
+                    if n_asks > 0:
+                        lowest_ask_price = order_prices[asks[0]]
+                else:
+                    order_volumes[winning_ask] -= fill_volume
+                    order_volumes[winning_bid] -= fill_volume
+                    if order_volumes[winning_bid] == 0:
+                        active_order[order_owners[winning_bid]] = -1
+                        in_book[winning_bid] = False
+                        n_bids -= 1
+                        if n_bids > 0:
+                            highest_bid_price = order_prices[bids[n_bids - 1]]
+                    else:
+                        active_order[order_owners[winning_ask]] = -1
+                        in_book[winning_ask] = False
+                        n_asks = _delete(asks, n_asks, 0)
+                        if n_asks > 0:
+                            lowest_ask_price = order_prices[asks[0]]
+
+                fill_prices[n_fills] = price
+                fill_volumes[n_fills] = fill_volume
+                fill_bids[n_fills] = order_owners[winning_bid]
+                fill_asks[n_fills] = order_owners[winning_ask]
+                fill_ticks[n_fills] = step
+                n_fills += 1
+
+                # execute trade
+                seller = order_owners[winning_ask]
+                buyer = order_owners[winning_bid]
+                if stocks[seller, t] < fill_volume:
+                    raise ValueError("not enough stocks to sell this amount")
+                stocks[seller, t] -= fill_volume
+                money[seller, t] += price * fill_volume
+                if money[buyer, t] < price * fill_volume:
+                    raise ValueError("not enough money to buy this amount of stocks")
+                stocks[buyer, t] += fill_volume
+                money[buyer, t] -= price * fill_volume
+
+        # expire the orders placed order_expiration + 1 ticks ago, which with an order expiration of 0 are the orders
+        # of this tick, so the end of this tick is recorded first
+        first_order_of_tick[step + 1] = n_orders
+        expiring_tick = t - order_expiration - 1
+        if expiring_tick >= 0:
+            for order_id in range(first_order_of_tick[expiring_tick], first_order_of_tick[expiring_tick + 1]):
+                if order_types[order_id] == 0:
+                    n_bids = _cancel(bids, n_bids, order_prices, in_book, order_id)
+                else:
+                    n_asks = _cancel(asks, n_asks, order_prices, in_book, order_id)
+
+        # update current highest bid and lowest ask
+        if n_bids > 0:
+            highest_bid_price = order_prices[bids[n_bids - 1]]
+        if n_asks > 0:
+            lowest_ask_price = order_prices[asks[0]]
+        tick_highest_bids[step] = highest_bid_price
+        tick_lowest_asks[step] = lowest_ask_price
+
+        # update the tick close price and returns
+        close[n_close] = (highest_bid_price + lowest_ask_price) / 2.
+        n_close += 1
+        returns[n_returns] = (close[n_close - 1] - close[n_close - 2]) / close[n_close - 2]
+        sums[n_returns + 1] = sums[n_returns] + returns[n_returns]
+        squared_sums[n_returns + 1] = squared_sums[n_returns] + returns[n_returns] * returns[n_returns]
+        n_returns += 1
+
+    first_order_of_tick[ticks] = n_orders
+    return (fill_prices[:n_fills], fill_volumes[:n_fills], fill_bids[:n_fills], fill_asks[:n_fills],
+            fill_ticks[:n_fills], order_prices[:n_orders], order_volumes[:n_orders], order_owners[:n_orders],
+            order_types[:n_orders], first_order_of_tick, bids[:n_bids], asks[:n_asks], active_order,
+            tick_highest_bids, tick_lowest_asks, mid_price)
+
+
+def numba_inequality_model(traders, orderbook, parameters, seed=1, rng='streams'):
+    """
+    Compiled counterpart of exuberance_inequality_model.
+    The random numbers are drawn up front from the same generators and in the same order as the pure Python model.
+    The simulated histories are written back to the traders and the order book, except the per-order
+    highest_bid_price_history and lowest_ask_price_history of the order book.
+    If the order book retention is bounded, only its recent history and tick summaries are written back.
+    :param traders: list of Agent objects which have not been simulated yet
+    :param orderbook: object Order book
+    :param parameters: dictionary of parameters
+    :param seed: integer seed to initialise the random number generators
+    :param rng: string 'streams' or 'legacy', see exuberance_inequality_model
+    :return: list of simulated Agent objects, object simulated Order book
+    """
+    if numba is None:
+        raise ImportError("the numba engine requires the numba package")
+    ticks = parameters["ticks"]
+    n_traders = len(traders)
+    sample_size = int(parameters['trader_sample_size'])
+    fundamental = parameters["fundamental_value"]
+
+    # draw the active traders and the noise and price shocks of every tick
+    if rng == 'streams':
+        active, noise, price_shocks = draw_random_blocks(random_streams(seed), ticks, n_traders, sample_size)
+        shocks = np.stack([noise, price_shocks], axis=2)
+    elif rng == 'legacy':
+        random.seed(seed)
+        np.random.seed(seed)
+        positions = list(range(n_traders))
+        active = np.array([random.sample(positions, sample_size) for tick in range(ticks)],
+                          dtype=np.int64).reshape(ticks, sample_size)
+        shocks = np.random.standard_normal((ticks, sample_size, 2))
+    else:
+        raise ValueError("unknown rng")
+
+    population = getattr(traders[0].var, 'population', None)
+    if population is not None:
+        money, stocks = population.money, population.stocks
+        wealth, real_wealth = population.wealth, population.real_wealth
+    else:
+        money = np.zeros((n_traders, ticks + 1))
+        stocks = np.zeros((n_traders, ticks + 1), dtype=np.int64)
+        wealth = np.zeros((n_traders, ticks + 1))
+        real_wealth = np.zeros((n_traders, ticks + 1))
+        money[:, 0] = [trader.var.money[-1] for trader in traders]
+        stocks[:, 0] = [trader.var.stocks[-1] for trader in traders]
+        wealth[:, 0] = [trader.var.wealth[-1] for trader in traders]
+        real_wealth[:, 0] = [trader.var.real_wealth[-1] for trader in traders]
+
+    n_init_returns = len(orderbook.returns)
+    returns = np.zeros(n_init_returns + ticks)
+    returns[:n_init_returns] = orderbook.returns
+    close = np.zeros(ticks + 2)
+    close[0] = orderbook.tick_close_price[-1]
+    close[1] = fundamental
+
+    print('Start of simulation ', seed)
+    (fill_prices, fill_volumes, fill_bids, fill_asks, fill_ticks, order_prices, order_volumes, order_owners,
+     order_types, first_order_of_tick, bids, asks, active_order, tick_highest_bids, tick_lowest_asks,
+     mid_price) = simulate_arrays(
+        np.array([trader.var.weight_fundamentalist[-1] for trader in traders], dtype=np.float64),
+        np.array([trader.var.weight_chartist[-1] for trader in traders], dtype=np.float64),
+        np.array([trader.var.weight_random[-1] for trader in traders], dtype=np.float64),
+        np.array([trader.par.horizon for trader in traders], dtype=np.int64),
+        np.array([trader.par.risk_aversion for trader in traders], dtype=np.float64),
+        np.array([trader.par.spread for trader in traders], dtype=np.float64),
+        money, stocks, wealth, real_wealth, returns, n_init_returns, close, active, shocks,
+        float(fundamental), float(parameters["std_noise"]), float(parameters["fundamentalist_horizon_multiplier"]),
+        int(orderbook.order_expiration), float(orderbook.highest_bid_price), float(orderbook.lowest_ask_price))
+    print('last mid-price was: ', mid_price)
+
+    # write the simulated state back to the traders
+    if population is not None:
+        population.tick = ticks
+    else:
+        for idx, trader in enumerate(traders):
+            trader.var.money = money[idx].tolist()
+            trader.var.stocks = stocks[idx].tolist()
+            trader.var.wealth = wealth[idx].tolist()
+            trader.var.real_wealth = real_wealth[idx].tolist()
+
+    # write the market history back to the order book
+    orderbook.initial_close_prices = close[:2].tolist()
+    orderbook.tick_close_price = orderbook.history_buffer(close.tolist())
+    orderbook.returns = returns.tolist()
+    orderbook.fundamental = [fundamental for tick in range(ticks + 1)]
+    fills_per_tick = np.searchsorted(fill_ticks, np.arange(ticks + 1))
+    for step in range(ticks):
+        prices = fill_prices[fills_per_tick[step]:fills_per_tick[step + 1]].tolist()
+        volumes = fill_volumes[fills_per_tick[step]:fills_per_tick[step + 1]].tolist()
+        if orderbook.retention == 'full':
+            if prices:
+                orderbook.transaction_prices_history.append(prices)
+            orderbook.transaction_volumes_history.append(volumes)
+            orderbook.sentiment_history.append([])
+        orderbook.current_tick = step + 1
+        orderbook.highest_bid_price = float(tick_highest_bids[step])
+        orderbook.lowest_ask_price = float(tick_lowest_asks[step])
+        orderbook.record_tick_summary(float(close[step + 2]), sum(volumes), len(volumes))
+
+    # restore the resting orders
+    placed_at = np.searchsorted(first_order_of_tick, np.arange(len(order_prices)), side='right') - 1
+    resting = {}
+    for order_id in np.concatenate([bids, asks]).tolist():
+        order = Order(order_type='b' if order_types[order_id] == 0 else 'a', owner=traders[order_owners[order_id]],
+                      price=float(order_prices[order_id]), volume=int(order_volumes[order_id]),
+                      order_id=next(orderbook.order_ids), book=orderbook)
+        order.placed_at = int(placed_at[order_id])
+        resting[order_id] = order
+    orderbook.bids = [resting[order_id] for order_id in bids.tolist()]
+    orderbook.asks = [resting[order_id] for order_id in asks.tolist()]
+    for order in resting.values():
+        orderbook.expiry_buckets[orderbook.expiry_tick(order)][order.order_id] = order
+    for idx, trader in enumerate(traders):
+        trader.var.active_orders = [resting[active_order[idx]]] if active_order[idx] in resting else []
+
+    return traders, orderbook
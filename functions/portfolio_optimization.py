@@ -118,3 +118,22 @@ def portfolio_optimization(trader, day):
         output[a] = weights[i]
 
     return output
+
+
+def batch_portfolio_optimization(expected_returns, variances, risk_aversions, money_returns=0.0):
+    """
+    Calculate the optimal stock weights of a batch of traders in one vectorized step.
+    With only a risky asset (stocks) and a riskless asset (money) the long-only mean-variance problem solved by
+    portfolio_optimization has a closed form solution: the unconstrained weight (r_s - r_m) / (risk_aversion * variance)
+    clipped to the interval [0, 1].
+    :param expected_returns: np.Array of expected stock returns, one per trader
+    :param variances: np.Array of stock return variances, one per trader
+    :param risk_aversions: np.Array of trader risk aversions
+    :param money_returns: float or np.Array of expected returns on money
+    :return: np.Array of optimal stock weights, the weight of money is one minus the weight of stocks
+    """
+    excess_returns = np.asarray(expected_returns, dtype=np.float64) - money_returns
+    scaled_variances = np.asarray(risk_aversions, dtype=np.float64) * np.asarray(variances, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = excess_returns / scaled_variances
+    return np.clip(np.nan_to_num(weights, nan=0.0), 0.0, 1.0)
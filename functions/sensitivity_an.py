@@ -1,95 +1,98 @@
+import os
 import numpy as np
 
-from model import exuberance_inequality_model
-import init_objects
-from functions.helpers import organise_data
-from functions.inequality import gini
+from functions.ensemble import stream_ensemble, reduce_ensemble
+from objects.config import ModelConfig
 
+EFAST_OUTPUTS = ['gini', 'real_gini', 'palma', 'real_palma', 'profit', 'volatility']
 
-def simulate_params_efast(NRUNS, parameter_set, fixed_parameters):
+
+def simulate_params_efast(NRUNS, parameter_set, fixed_parameters, workers=1, runner=None, cache=None, journal=None,
+                          output=None):
     """
     Simulate the model for different parameter sets. Record the difference in Gini inequality.
     :param NRUNS: integer amount of Monte Carlo simulations
     :param parameter_set: list of parameters which have been sampled for Sobol sensitivity analysis
-    :param fixed_parameters: list of parameters which will remain fixed
+    :param fixed_parameters: dictionary of parameters or ModelConfig which will remain fixed
+    :param workers: integer number of worker processes over which all (parameter set, seed) runs are spread
+    :param runner: object EnsembleRunner of which the process pool is reused
+    :param cache: object SimulationCache which is checked for runs that have been simulated before
+    :param journal: object EvaluationJournal to which the outcomes of every parameter set are appended, parameter sets
+    which are already in the journal are not simulated again
+    :param output: string file name of a .npy array to which the outcomes are written, see stream_params_efast
     :return: numpy array of average stylized facts outcome values for all parameter combinations
     """
-    gini_avs = []
-    real_gini_avs = []
-    palma_avs = []
-    real_palma_avs = []
-    av_profits = []
-    av_volatilities = []
+    averages = {name: np.zeros(len(parameter_set)) for name in EFAST_OUTPUTS}
+    for p_idx, outcomes in stream_params_efast(NRUNS, parameter_set, fixed_parameters, workers, runner, cache,
+                                               journal, output):
+        for name in EFAST_OUTPUTS:
+            averages[name][p_idx] = outcomes[name]
+
+    return tuple(list(averages[name]) for name in EFAST_OUTPUTS)
+
 
+def stream_params_efast(NRUNS, parameter_set, fixed_parameters, workers=1, runner=None, cache=None, journal=None,
+                        output=None):
+    """
+    Simulate the model for different parameter sets, and generate the outcomes of every parameter set as soon as all
+    its seeds are simulated. Only the runs of the parameter sets which are being simulated are kept in memory.
+    :param NRUNS: integer amount of Monte Carlo simulations
+    :param parameter_set: list of parameters which have been sampled for Sobol sensitivity analysis
+    :param fixed_parameters: dictionary of parameters or ModelConfig which will remain fixed
+    :param workers: integer number of worker processes over which all (parameter set, seed) runs are spread
+    :param runner: object EnsembleRunner of which the process pool is reused
+    :param cache: object SimulationCache which is checked for runs that have been simulated before
+    :param journal: object EvaluationJournal to which the outcomes of every parameter set are appended, parameter sets
+    which are already in the journal are generated from it first
+    :param output: string file name of a .npy array of shape (len(parameter_set), len(EFAST_OUTPUTS)), in which a row
+    is written as soon as the outcomes of a parameter set are known and which is nan until then. A column is the model
+    output which SALib fast.analyze expects. An existing array of the same shape is continued.
+    :return: generator of tuples of the index of a parameter set and a dictionary of its outcomes, see EFAST_OUTPUTS
+    """
+    if isinstance(fixed_parameters, ModelConfig):
+        fixed_parameters = fixed_parameters.to_dict()
+    param_sets = []
     for parameters in parameter_set:
         # combine individual parameters with fixed parameters
-        params = fixed_parameters.copy()
+        params = dict(fixed_parameters)
         params.update(parameters)
-
-        # simulate the model
-        trdrs = []
-        orbs = []
-        for seed in range(NRUNS):
-            traders, orderbook = init_objects.init_objects(params, seed)
-            traders, orderbook = exuberance_inequality_model(traders, orderbook, params, seed=seed)
-            trdrs.append(traders)
-            orbs.append(orderbook)
-
-        mc_prices, mc_returns, mc_autocorr_returns, \
-        mc_autocorr_abs_returns, mc_volatility, mc_volume, mc_fundamentals = organise_data(orbs, burn_in_period=0)
-
-        av_volatility = mc_volatility.mean().mean()
-
-        ginis_ot = []
-        palmas_ot = []
-        real_ginis_ot = []
-        real_palmas_ot = []
-        profits = []
-
-        # determine the start and end wealth
-        for seed, traders in enumerate(trdrs):
-            money_start = np.array([x.var.money[0] for x in traders])
-            stocks_start = np.array([x.var.stocks[0] for x in traders])
-            wealth_start = money_start + (stocks_start * orbs[seed].tick_close_price[0])
-
-            money_end = np.array([x.var.money[-1] for x in traders])
-            stocks_end = np.array([x.var.stocks[-1] for x in traders])
-            wealth_end = money_end + (stocks_end * orbs[seed].tick_close_price[-1])
-
-            profits.append((np.array(wealth_end) - np.array(wealth_start)) / np.array(wealth_start))
-
-            wealth_gini_over_time = []
-            palma_over_time = []
-
-            real_wealth_gini_over_time = []
-            real_palma_over_time = []
-            for t in range(params['ticks'] - 1):
-                money = np.array([x.var.money[t] for x in traders])
-                stocks = np.array([x.var.stocks[t] for x in traders])
-                wealth = money + (stocks * orbs[seed].tick_close_price[t])
-                real_wealth = np.array([x.var.real_wealth[t] for x in traders])
-
-                share_top_10 = sum(np.sort(wealth)[int(len(wealth) * 0.9):]) / sum(wealth)
-                share_bottom_40 = sum(np.sort(wealth)[:int(len(wealth) * 0.4)]) / sum(wealth)
-                palma_over_time.append(share_top_10 / share_bottom_40)
-
-                real_share_top_10 = sum(np.sort(real_wealth)[int(len(real_wealth) * 0.9):]) / sum(real_wealth)
-                real_share_bottom_40 = sum(np.sort(real_wealth)[:int(len(real_wealth) * 0.4)]) / sum(real_wealth)
-                real_palma_over_time.append(real_share_top_10 / real_share_bottom_40)
-
-                wealth_gini_over_time.append(gini(wealth))
-                real_wealth_gini_over_time.append(gini(real_wealth))
-
-            ginis_ot.append(wealth_gini_over_time)
-            palmas_ot.append(palma_over_time)
-            real_ginis_ot.append(real_wealth_gini_over_time)
-            real_palmas_ot.append(real_palma_over_time)
-
-        gini_avs.append(np.mean(ginis_ot))
-        real_gini_avs.append(np.mean(real_ginis_ot))
-        palma_avs.append(np.mean(palmas_ot))
-        real_palma_avs.append(np.mean(real_palmas_ot))
-        av_profits.append(np.mean(profits))
-        av_volatilities.append(av_volatility)
-
-    return gini_avs, real_gini_avs, palma_avs, real_palma_avs, av_profits, av_volatilities
+        param_sets.append(ModelConfig.from_dict(params))
+    seeds = list(range(NRUNS))
+
+    Y = None
+    if output is not None:
+        shape = (len(param_sets), len(EFAST_OUTPUTS))
+        if os.path.exists(output) and np.load(output, mmap_mode='r').shape == shape:
+            Y = np.lib.format.open_memmap(output, mode='r+')
+        else:
+            Y = np.lib.format.open_memmap(output, mode='w+', dtype=np.float64, shape=shape)
+            Y.fill(np.nan)
+            Y.flush()
+
+    def write(p_idx, outcomes):
+        if Y is not None:
+            Y[p_idx] = [outcomes[name] for name in EFAST_OUTPUTS]
+            Y.flush()
+
+    keys = [None] * len(param_sets)
+    remaining = list(range(len(param_sets)))
+    if journal is not None:
+        keys = [journal.key(params, seeds, outputs='efast') for params in param_sets]
+        remaining = [p_idx for p_idx, key in enumerate(keys) if key not in journal]
+        for p_idx, key in enumerate(keys):
+            if key in journal:
+                outcomes = journal.get(key)['moments']
+                write(p_idx, outcomes)
+                yield p_idx, outcomes
+
+    # simulate the model
+    for r_idx, results in stream_ensemble([param_sets[p_idx] for p_idx in remaining], seeds, workers=workers,
+                                          runner=runner, cache=cache):
+        p_idx = remaining[r_idx]
+        averages = reduce_ensemble(results, [param_sets[p_idx]])
+        outcomes = {name: float(averages[name][0]) for name in EFAST_OUTPUTS}
+        if journal is not None:
+            journal.record(keys[p_idx], param_sets[p_idx], seeds, index=p_idx, moments=outcomes,
+                           seconds=list(results['seconds']))
+        write(p_idx, outcomes)
+        yield p_idx, outcomes
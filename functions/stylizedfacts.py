@@ -1,7 +1,7 @@
 """This file contains functions and tests to calculate the stylized facts"""
 import pandas as pd
 import numpy as np
-from functions.helpers import div0
+from functions.helpers import div0, lagged_products
 import statsmodels.api as sm
 import statsmodels.tsa.stattools as ts
 
@@ -104,6 +104,160 @@ def correlation_volume_volatility(volume, returns, window):
     return correlation
 
 
+def autocorrelation_matrix(returns, lags):
+    """
+    Autocorrelations of all columns of a returns matrix for several lags at once. Like pandas Series.autocorr, every
+    autocorrelation is the Pearson correlation of the series and its lagged series over the pairs of which neither is
+    nan, and nan if there are too few pairs or one of the two is constant.
+    :param returns: np.Array or DataFrame of shape (T, runs), or a single time series
+    :param lags: list of integer lags
+    :return: np.Array of shape (len(lags), runs), or (len(lags),) for a single time series
+    """
+    x = np.asarray(returns, dtype=np.float64)
+    single = x.ndim == 1
+    if single:
+        x = x[:, None]
+    lags = np.asarray(lags, dtype=np.int64)
+    max_lag = int(lags.max()) if len(lags) else 0
+    length = x.shape[0]
+    n_fft = 1 << int(np.ceil(np.log2(max(length + max_lag, 2))))
+
+    valid = ~np.isnan(x)
+    counts = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, np.where(valid, x, 0.).sum(axis=0) / counts, 0.)
+    centered = np.where(valid, x - means, 0.)
+    centered_spectrum = np.fft.rfft(centered, n_fft, axis=0)
+    sum_ab = lagged_products(centered_spectrum, centered_spectrum, n_fft, length, max_lag)
+
+    # sums over the pairs (a, b) = (x[t + k], x[t]) of which both values are observed
+    if valid.all():
+        shape = (max_lag + 1, x.shape[1])
+        n = np.broadcast_to(np.maximum(length - np.arange(max_lag + 1), 0)[:, None].astype(np.float64), shape)
+        sums = np.cumsum(np.concatenate([np.zeros((1, x.shape[1])), centered]), axis=0)
+        squares = np.cumsum(np.concatenate([np.zeros((1, x.shape[1])), centered ** 2]), axis=0)
+        ends = np.maximum(length - np.arange(max_lag + 1), 0)
+        starts = np.minimum(np.arange(max_lag + 1), length)
+        sum_a, sum_aa = sums[-1] - sums[starts], squares[-1] - squares[starts]
+        sum_b, sum_bb = sums[ends], squares[ends]
+    else:
+        mask_spectrum = np.fft.rfft(valid.astype(np.float64), n_fft, axis=0)
+        squares_spectrum = np.fft.rfft(centered ** 2, n_fft, axis=0)
+        n = np.rint(lagged_products(mask_spectrum, mask_spectrum, n_fft, length, max_lag))
+        sum_a = lagged_products(centered_spectrum, mask_spectrum, n_fft, length, max_lag)
+        sum_b = lagged_products(mask_spectrum, centered_spectrum, n_fft, length, max_lag)
+        sum_aa = lagged_products(squares_spectrum, mask_spectrum, n_fft, length, max_lag)
+        sum_bb = lagged_products(mask_spectrum, squares_spectrum, n_fft, length, max_lag)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance = sum_ab - sum_a * sum_b / n
+        variance_a = sum_aa - sum_a ** 2 / n
+        variance_b = sum_bb - sum_b ** 2 / n
+        correlations = covariance / np.sqrt(variance_a * variance_b)
+    correlations[(n < 2) | (variance_a <= 0) | (variance_b <= 0)] = np.nan
+    correlations = np.clip(correlations, -1., 1.)[lags]
+    return correlations[:, 0] if single else correlations
+
+
+def kurtosis_matrix(returns):
+    """
+    Bias corrected excess kurtosis of every column of a returns matrix, like pandas Series.kurtosis, skipping nan
+    :param returns: np.Array or DataFrame of shape (T, runs)
+    :return: np.Array of shape (runs,)
+    """
+    x = np.asarray(returns, dtype=np.float64)
+    valid = ~np.isnan(x)
+    count = valid.sum(axis=0).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, x, 0.).sum(axis=0) / count
+        deviations = np.where(valid, x - mean, 0.)
+        m2 = (deviations ** 2).sum(axis=0)
+        m4 = (deviations ** 4).sum(axis=0)
+        adjustment = 3 * (count - 1) ** 2 / ((count - 2) * (count - 3))
+        numerator = count * (count + 1) * (count - 1) * m4
+        denominator = (count - 2) * (count - 3) * m2 ** 2
+        numerator = np.where(np.abs(numerator) < 1e-14, 0., numerator)
+        denominator = np.where(np.abs(denominator) < 1e-14, 0., denominator)
+        result = numerator / denominator - adjustment
+    result = np.where(denominator == 0, 0., result)
+    return np.where(count < 4, np.nan, result)
+
+
+def rolling_volatility_matrix(returns, window):
+    """
+    Rolling standard deviation (ddof=0) of every column of a returns matrix, like pandas rolling(window).std(ddof=0)
+    :param returns: np.Array or DataFrame of shape (T, runs)
+    :param window: integer window, windows with a nan value have a nan volatility
+    :return: np.Array of shape (T, runs)
+    """
+    x = np.asarray(returns, dtype=np.float64)
+    valid = ~np.isnan(x)
+    counts = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, np.where(valid, x, 0.).sum(axis=0) / counts, 0.)
+    centered = np.where(valid, x - means, 0.)
+
+    def window_sums(values):
+        cumulative = np.cumsum(np.concatenate([np.zeros((1,) + values.shape[1:]), values]), axis=0)
+        return cumulative[window:] - cumulative[:-window]
+
+    volatility = np.full(x.shape, np.nan)
+    if x.shape[0] >= window:
+        total = window_sums(centered)
+        variance = (window_sums(centered ** 2) - total ** 2 / window) / window
+        volatility[window - 1:] = np.where(window_sums(valid.astype(np.float64)) == window,
+                                           np.sqrt(np.maximum(variance, 0.)), np.nan)
+    return volatility
+
+
+def column_correlations(a, b):
+    """
+    Pearson correlation of every column of a with the same column of b, over the rows in which neither is nan
+    :param a: np.Array or DataFrame of shape (T, runs)
+    :param b: np.Array or DataFrame of shape (T, runs)
+    :return: np.Array of shape (runs,)
+    """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    valid = ~(np.isnan(a) | np.isnan(b))
+    n = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a_centered = np.where(valid, a - np.where(valid, a, 0.).sum(axis=0) / n, 0.)
+        b_centered = np.where(valid, b - np.where(valid, b, 0.).sum(axis=0) / n, 0.)
+        correlations = (a_centered * b_centered).sum(axis=0) / np.sqrt(
+            (a_centered ** 2).sum(axis=0) * (b_centered ** 2).sum(axis=0))
+    return np.where(n < 2, np.nan, np.clip(correlations, -1., 1.))
+
+
+def stylized_moments(returns, mean_lags=25, ac_lags=(1, 5), abs_ac_lags=(10, 25, 50, 100), volume=None, window=20):
+    """
+    Moments of a matrix of simulated returns, calculated for all runs at once
+    :param returns: np.Array or DataFrame of shape (T, runs) of returns without the leading nan of pct_change
+    :param mean_lags: integer, the average autocorrelations are taken over lags 1 to mean_lags - 1
+    :param ac_lags: list of lags of which the autocorrelation of returns is reported
+    :param abs_ac_lags: list of lags of which the autocorrelation of absolute returns is reported
+    :param volume: np.Array or DataFrame of shape (T, runs) of volumes, if given the correlation between volume and
+    rolling volatility is reported
+    :param window: integer window of the rolling volatility
+    :return: DataFrame with a row per run and a column per moment
+    """
+    x = np.asarray(returns, dtype=np.float64)
+    lags = sorted(set(range(1, mean_lags)) | set(ac_lags))
+    abs_lags = sorted(set(range(1, mean_lags)) | set(abs_ac_lags))
+    autocorrelations = autocorrelation_matrix(x, lags)
+    abs_autocorrelations = autocorrelation_matrix(np.abs(x), abs_lags)
+
+    moments = {'autocorrelation': autocorrelations[:mean_lags - 1].mean(axis=0),
+               'abs_autocorrelation': abs_autocorrelations[:mean_lags - 1].mean(axis=0)}
+    for lag in ac_lags:
+        moments['autocorrelation_{}'.format(lag)] = autocorrelations[lags.index(lag)]
+    for lag in abs_ac_lags:
+        moments['abs_autocorrelation_{}'.format(lag)] = abs_autocorrelations[abs_lags.index(lag)]
+    moments['kurtosis'] = kurtosis_matrix(x)
+    if volume is not None:
+        moments['volume_volatility'] = column_correlations(rolling_volatility_matrix(x, window), volume)
+    return pd.DataFrame(moments)
+
+
 def cointegr(fundament, price):
     """
     Calculate cointegration with fundamentals
@@ -138,38 +292,21 @@ def get_model_moments_in_confidence(mc_rets, mc_p, mc_f, conf_int_mom):
     :param conf_int_mom:
     :return: list of True and False's for all the moments which are within the confidence intervals
     """
-    first_order_autocors = []
-    autocors1 = []
-    autocors5 = []
-    mean_abs_autocor = []
-    kurtoses = []
-    spy_abs_auto10 = []
-    spy_abs_auto25 = []
-    spy_abs_auto50 = []
-    spy_abs_auto100 = []
-    cointegrations = []
-    for col in mc_rets:
-        first_order_autocors.append(autocorrelation_returns(mc_rets[col][1:], 25))
-        autocors1.append(mc_rets[col][1:].autocorr(lag=1))
-        autocors5.append(mc_rets[col][1:].autocorr(lag=5))
-        mean_abs_autocor.append(autocorrelation_abs_returns(mc_rets[col][1:], 25))
-        kurtoses.append(mc_rets[col][2:].kurtosis())
-        spy_abs_auto10.append(mc_rets[col][1:].abs().autocorr(lag=10))
-        spy_abs_auto25.append(mc_rets[col][1:].abs().autocorr(lag=25))
-        spy_abs_auto50.append(mc_rets[col][1:].abs().autocorr(lag=50))
-        spy_abs_auto100.append(mc_rets[col][1:].abs().autocorr(lag=100))
-        cointegrations.append(cointegr(mc_p[col][1:], mc_f[col][1:])[0])
+    returns = mc_rets.values[1:]
+    moments = stylized_moments(returns)
+    kurtoses = kurtosis_matrix(returns[1:])
+    cointegrations = [cointegr(mc_p[col][1:], mc_f[col][1:])[0] for col in mc_rets]
 
     moments = np.array([
-        np.mean(first_order_autocors),
-        np.mean(autocors1),
-        np.mean(autocors5),
-        np.mean(mean_abs_autocor),
+        np.mean(moments['autocorrelation']),
+        np.mean(moments['autocorrelation_1']),
+        np.mean(moments['autocorrelation_5']),
+        np.mean(moments['abs_autocorrelation']),
         np.mean(kurtoses),
-        np.mean(spy_abs_auto10),
-        np.mean(spy_abs_auto25),
-        np.mean(spy_abs_auto50),
-        np.mean(spy_abs_auto100),
+        np.mean(moments['abs_autocorrelation_10']),
+        np.mean(moments['abs_autocorrelation_25']),
+        np.mean(moments['abs_autocorrelation_50']),
+        np.mean(moments['abs_autocorrelation_100']),
         np.mean(cointegrations)])
 
     mom_covered = [between_interval(i, v) for i, v in zip(conf_int_mom, moments)]
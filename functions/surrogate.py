@@ -0,0 +1,164 @@
+"""Gaussian process emulator of the calibration cost, which proposes the parameters that are simulated next"""
+
+import numpy as np
+import scipy.optimize as sciopt
+import scipy.stats as stats
+
+
+class GaussianProcess:
+    """
+    Gaussian process regression with a constant mean and an anisotropic Matern 5/2 kernel, also known as kriging.
+    Inputs are scaled to the unit cube and outputs are standardized. The noise variance is estimated together with the
+    signal variance and length scales, since the simulated cost of a parameter set depends on the seeds.
+    """
+    def __init__(self, length_scale_bounds=(1e-2, 1e1), variance_bounds=(1e-2, 1e2), noise_bounds=(1e-6, 1.),
+                 restarts=5, seed=0):
+        """
+        Initialize emulator
+        :param length_scale_bounds: tuple of the lowest and highest length scale, relative to the unit cube
+        :param variance_bounds: tuple of the lowest and highest signal variance, relative to the output variance
+        :param noise_bounds: tuple of the lowest and highest noise variance, relative to the output variance
+        :param restarts: integer number of random starting points of the hyperparameter optimization
+        :param seed: integer seed of the starting points of the hyperparameter optimization
+        """
+        self.length_scale_bounds = length_scale_bounds
+        self.variance_bounds = variance_bounds
+        self.noise_bounds = noise_bounds
+        self.restarts = restarts
+        self.seed = seed
+        self.theta = None
+
+    def fit(self, X, y, optimize=True):
+        """
+        Condition the emulator on observations
+        :param X: numpy array of shape (n, d) of inputs in the unit cube
+        :param y: numpy array of n outputs
+        :param optimize: if False, the hyperparameters and output scaling of the previous fit are kept, which is how
+        believed observations are added to a batch
+        :return: the emulator itself
+        """
+        self.X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        y = np.asarray(y, dtype=np.float64)
+        if optimize or self.theta is None:
+            self.y_mean = np.mean(y)
+            self.y_std = np.std(y) if np.std(y) > 0 else 1.
+            self.theta = self._optimize(self.X, (y - self.y_mean) / self.y_std)
+        self.y = (y - self.y_mean) / self.y_std
+        self.L, self.alpha = self._factorize(self.theta, self.X, self.y)
+        return self
+
+    def predict(self, X):
+        """
+        Posterior of the noise free output
+        :param X: numpy array of shape (m, d) of inputs in the unit cube
+        :return: tuple of numpy arrays of the m posterior means and standard deviations
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        length_scales, variance, _ = self._hyperparameters(self.theta)
+        K_s = matern52(X, self.X, length_scales, variance)
+        mean = K_s @ self.alpha
+        v = np.linalg.solve(self.L, K_s.T)
+        var = np.maximum(variance - np.sum(v ** 2, axis=0), 0.)
+        return self.y_mean + self.y_std * mean, self.y_std * np.sqrt(var)
+
+    def _hyperparameters(self, theta):
+        d = self.X.shape[1]
+        return np.exp(theta[:d]), np.exp(theta[d]), np.exp(theta[d + 1])
+
+    def _factorize(self, theta, X, y):
+        length_scales, variance, noise = self._hyperparameters(theta)
+        K = matern52(X, X, length_scales, variance) + (noise + 1e-10) * np.eye(len(X))
+        L = np.linalg.cholesky(K)
+        alpha = np.linalg.solve(L.T, np.linalg.solve(L, y))
+        return L, alpha
+
+    def _negative_log_likelihood(self, theta, X, y):
+        try:
+            L, alpha = self._factorize(theta, X, y)
+        except np.linalg.LinAlgError:
+            return 1e25
+        return 0.5 * y @ alpha + np.sum(np.log(np.diag(L))) + 0.5 * len(X) * np.log(2 * np.pi)
+
+    def _optimize(self, X, y):
+        d = X.shape[1]
+        bounds = np.log([self.length_scale_bounds] * d + [self.variance_bounds, self.noise_bounds])
+        rng = np.random.default_rng(self.seed)
+        starts = [np.append(np.full(d, np.log(0.3)), [0., np.log(1e-2)])]
+        starts += list(rng.uniform(bounds[:, 0], bounds[:, 1], size=(self.restarts, d + 2)))
+        best = None
+        for theta0 in starts:
+            res = sciopt.minimize(self._negative_log_likelihood, theta0, args=(X, y), method='L-BFGS-B',
+                                  bounds=bounds)
+            if best is None or res.fun < best.fun:
+                best = res
+        return best.x
+
+
+def matern52(A, B, length_scales, variance):
+    """
+    Matern 5/2 covariance between two sets of points
+    :param A: numpy array of shape (n, d)
+    :param B: numpy array of shape (m, d)
+    :param length_scales: numpy array of d length scales
+    :param variance: float signal variance
+    :return: numpy array of shape (n, m)
+    """
+    diff = (A[:, None, :] - B[None, :, :]) / length_scales
+    r = np.sqrt(5. * np.sum(diff ** 2, axis=2))
+    return variance * (1. + r + r ** 2 / 3.) * np.exp(-r)
+
+
+def expected_improvement(mean, std, best, xi=0.0):
+    """
+    Expected improvement of minimization over the best value so far
+    :param mean: numpy array of posterior means
+    :param std: numpy array of posterior standard deviations
+    :param best: float best value so far
+    :param xi: float improvement that is required before a point is expected to improve
+    :return: numpy array of expected improvements, zero where the posterior is certain
+    """
+    improvement = best - mean - xi
+    z = np.divide(improvement, std, out=np.zeros_like(improvement), where=std > 0)
+    ei = improvement * stats.norm.cdf(z) + std * stats.norm.pdf(z)
+    return np.where(std > 0, ei, np.maximum(improvement, 0.))
+
+
+def propose_batch(gp, X, y, size, candidates=2000, local=0.05, rng=None):
+    """
+    Propose points which maximize the expected improvement, a batch is filled with the kriging believer heuristic: after
+    a point is chosen, the emulator is conditioned on its posterior mean as if it had been observed
+    :param gp: object GaussianProcess fitted to X and y
+    :param X: numpy array of shape (n, d) of observed inputs in the unit cube
+    :param y: numpy array of n observed outputs
+    :param size: integer number of points in the batch
+    :param candidates: integer number of uniformly drawn candidate points, to which perturbations of the best observed
+    points are added
+    :param local: float standard deviation of the perturbations of the best observed points
+    :param rng: numpy Generator which draws the candidates
+    :return: tuple of a numpy array of shape (size, d) of proposed inputs and a numpy array of their expected
+    improvements when they were chosen
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    d = X.shape[1]
+    best_points = X[np.argsort(y)[:min(5, len(y))]]
+    pool = np.vstack([rng.random((candidates, d)),
+                      np.clip(np.repeat(best_points, candidates // 10, axis=0) +
+                              rng.normal(0., local, size=(len(best_points) * (candidates // 10), d)), 0., 1.)])
+    X_believed, y_believed = X.copy(), np.asarray(y, dtype=np.float64).copy()
+    believer = gp
+    proposals, improvements = [], []
+    for _ in range(size):
+        mean, std = believer.predict(pool)
+        # with noisy observations, the best value is the lowest posterior mean at an observed point
+        best = np.min(believer.predict(X_believed)[0])
+        ei = expected_improvement(mean, std, best)
+        choice = int(np.argmax(ei))
+        proposals.append(pool[choice])
+        improvements.append(ei[choice])
+        X_believed = np.vstack([X_believed, pool[choice]])
+        y_believed = np.append(y_believed, mean[choice])
+        pool = np.delete(pool, choice, axis=0)
+        believer = GaussianProcess(gp.length_scale_bounds, gp.variance_bounds, gp.noise_bounds, gp.restarts, gp.seed)
+        believer.theta, believer.y_mean, believer.y_std = gp.theta, gp.y_mean, gp.y_std
+        believer.fit(X_believed, y_believed, optimize=False)
+    return np.array(proposals), np.array(improvements)
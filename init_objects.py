@@ -2,14 +2,99 @@ from objects.trader import *
 from objects.orderbook import *
 import random
 import numpy as np
-from functions.helpers import calculate_covariance_matrix, div0
+from objects.config import ModelConfig
+from functions.helpers import calculate_covariance_matrix, div0, div0_array, random_streams
 
 
-def init_objects(parameters, seed):
+def init_objects(parameters, seed, array_backed=False, orderbook_type='sorted_list', history_retention='full',
+                 rng='streams'):
     """
     Init object for the distribution version of the model
+    :param parameters: dictionary of parameters or ModelConfig
+    :param seed:
+    :param array_backed: boolean, if True the trader variables are views on a preallocated TraderPopulation
+    :param orderbook_type: string 'sorted_list' for LimitOrderBook or 'price_level' for PriceLevelOrderBook
+    :param history_retention: string 'full' or 'bounded' to keep only the recent history the traders need
+    :param rng: string 'streams' to draw all trader properties at once from the init stream of random_streams(seed)
+    or 'legacy' to seed the global random and numpy random states and draw trader by trader with init_objects_legacy
+    :return:
+    """
+    parameters = ModelConfig.from_dict(parameters)
+    if rng == 'legacy':
+        return init_objects_legacy(parameters, seed, array_backed, orderbook_type, history_retention)
+    elif rng != 'streams':
+        raise ValueError("unknown rng")
+    generator = random_streams(seed)['init']
+    n_traders = parameters.n_traders
+
+    f_points = int(parameters.weight_fundamentalist * 100 * n_traders)
+    c_points = int(parameters.weight_chartist * 100 * n_traders)
+    r_points = int(parameters['w_random'] * 100 * n_traders)
+
+    # Dividing a shuffled list of strategy points in equal parts, gives every part a number of f points drawn from a
+    # multivariate hypergeometric distribution, and then a number of c points from the points that are left
+    total_points = f_points + c_points + r_points
+    chunk_sizes = np.full(n_traders, total_points // n_traders, dtype=np.int64)
+    chunk_sizes[:total_points % n_traders] += 1
+    f_counts = generator.multivariate_hypergeometric(chunk_sizes, f_points, method='marginals')
+    c_counts = generator.multivariate_hypergeometric(chunk_sizes - f_counts, c_points, method='marginals')
+    r_counts = chunk_sizes - f_counts - c_counts
+    weights_f, weights_c, weights_r = [counts / chunk_sizes.astype(np.float64)
+                                       for counts in [f_counts, c_counts, r_counts]]
+
+    max_horizon = parameters.max_horizon
+    historical_stock_returns = generator.normal(0, parameters["std_noise"], max_horizon)
+
+    init_stocks = generator.uniform(0, parameters["init_stocks"], n_traders).astype(np.int64)
+    init_money = generator.uniform(0, (parameters["init_stocks"] * parameters['fundamental_value']), n_traders)
+
+    # If there are chartists (c) & fundamentalists (f) in the model, keep track of the fraction between c & f.
+    c_shares_strat = np.where(weights_r < 1.0, div0_array(weights_c, weights_f + weights_c), 0.0)
+
+    # all traders start with the same covariance matrix
+    init_covariance_matrix = calculate_covariance_matrix(historical_stock_returns, parameters["std_noise"])
+
+    horizons = generator.integers(10, parameters['horizon'], n_traders)
+    risk_aversions = np.abs(generator.normal(parameters["base_risk_aversion"], parameters["base_risk_aversion"] / 5.0,
+                                             n_traders))
+    spreads = parameters['spread_max'] * generator.random(n_traders)
+
+    if array_backed:
+        population = TraderPopulation(n_traders, parameters['ticks'])
+        population.initialize(weights_f, weights_c, weights_r, init_money, init_stocks,
+                              parameters['fundamental_value'])
+    traders = []
+    for idx, (w_f, w_c, w_r, c_share, money, stocks, horizon, risk_aversion, spread) in enumerate(zip(
+            weights_f.tolist(), weights_c.tolist(), weights_r.tolist(), c_shares_strat.tolist(),
+            init_money.tolist(), init_stocks.tolist(), horizons.tolist(), risk_aversions.tolist(), spreads.tolist())):
+        if array_backed:
+            trader_vars = PopulationTraderVariables(population, idx, c_share, init_covariance_matrix, money, stocks,
+                                                    parameters['fundamental_value'])
+        else:
+            trader_vars = TraderVariables(w_f, w_c, w_r, c_share, money, stocks, init_covariance_matrix,
+                                          parameters['fundamental_value'])
+        trader_params = TraderParameters(horizon, risk_aversion, parameters['spread_max'], spread=spread)
+        trader_expectations = TraderExpectations(parameters['fundamental_value'])
+        traders.append(Trader(idx, trader_vars, trader_params, trader_expectations))
+
+    order_book = ORDERBOOK_TYPES[orderbook_type](parameters['fundamental_value'], parameters["std_noise"],
+                                                 max_horizon, parameters['ticks'], retention=history_retention)
+
+    # initialize order-book returns for initial variance calculations
+    order_book.returns = list(historical_stock_returns)
+
+    return traders, order_book
+
+
+def init_objects_legacy(parameters, seed, array_backed=False, orderbook_type='sorted_list', history_retention='full'):
+    """
+    Init object for the distribution version of the model which seeds and draws from the global random and numpy
+    random states trader by trader, reproducing results from before random_streams
     :param parameters:
     :param seed:
+    :param array_backed: boolean, if True the trader variables are views on a preallocated TraderPopulation
+    :param orderbook_type: string 'sorted_list' for LimitOrderBook or 'price_level' for PriceLevelOrderBook
+    :param history_retention: string 'full' or 'bounded' to keep only the recent history the traders need
     :return:
     """
     np.random.seed(seed)
@@ -17,6 +102,7 @@ def init_objects(parameters, seed):
 
     traders = []
     n_traders = parameters["n_traders"]
+    population = TraderPopulation(n_traders, parameters['ticks']) if array_backed else None
 
     weight_f = (1 - parameters['strat_share_chartists']) * (1 - parameters['w_random'])
     weight_c = parameters['strat_share_chartists'] * (1 - parameters['w_random'])
@@ -49,9 +135,14 @@ def init_objects(parameters, seed):
 
         init_covariance_matrix = calculate_covariance_matrix(historical_stock_returns, parameters["std_noise"])
 
-        trader_vars = TraderVariables(weights[0], weights[1], weights[2], c_share_strat,
-                                   init_money, init_stocks, init_covariance_matrix,
-                                   parameters['fundamental_value'])
+        if population is not None:
+            trader_vars = population.trader_variables(idx, weights[0], weights[1], weights[2], c_share_strat,
+                                                      init_money, init_stocks, init_covariance_matrix,
+                                                      parameters['fundamental_value'])
+        else:
+            trader_vars = TraderVariables(weights[0], weights[1], weights[2], c_share_strat,
+                                          init_money, init_stocks, init_covariance_matrix,
+                                          parameters['fundamental_value'])
 
         individual_horizon = np.random.randint(10, parameters['horizon'])
 
@@ -61,8 +152,8 @@ def init_objects(parameters, seed):
         trader_expectations = TraderExpectations(parameters['fundamental_value'])
         traders.append(Trader(idx, trader_vars, trader_params, trader_expectations))
 
-    order_book = LimitOrderBook(parameters['fundamental_value'], parameters["std_noise"], max_horizon,
-                                parameters['ticks'])
+    order_book = ORDERBOOK_TYPES[orderbook_type](parameters['fundamental_value'], parameters["std_noise"],
+                                                 max_horizon, parameters['ticks'], retention=history_retention)
 
     # initialize order-book returns for initial variance calculations
     order_book.returns = list(historical_stock_returns)
@@ -84,6 +175,7 @@ def init_objects_unequal(parameters, seed, equality=1.0):
     :param seed:
     :return:
     """
+    parameters = ModelConfig.from_dict(parameters)
     np.random.seed(seed)
     random.seed(seed)
 
@@ -136,8 +228,8 @@ def init_objects_unequal(parameters, seed, equality=1.0):
         individual_risk_aversion = abs(np.random.normal(parameters["base_risk_aversion"], parameters["base_risk_aversion"] / 5.0))#parameters["base_risk_aversion"] * relative_fundamentalism
         individual_learning_ability = min(abs(np.random.normal(parameters['average_learning_ability'], 0.1)), 1.0) #TODO what to do with std_dev
 
-        lft_params = TraderParameters(individual_horizon, individual_risk_aversion,
-                                      individual_learning_ability, parameters['spread_max'])
+        lft_params = TraderParameters(individual_horizon, individual_risk_aversion, parameters['spread_max'])
+        lft_params.learning_ability = individual_learning_ability
         lft_expectations = TraderExpectations(parameters['fundamental_value'])
         traders.append(Trader(idx, lft_vars, lft_params, lft_expectations))
 
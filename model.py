@@ -1,102 +1,314 @@
 import random
 import numpy as np
 from functions.portfolio_optimization import *
-from functions.helpers import calculate_covariance_matrix, div0, ornstein_uhlenbeck_evolve
+from objects.config import ModelConfig
+from functions.helpers import covariance_matrix_from_variance, div0, div0_array, draw_random_blocks, \
+    ornstein_uhlenbeck_evolve, random_streams
 
+# increase when a change alters simulated outcomes, so that cached simulation results are no longer used
+MODEL_VERSION = '3'
 
-def exuberance_inequality_model(traders, orderbook, parameters, seed=1):
+
+def exuberance_inequality_model(traders, orderbook, parameters, seed=1, portfolio_solver='closed_form',
+                                order_submission='sequential', engine='python', recorder=None, rng='streams',
+                                monitor=None):
     """
     The main model function of distribution model where trader stocks are tracked.
     :param traders: list of Agent objects
     :param orderbook: object Order book
-    :param parameters: dictionary of parameters
+    :param parameters: dictionary of parameters or ModelConfig
     :param seed: integer seed to initialise the random number generators
+    :param portfolio_solver: string 'closed_form' to solve the portfolios of all active traders in one vectorized step
+    or 'kkt' to use the reference Kuhn-Tucker routine per trader
+    :param order_submission: string 'sequential' to submit and match orders trader by trader or 'batch' to submit the
+    orders of all active traders with orderbook.submit_batch and settle the resulting fills in one vectorized step
+    :param engine: string 'python' or 'numba' to run the tick loop as a compiled kernel over flat arrays, which always
+    uses the closed form portfolio solver and sequential order submission
+    :param recorder: object SimulationRecorder which records the market series and trader panels of every tick
+    :param rng: string 'streams' to draw the active traders, noise and price shocks of all ticks up front from the
+    independent streams of random_streams(seed), or 'legacy' to seed and draw from the global random and numpy random
+    states trader by trader
+    :param monitor: object CheckpointMonitor which is told about every tick and may stop the simulation early, in
+    which case the histories end at the tick at which it was stopped
     :return: list of simulated Agent objects, object simulated Order book
     """
-    random.seed(seed)
-    np.random.seed(seed)
+    parameters = ModelConfig.from_dict(parameters)
+    if rng not in ['streams', 'legacy']:
+        raise ValueError("unknown rng")
+    if recorder is not None:
+        recorder.record_tick(traders, orderbook, parameters["fundamental_value"])
+
+    if engine == 'numba':
+        if portfolio_solver != 'closed_form':
+            raise ValueError("the numba engine only supports the closed_form portfolio_solver")
+        if monitor is not None:
+            raise ValueError("the numba engine does not support monitors")
+        from functions.numba_engine import numba_inequality_model
+        traders, orderbook = numba_inequality_model(traders, orderbook, parameters, seed, rng)
+        if recorder is not None:
+            recorder.record_history(traders, orderbook)
+        return traders, orderbook
+    elif engine != 'python':
+        raise ValueError("unknown engine")
+
+    sample_size = int(parameters['trader_sample_size'])
+    if rng == 'streams':
+        active_indices, noise, price_shocks = draw_random_blocks(random_streams(seed), parameters["ticks"],
+                                                                 len(traders), sample_size)
+    else:
+        random.seed(seed)
+        np.random.seed(seed)
     fundamental = [parameters["fundamental_value"]]
     orderbook.tick_close_price.append(fundamental[-1])
 
-    traders_by_wealth = [t for t in traders]
+    # array-backed traders share a single TraderPopulation
+    population = getattr(traders[0].var, 'population', None)
+    traders_by_name = {trader.name: trader for trader in traders}
 
     for tick in range(parameters['horizon'] + 1, parameters["ticks"] + parameters['horizon'] + 1):  # for init history
         if tick == parameters['horizon'] + 1:
             print('Start of simulation ', seed)
 
         # update money and stocks history for agents
-        for trader in traders:
-            trader.var.money.append(trader.var.money[-1])
-            trader.var.stocks.append(trader.var.stocks[-1])
-            trader.var.wealth.append(trader.var.money[-1] + trader.var.stocks[-1] * orderbook.tick_close_price[-1])
-            trader.var.real_wealth.append(trader.var.money[-1] + trader.var.stocks[-1] * fundamental[-1])
-
-        # sort the traders by wealth to
-        traders_by_wealth.sort(key=lambda x: x.var.wealth[-1], reverse=True)
+        if population is not None:
+            population.carry_forward(orderbook.tick_close_price[-1], fundamental[-1])
+        else:
+            for trader in traders:
+                trader.var.money.append(trader.var.money[-1])
+                trader.var.stocks.append(trader.var.stocks[-1])
+                trader.var.wealth.append(trader.var.money[-1] + trader.var.stocks[-1] * orderbook.tick_close_price[-1])
+                trader.var.real_wealth.append(trader.var.money[-1] + trader.var.stocks[-1] * fundamental[-1])
 
         # For simplicity, the fundamental value does not change.
         fundamental.append(fundamental[-1])
 
         # select random sample of active traders
-        active_traders = random.sample(traders, int((parameters['trader_sample_size'])))
+        step = tick - parameters['horizon'] - 1
+        if rng == 'streams':
+            active_traders = [traders[idx] for idx in active_indices[step]]
+        else:
+            active_traders = random.sample(traders, sample_size)
 
         mid_price = np.mean([orderbook.highest_bid_price, orderbook.lowest_ask_price])
         fundamental_component = np.log(fundamental[-1] / mid_price)
 
-        orderbook.returns[-1] = (mid_price - orderbook.tick_close_price[-2]) / orderbook.tick_close_price[-2]
-        chartist_component = np.cumsum(orderbook.returns[:-len(orderbook.returns) - 1:-1]
-                                       ) / np.arange(1., float(len(orderbook.returns) + 1))
-
-        for trader in active_traders:
-            # Cancel any active orders
-            if trader.var.active_orders:
-                for order in trader.var.active_orders:
-                    orderbook.cancel_order(order)
-                trader.var.active_orders = []
+        orderbook.update_last_return((mid_price - orderbook.tick_close_price[-2]) / orderbook.tick_close_price[-2])
 
+        # form expectations and draw order prices for all active traders
+        expected_returns = np.zeros(len(active_traders))
+        variances = np.zeros(len(active_traders))
+        trader_prices = np.zeros(len(active_traders))
+        for idx, trader in enumerate(active_traders):
             # Update trader specific expectations
-            noise_component = parameters['std_noise'] * np.random.randn()
+            if rng == 'streams':
+                noise_component = parameters['std_noise'] * noise[step, idx]
+            else:
+                noise_component = parameters['std_noise'] * np.random.randn()
 
             # Expectation formation
             trader.exp.returns['stocks'] = (
                     trader.var.weight_fundamentalist[-1] * np.divide(1, float(trader.par.horizon) * parameters["fundamentalist_horizon_multiplier"]) * fundamental_component +
-                    trader.var.weight_chartist[-1] * chartist_component[trader.par.horizon - 1] +
+                    trader.var.weight_chartist[-1] * orderbook.mean_return(trader.par.horizon) +
                     trader.var.weight_random[-1] * noise_component)
+            expected_returns[idx] = trader.exp.returns['stocks']
             fcast_price = mid_price * np.exp(trader.exp.returns['stocks'])
-            trader.var.covariance_matrix = calculate_covariance_matrix(orderbook.returns[-trader.par.horizon:],
-                                                                       parameters["std_noise"])
-
-            # employ portfolio optimization algo
-            ideal_trader_weights = portfolio_optimization(trader, tick)
-
-            # Determine price and volume
-            trader_price = np.random.normal(fcast_price, trader.par.spread)
-            position_change = (ideal_trader_weights['stocks'] * (trader.var.stocks[-1] * trader_price + trader.var.money[-1])
-                      ) - (trader.var.stocks[-1] * trader_price)
-            volume = int(div0(position_change, trader_price))
-
-            # Trade:
-            if volume > 0:
-                bid = orderbook.add_bid(trader_price, volume, trader)
-                trader.var.active_orders.append(bid)
-            elif volume < 0:
-                ask = orderbook.add_ask(trader_price, -volume, trader)
-                trader.var.active_orders.append(ask)
-
-            # Match orders in the order-book
-            while True:
-                matched_orders = orderbook.match_orders()
-                if matched_orders is None:
-                    break
-                # execute trade
-                matched_orders[3].owner.sell(matched_orders[1], matched_orders[0] * matched_orders[1])
-                matched_orders[2].owner.buy(matched_orders[1], matched_orders[0] * matched_orders[1])
+            variances[idx] = orderbook.returns_variance(trader.par.horizon, parameters["std_noise"])
+            if rng == 'streams':
+                trader_prices[idx] = fcast_price + trader.par.spread * price_shocks[step, idx]
+            else:
+                trader_prices[idx] = np.random.normal(fcast_price, trader.par.spread)
+
+        # employ portfolio optimization algo
+        if portfolio_solver == 'closed_form':
+            stock_weights = batch_portfolio_optimization(expected_returns, variances,
+                                                         [trader.par.risk_aversion for trader in active_traders])
+        elif portfolio_solver == 'kkt':
+            stock_weights = []
+            for trader, variance in zip(active_traders, variances):
+                trader.var.covariance_matrix = covariance_matrix_from_variance(variance)
+                stock_weights.append(portfolio_optimization(trader, tick)['stocks'])
+        else:
+            raise ValueError("unknown portfolio_solver")
+
+        if order_submission == 'batch':
+            submit_orders_batch(orderbook, active_traders, trader_prices, stock_weights, population, traders_by_name)
+        elif order_submission == 'sequential':
+            for trader, trader_price, stock_weight in zip(active_traders, trader_prices, stock_weights):
+                # Cancel any active orders
+                if trader.var.active_orders:
+                    for order in trader.var.active_orders:
+                        orderbook.cancel_order(order)
+                    trader.var.active_orders = []
+
+                # Determine volume
+                position_change = (stock_weight * (trader.var.stocks[-1] * trader_price + trader.var.money[-1])
+                          ) - (trader.var.stocks[-1] * trader_price)
+                volume = int(div0(position_change, trader_price))
+
+                # Trade:
+                if volume > 0:
+                    bid = orderbook.add_bid(trader_price, volume, trader)
+                    trader.var.active_orders.append(bid)
+                elif volume < 0:
+                    ask = orderbook.add_ask(trader_price, -volume, trader)
+                    trader.var.active_orders.append(ask)
+
+                # Match orders in the order-book
+                while True:
+                    matched_orders = orderbook.match_orders()
+                    if matched_orders is None:
+                        break
+                    # execute trade
+                    matched_orders[3].owner.sell(matched_orders[1], matched_orders[0] * matched_orders[1])
+                    matched_orders[2].owner.buy(matched_orders[1], matched_orders[0] * matched_orders[1])
+        else:
+            raise ValueError("unknown order_submission")
 
         # Clear and update order-book history
+        tick_volume, tick_trades = sum(orderbook.transaction_volumes), len(orderbook.transaction_volumes)
         orderbook.cleanse_book()
         orderbook.fundamental = fundamental
 
+        if recorder is not None:
+            recorder.record_tick(traders, orderbook, fundamental[-1], tick_volume, tick_trades)
+
+        if monitor is not None and monitor.check(orderbook, fundamental[-1], tick_volume):
+            break
+
     print('last mid-price was: ', mid_price)
 
     return traders, orderbook
 
+
+def submit_orders_batch(orderbook, active_traders, trader_prices, stock_weights, population, traders_by_name):
+    """
+    Submit the orders of all active traders with orderbook.submit_batch and settle the resulting fills
+    :param orderbook: object Order book
+    :param active_traders: list of active Agent objects in order of submission
+    :param trader_prices: np.Array of order prices of the active traders
+    :param stock_weights: np.Array of optimal stock weights of the active traders
+    :param population: object TraderPopulation of array-backed traders or None
+    :param traders_by_name: dictionary of trader name to Agent object
+    :return: None
+    """
+    stock_weights = np.asarray(stock_weights)
+    first_pending = 0
+    while first_pending < len(active_traders):
+        # orders of which the owner traded earlier in the tick are resubmitted with updated volumes
+        batch = active_traders[first_pending:]
+        stocks = np.array([trader.var.stocks[-1] for trader in batch])
+        money = np.array([trader.var.money[-1] for trader in batch])
+        prices = trader_prices[first_pending:]
+        position_changes = (stock_weights[first_pending:] * (stocks * prices + money)) - (stocks * prices)
+        volumes = div0_array(position_changes, prices).astype(np.int64)
+
+        fills, submitted = orderbook.submit_batch(prices, volumes, batch)
+        first_pending += submitted
+
+        # execute trades
+        if population is not None:
+            population.settle(fills)
+        else:
+            for price, volume, bid_owner, ask_owner, _ in fills.tolist():
+                traders_by_name[ask_owner].sell(volume, price * volume)
+                traders_by_name[bid_owner].buy(volume, price * volume)
+
+
+def exuberance_inequality_replicates(replicates, parameters, seeds, recorders=None):
+    """
+    Simulate independent replicates of the model in lockstep. Every replicate draws from its own random_streams.
+    Expectations, variances, portfolio weights and order prices of the active traders of all replicates are
+    calculated at once over arrays with a leading replicate axis, only order matching is done per replicate with
+    batch order submission. A replicate follows the same path as exuberance_inequality_model with the same seed and
+    order_submission='batch'.
+    :param replicates: list of (traders, orderbook) tuples, for instance created by init_objects with different seeds
+    :param parameters: dictionary of parameters or ModelConfig
+    :param seeds: list of integer seeds of the random streams of the replicates
+    :param recorders: list of SimulationRecorder objects, one per replicate, or None
+    :return: list of (simulated traders, simulated orderbook) tuples
+    """
+    parameters = ModelConfig.from_dict(parameters)
+    if len(seeds) != len(replicates):
+        raise ValueError("every replicate needs a seed")
+    trader_lists = [list(traders) for traders, orderbook in replicates]
+    orderbooks = [orderbook for traders, orderbook in replicates]
+    populations = [getattr(traders[0].var, 'population', None) for traders in trader_lists]
+    traders_by_name = [{trader.name: trader for trader in traders} for traders in trader_lists]
+    n_traders = len(trader_lists[0])
+    if any(len(traders) != n_traders for traders in trader_lists):
+        raise ValueError("all replicates need the same number of traders")
+    sample_size = int(parameters['trader_sample_size'])
+    rows = np.arange(len(replicates))[:, None]
+
+    # active traders, noise and price shocks of shape (replicates, ticks, sample_size)
+    blocks = [draw_random_blocks(random_streams(seed), parameters["ticks"], n_traders, sample_size) for seed in seeds]
+    active_indices, noise_blocks, price_shock_blocks = [np.array(block) for block in zip(*blocks)]
+
+    # trader properties with a leading replicate axis
+    weight_f = np.array([[trader.var.weight_fundamentalist[-1] for trader in traders] for traders in trader_lists])
+    weight_c = np.array([[trader.var.weight_chartist[-1] for trader in traders] for traders in trader_lists])
+    weight_r = np.array([[trader.var.weight_random[-1] for trader in traders] for traders in trader_lists])
+    horizons = np.array([[trader.par.horizon for trader in traders] for traders in trader_lists])
+    spreads = np.array([[trader.par.spread for trader in traders] for traders in trader_lists])
+    risk_aversions = np.array([[trader.par.risk_aversion for trader in traders] for traders in trader_lists])
+    fundamental_scale = 1 / (horizons * parameters["fundamentalist_horizon_multiplier"])
+
+    fundamentals = [[parameters["fundamental_value"]] for _ in replicates]
+    for orderbook, fundamental in zip(orderbooks, fundamentals):
+        orderbook.tick_close_price.append(fundamental[-1])
+    for recorder, traders, orderbook in zip(recorders or [], trader_lists, orderbooks):
+        recorder.record_tick(traders, orderbook, parameters["fundamental_value"])
+
+    print('Start of simulation ', list(seeds))
+    for tick in range(parameters["ticks"]):
+        # update money and stocks history for agents
+        for traders, orderbook, population, fundamental in zip(trader_lists, orderbooks, populations, fundamentals):
+            if population is not None:
+                population.carry_forward(orderbook.tick_close_price[-1], fundamental[-1])
+            else:
+                for trader in traders:
+                    trader.var.money.append(trader.var.money[-1])
+                    trader.var.stocks.append(trader.var.stocks[-1])
+                    trader.var.wealth.append(trader.var.money[-1] + trader.var.stocks[-1] * orderbook.tick_close_price[-1])
+                    trader.var.real_wealth.append(trader.var.money[-1] + trader.var.stocks[-1] * fundamental[-1])
+            fundamental.append(fundamental[-1])
+
+        # random samples of active traders with their noise and price shocks
+        active = active_indices[:, tick]
+        noise = parameters['std_noise'] * noise_blocks[:, tick]
+        price_shocks = price_shock_blocks[:, tick]
+
+        mid_prices = np.array([np.mean([orderbook.highest_bid_price, orderbook.lowest_ask_price])
+                               for orderbook in orderbooks])
+        fundamental_components = np.log(np.array([fundamental[-1] for fundamental in fundamentals]) / mid_prices)
+        for orderbook, mid_price in zip(orderbooks, mid_prices):
+            orderbook.update_last_return((mid_price - orderbook.tick_close_price[-2]) / orderbook.tick_close_price[-2])
+
+        # expectations, variances, order prices and portfolio weights of all replicates
+        active_horizons = horizons[rows, active]
+        chartist_components = np.array([orderbook.mean_returns(h) for orderbook, h in zip(orderbooks, active_horizons)])
+        variances = np.array([orderbook.returns_variances(h, parameters["std_noise"])
+                              for orderbook, h in zip(orderbooks, active_horizons)])
+        expected_returns = (weight_f[rows, active] * fundamental_scale[rows, active] * fundamental_components[:, None] +
+                            weight_c[rows, active] * chartist_components +
+                            weight_r[rows, active] * noise)
+        trader_prices = mid_prices[:, None] * np.exp(expected_returns) + spreads[rows, active] * price_shocks
+        stock_weights = batch_portfolio_optimization(expected_returns, variances, risk_aversions[rows, active])
+
+        # match orders per replicate
+        for k, orderbook in enumerate(orderbooks):
+            active_traders = [trader_lists[k][idx] for idx in active[k]]
+            for trader, expected_return in zip(active_traders, expected_returns[k]):
+                trader.exp.returns['stocks'] = expected_return
+            submit_orders_batch(orderbook, active_traders, trader_prices[k], stock_weights[k], populations[k],
+                                traders_by_name[k])
+
+            tick_volume, tick_trades = sum(orderbook.transaction_volumes), len(orderbook.transaction_volumes)
+            orderbook.cleanse_book()
+            orderbook.fundamental = fundamentals[k]
+            if recorders is not None:
+                recorders[k].record_tick(trader_lists[k], orderbook, fundamentals[k][-1], tick_volume, tick_trades)
+
+    print('last mid-prices were: ', mid_prices)
+
+    return list(zip(trader_lists, orderbooks))
@@ -0,0 +1,112 @@
+"""Validated, immutable model configuration"""
+
+import collections
+import numbers
+
+# parameter name: (type, default or None if required, lower bound, upper bound)
+PARAMETER_SCHEMA = collections.OrderedDict([
+    ('trader_sample_size', (int, None, 1, None)),
+    ('n_traders', (int, None, 1, None)),
+    ('init_stocks', (int, None, 1, None)),
+    ('ticks', (int, None, 1, None)),
+    ('fundamental_value', (float, None, 0., None)),
+    ('base_risk_aversion', (float, None, 0., None)),
+    ('spread_max', (float, None, 0., None)),
+    ('horizon', (int, None, 11, None)),
+    ('std_noise', (float, None, 0., None)),
+    ('w_random', (float, None, 0., 1.)),
+    ('fundamentalist_horizon_multiplier', (float, None, 0., None)),
+    ('strat_share_chartists', (float, None, 0., 1.)),
+    ('std_fundamental', (float, 0.0, 0., None)),
+    ('mean_reversion', (float, 0.0, None, None)),
+    ('mutation_intensity', (float, 0.0, 0., None)),
+    ('average_learning_ability', (float, 0.0, 0., None)),
+    ('trades_per_tick', (int, 1, 1, None)),
+])
+
+# fields derived from the parameters
+DERIVED_FIELDS = ['max_horizon', 'weight_fundamentalist', 'weight_chartist']
+
+
+class ModelConfig(collections.namedtuple('ModelConfig', list(PARAMETER_SCHEMA) + DERIVED_FIELDS)):
+    """
+    Immutable and hashable model parameters, validated against PARAMETER_SCHEMA when they are created with from_dict.
+    Parameters can be read as attributes or, like the parameter dictionaries used throughout the model, by name:
+    config['ticks']. Derived fields are calculated once:
+    - max_horizon: the longest horizon of a trader plus one, the length of the initial returns series
+    - weight_fundamentalist and weight_chartist: the population shares of the fundamentalist and chartist strategies
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, parameters):
+        """
+        Validate a dictionary of parameters and fill in defaults
+        :param parameters: dictionary of parameters, or a ModelConfig which is returned as it is
+        :return: ModelConfig
+        """
+        if isinstance(parameters, cls):
+            return parameters
+        unknown = set(parameters) - set(PARAMETER_SCHEMA)
+        if unknown:
+            raise ValueError("unknown parameters: {}".format(', '.join(sorted(unknown))))
+        values = {}
+        for name, (kind, default, lower, upper) in PARAMETER_SCHEMA.items():
+            if name not in parameters:
+                if default is None:
+                    raise ValueError("missing parameter: {}".format(name))
+                values[name] = default
+                continue
+            value = parameters[name]
+            if isinstance(value, bool) or not isinstance(value, numbers.Real):
+                raise ValueError("parameter {} must be a number, not {!r}".format(name, value))
+            if kind is int:
+                if int(value) != value:
+                    raise ValueError("parameter {} must be an integer, not {!r}".format(name, value))
+                value = int(value)
+            else:
+                value = float(value)
+            if value != value:
+                raise ValueError("parameter {} is nan".format(name))
+            if lower is not None and value < lower:
+                raise ValueError("parameter {} must be at least {}, not {}".format(name, lower, value))
+            if upper is not None and value > upper:
+                raise ValueError("parameter {} must be at most {}, not {}".format(name, upper, value))
+            values[name] = value
+        for name in ['fundamental_value', 'base_risk_aversion', 'fundamentalist_horizon_multiplier']:
+            if values[name] <= 0:
+                raise ValueError("parameter {} must be positive, not {}".format(name, values[name]))
+        if values['trader_sample_size'] > values['n_traders']:
+            raise ValueError("trader_sample_size can not be larger than n_traders")
+
+        values['max_horizon'] = int(values['horizon'] * values['fundamentalist_horizon_multiplier']) + 1
+        values['weight_fundamentalist'] = (1 - values['strat_share_chartists']) * (1 - values['w_random'])
+        values['weight_chartist'] = values['strat_share_chartists'] * (1 - values['w_random'])
+        return cls(**values)
+
+    def __getitem__(self, key):
+        """
+        :param key: string parameter name, or integer position
+        :return: parameter value
+        """
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+    def replace(self, **changes):
+        """
+        :param changes: new parameter values
+        :return: validated ModelConfig with the changed parameters
+        """
+        parameters = self.to_dict()
+        parameters.update(changes)
+        return ModelConfig.from_dict(parameters)
+
+    def to_dict(self):
+        """
+        :return: dictionary of the parameters, without the derived fields
+        """
+        return {name: getattr(self, name) for name in PARAMETER_SCHEMA}
@@ -0,0 +1,79 @@
+"""Checkpoints at which a simulation that can no longer be competitive is stopped early"""
+
+import numpy as np
+
+
+class CheckpointMonitor:
+    """
+    Checks a simulation every few ticks and stops it when its outcome is only needed if it is below a threshold, and
+    it is already clear that it will not be: the lower confidence bound of the loss of the full run, estimated from
+    the ticks so far, exceeds the threshold. A stopped run reports that bound as its censored loss.
+    Divergence is recorded but does not stop a run, because the loss is calculated from scale free moments and a
+    diverging run can still have a low loss:
+    - explosive prices: the close price is not finite or outside price_bounds times the fundamental value
+    - no trading: nothing was traded since the previous checkpoint
+    A monitor without a finite threshold never stops a simulation.
+    """
+    def __init__(self, threshold=np.inf, bound=None, every=50, min_ticks=100, price_bounds=(0.1, 10.)):
+        """
+        Initialize monitor
+        :param threshold: float loss above which the exact loss of the run is not needed
+        :param bound: function of the order book which returns a lower confidence bound of the loss of the full run,
+        or None to only record divergence
+        :param every: integer number of ticks between checkpoints
+        :param min_ticks: integer number of ticks before which the bound is not calculated
+        :param price_bounds: tuple of the lowest and highest close price relative to the fundamental value
+        """
+        self.threshold = threshold
+        self.bound = bound
+        self.every = every
+        self.min_ticks = min_ticks
+        self.price_bounds = price_bounds
+        self.ticks = 0
+        self.volume = 0
+        self.partial_loss = None
+        self.stopped_at = None
+        self.reason = None
+        self.diverged_at = None
+        self.divergence = None
+
+    def check(self, orderbook, fundamental, volume):
+        """
+        Record a simulated tick and, at a checkpoint, decide whether the simulation is stopped
+        :param orderbook: object Order book
+        :param fundamental: float fundamental value
+        :param volume: integer traded volume in the tick
+        :return: True if the simulation is stopped
+        """
+        self.ticks += 1
+        self.volume += volume
+        if self.ticks % self.every or not np.isfinite(self.threshold):
+            return False
+
+        close = orderbook.tick_close_price[-1]
+        lowest, highest = self.price_bounds[0] * fundamental, self.price_bounds[1] * fundamental
+        divergence = None
+        if not np.isfinite(close) or not lowest <= close <= highest:
+            divergence = 'explosive prices'
+        elif self.volume == 0:
+            divergence = 'no trading'
+        if divergence is not None and self.divergence is None:
+            self.divergence, self.diverged_at = divergence, self.ticks
+        self.volume = 0
+
+        if self.bound is not None and self.ticks >= self.min_ticks:
+            self.partial_loss = self.bound(orderbook)
+            if np.isfinite(self.partial_loss) and self.partial_loss > self.threshold:
+                self.reason = 'partial loss'
+                self.stopped_at = self.ticks
+                return True
+        return False
+
+    def censored_loss(self):
+        """
+        :return: float lower confidence bound of the loss reported for a stopped simulation, which exceeds the
+        threshold, or None if it was not stopped
+        """
+        if self.stopped_at is None:
+            return None
+        return self.partial_loss
@@ -1,9 +1,20 @@
 """Limit orderbook updated from Schasfoort & Stockermans 2017"""
 
 import bisect
+import collections
+import heapq
+import itertools
 import operator
 import numpy as np
 
+# aggregated market data over one or more ticks, see LimitOrderBook.tick_summaries
+SUMMARY_DTYPE = np.dtype([('tick', np.int64), ('close', np.float64), ('volume', np.int64),
+                          ('highest_bid', np.float64), ('lowest_ask', np.float64), ('trades', np.int64)])
+
+# record of a single transaction returned by LimitOrderBook.submit_batch
+FILL_DTYPE = np.dtype([('price', np.float64), ('volume', np.int64), ('bid_owner', np.int64),
+                       ('ask_owner', np.int64), ('order', np.int64)])
+
 
 class LimitOrderBook:
     """
@@ -14,24 +25,42 @@ class LimitOrderBook:
     1. A bids book which contains orders of type 'bid'
     2. An asks book which contains orders of type 'ask'
     """
-    def __init__(self, last_price, spread_max, max_return_interval, order_expiration):
+    def __init__(self, last_price, spread_max, max_return_interval, order_expiration, retention='full',
+                 summary_interval=1):
         """
         Initialize order-book class
         :param last_price: float initial price
         :param spread_max: float initial spread used to initialize highest bid and ask
         :param max_return_interval: integer length of initial returns series
         :param order_expiration: integer amount of periods after which orders are deleted from the book
+        :param retention: string 'full' to keep the complete price, return, volume and bid-ask histories or 'bounded'
+        to keep only the last max_return_interval returns and close prices in ring buffers, and tick summaries
+        :param summary_interval: integer number of ticks aggregated in one tick summary
         """
+        if retention not in ['full', 'bounded']:
+            raise ValueError("unknown retention")
+        self.retention = retention
+        self.max_return_interval = max_return_interval
+        self.summary_interval = summary_interval
+        self.summaries = []
+        self._summary = None
+        # close prices before the first tick summary, which bounded retention does not keep otherwise
+        self.initial_close_prices = None
         self.bids = []
         self.asks = []
         self.order_expiration = order_expiration
+        self.current_tick = 0
+        self.order_ids = itertools.count()
+        # resting orders bucketed by the tick at which they expire, so expiry only touches expiring orders
+        self.expiry_buckets = collections.defaultdict(dict)
         self.highest_bid_price = last_price - (spread_max / 2)
         self.lowest_ask_price = last_price + (spread_max / 2)
-        self.tick_close_price = [np.mean([self.highest_bid_price, self.lowest_ask_price])]
+        self.tick_close_price = self.history_buffer([np.mean([self.highest_bid_price, self.lowest_ask_price])])
 
         # historical prices, volumes, and returns for the tick
         self.transaction_prices = []
         self.transaction_volumes = []
+        self.return_moments = RollingReturnMoments(maxlen=max_return_interval if retention == 'bounded' else None)
         self.returns = [0 for i in range(max_return_interval)]
 
         # historical prices, volumes, for the total simulation
@@ -44,6 +73,109 @@ class LimitOrderBook:
         self.sentiment = []
         self.sentiment_history = []
 
+    @property
+    def returns(self):
+        """List of tick returns"""
+        return self._returns
+
+    @returns.setter
+    def returns(self, returns):
+        """Replace the returns series and rebuild the rolling return moments"""
+        self._returns = self.history_buffer(returns)
+        self.return_moments.reset(self._returns)
+
+    def history_buffer(self, values):
+        """
+        :param values: iterable of initial values
+        :return: list of the values, or a ring buffer of the last max_return_interval values if retention is bounded
+        """
+        if self.retention == 'bounded':
+            return collections.deque(values, maxlen=self.max_return_interval + 1)
+        return list(values)
+
+    def record_tick_summary(self, close, volume, trades):
+        """
+        Add the market data of a tick to the current tick summary and store it every summary_interval ticks
+        :param close: float close price of the tick
+        :param volume: integer traded volume in the tick
+        :param trades: integer number of transactions in the tick
+        :return: None
+        """
+        if self.initial_close_prices is None:
+            self.initial_close_prices = list(self.tick_close_price)[:-1]
+        if self._summary is None:
+            self._summary = [0, 0., 0, 0., 0., 0]
+        self._summary[0] = self.current_tick
+        self._summary[1] = close
+        self._summary[2] += volume
+        self._summary[3] = self.highest_bid_price
+        self._summary[4] = self.lowest_ask_price
+        self._summary[5] += trades
+        if self.current_tick % self.summary_interval == 0:
+            self.summaries.append(tuple(self._summary))
+            self._summary = None
+
+    def tick_summaries(self):
+        """
+        :return: structured np.Array (SUMMARY_DTYPE) with the close price, volume, best bid and ask and number of
+        trades per summary interval, including the last interval if it is not complete yet
+        """
+        if self._summary is not None:
+            return np.array(self.summaries + [tuple(self._summary)], dtype=SUMMARY_DTYPE)
+        return np.array(self.summaries, dtype=SUMMARY_DTYPE)
+
+    def close_prices(self):
+        """
+        :return: list of the close prices of all ticks, including the initial close prices, the same for full and
+        bounded retention if tick summaries are recorded every tick
+        """
+        if self.retention == 'bounded':
+            return list(self.initial_close_prices or []) + self.tick_summaries()['close'].tolist()
+        return list(self.tick_close_price)
+
+    def update_last_return(self, value):
+        """
+        Overwrite the most recent return, keeping the rolling return moments in sync
+        :param value: float new value of the last return
+        :return: None
+        """
+        self._returns[-1] = value
+        self.return_moments.replace_last(value)
+
+    def mean_return(self, horizon):
+        """
+        Mean of the last `horizon` returns, read in O(1) from the rolling return moments
+        :param horizon: integer number of most recent returns to include
+        :return: float mean return
+        """
+        return self.return_moments.mean(horizon)
+
+    def returns_variance(self, horizon, base_historical_variance):
+        """
+        Variance of the last `horizon` returns, read in O(1) from the rolling return moments
+        :param horizon: integer number of most recent returns to include
+        :param base_historical_variance: float variance used when the price series is flat
+        :return: float variance of the returns
+        """
+        return self.return_moments.variance(horizon, base_historical_variance)
+
+    def mean_returns(self, horizons):
+        """
+        Mean of the last `horizon` returns for an array of horizons
+        :param horizons: np.Array of integer numbers of most recent returns to include
+        :return: np.Array of mean returns
+        """
+        return self.return_moments.means(horizons)
+
+    def returns_variances(self, horizons, base_historical_variance):
+        """
+        Variance of the last `horizon` returns for an array of horizons
+        :param horizons: np.Array of integer numbers of most recent returns to include
+        :param base_historical_variance: float variance used when the price series is flat
+        :return: np.Array of variances of the returns
+        """
+        return self.return_moments.variances(horizons, base_historical_variance)
+
     def add_bid(self, price, volume, agent):
         """
         Add a bid to the (price low-high, age young-old) sorted bids book
@@ -52,7 +184,7 @@ class LimitOrderBook:
         :param agent: object agent which issues the bid
         :return: object bid
         """
-        bid = Order(order_type='b', owner=agent, price=price, volume=volume)
+        bid = self.new_order('b', agent, price, volume)
         bisect.insort_left(self.bids, bid)
         self.update_bid_ask_spread('bid')
         return bid
@@ -65,7 +197,7 @@ class LimitOrderBook:
         :param agent: object agent which issues the ask
         :return: object ask
         """
-        ask = Order(order_type='a', owner=agent, price=price, volume=volume)
+        ask = self.new_order('a', agent, price, volume)
         bisect.insort_right(self.asks, ask)
         self.update_bid_ask_spread('ask')
         return ask
@@ -76,9 +208,53 @@ class LimitOrderBook:
         :param order: class Order
         :return: None
         """
-        for book in [self.bids, self.asks]:
-            if order in book:
-                book.remove(order)
+        book = self.bids if order.order_type == 'b' else self.asks
+        # search only the run of orders with the same price
+        for idx in range(bisect.bisect_left(book, order), bisect.bisect_right(book, order)):
+            if book[idx] is order:
+                del book[idx]
+                self.forget_order(order)
+                break
+
+    def submit_batch(self, prices, volumes, owners, cancel_active=True):
+        """
+        Let a sequence of orders arrive at the book one after the other, matching the book after every arrival.
+        Submission stops early when a fill involves the owner of a later order in the batch, because the holdings
+        that owner based its order volume on have changed. The remaining orders can then be resubmitted.
+        :param prices: np.Array of order prices
+        :param volumes: np.Array of signed order volumes, positive for bids, negative for asks and zero for no order
+        :param owners: list of agents which issue the orders, identified in the fills by their name
+        :param cancel_active: boolean, if True the active orders of an owner are cancelled before its order arrives
+        :return: structured np.Array of fills (FILL_DTYPE), integer number of submitted orders
+        """
+        fills = []
+        pending_owners = collections.Counter(id(owner) for owner in owners)
+        submitted = 0
+        for price, volume, owner in zip(prices, volumes, owners):
+            pending_owners[id(owner)] -= 1
+            if cancel_active and owner.var.active_orders:
+                for order in owner.var.active_orders:
+                    self.cancel_order(order)
+                owner.var.active_orders = []
+
+            if volume > 0:
+                owner.var.active_orders.append(self.add_bid(price, int(volume), owner))
+            elif volume < 0:
+                owner.var.active_orders.append(self.add_ask(price, -int(volume), owner))
+
+            stale = False
+            while True:
+                matched_orders = self.match_orders()
+                if matched_orders is None:
+                    break
+                bid_owner, ask_owner = matched_orders[2].owner, matched_orders[3].owner
+                fills.append((matched_orders[0], matched_orders[1], bid_owner.name, ask_owner.name, submitted))
+                stale = stale or pending_owners[id(bid_owner)] > 0 or pending_owners[id(ask_owner)] > 0
+            submitted += 1
+            if stale:
+                break
+
+        return np.array(fills, dtype=FILL_DTYPE), submitted
 
     def cleanse_book(self):
         """
@@ -86,25 +262,25 @@ class LimitOrderBook:
         variables.
         :return: None
         """
-        # store and clean recorded transaction prices
-        if len(self.transaction_prices):
-            self.transaction_prices_history.append(self.transaction_prices)
-        self.transaction_prices = []
+        tick_volume = sum(self.transaction_volumes)
+        tick_trades = len(self.transaction_volumes)
+        if self.retention == 'full':
+            # store and clean recorded transaction prices
+            if len(self.transaction_prices):
+                self.transaction_prices_history.append(self.transaction_prices)
 
-        # store and clean recorded transaction volumes
-        self.transaction_volumes_history.append(self.transaction_volumes)
-        self.transaction_volumes = []
+            # store recorded transaction volumes
+            self.transaction_volumes_history.append(self.transaction_volumes)
+
+            # store sentiment data
+            self.sentiment_history.append(self.sentiment)
 
-        # story and clean sentiment data
-        self.sentiment_history.append(self.sentiment)
+        # clean transaction and sentiment data
+        self.transaction_prices = []
+        self.transaction_volumes = []
         self.sentiment = []
 
-        # increase the age of all orders by 1
-        for book in [self.bids, self.asks]:
-            for order in book:
-                order.age += 1
-                if order.age > self.order_expiration:
-                    book.remove(order)
+        self.expire_orders()
 
         # update current highest bid and lowest ask
         for order_type in ['bid', 'ask']:
@@ -114,7 +290,73 @@ class LimitOrderBook:
         self.tick_close_price.append(np.mean([self.highest_bid_price, self.lowest_ask_price]))
 
         # update returns
-        self.returns.append((self.tick_close_price[-1] - self.tick_close_price[-2]) / self.tick_close_price[-2])
+        self._returns.append((self.tick_close_price[-1] - self.tick_close_price[-2]) / self.tick_close_price[-2])
+        self.return_moments.append(self._returns[-1])
+
+        self.record_tick_summary(self.tick_close_price[-1], tick_volume, tick_trades)
+
+    def new_order(self, order_type, agent, price, volume):
+        """
+        Create an order for the current tick and register it in the bucket of the tick at which it expires
+        :param order_type: string 'b' for bid or 'a' for ask
+        :param agent: object agent which issues the order
+        :param price: float price of the order
+        :param volume: integer volume of the order
+        :return: object Order
+        """
+        order = Order(order_type=order_type, owner=agent, price=price, volume=volume,
+                      order_id=next(self.order_ids), book=self)
+        self.expiry_buckets[self.expiry_tick(order)][order.order_id] = order
+        return order
+
+    def expiry_tick(self, order):
+        """
+        :param order: object Order
+        :return: integer tick at which the age of the order exceeds the order expiration
+        """
+        return order.placed_at + self.order_expiration + 1
+
+    def forget_order(self, order):
+        """
+        Remove an order which left the book from its expiry bucket
+        :param order: object Order
+        :return: None
+        """
+        bucket = self.expiry_buckets.get(self.expiry_tick(order))
+        if bucket is not None:
+            bucket.pop(order.order_id, None)
+            if not bucket:
+                del self.expiry_buckets[self.expiry_tick(order)]
+
+    def expire_orders(self):
+        """
+        Increase the age of all orders by 1 and remove the orders which are older than the order expiration.
+        Only the orders in the expiry bucket of the new tick are touched.
+        :return: None
+        """
+        self.current_tick += 1
+        for order in list(self.expiry_buckets.pop(self.current_tick, {}).values()):
+            self.cancel_order(order)
+
+    def best_bid(self):
+        """
+        :return: object highest (and oldest at that price) bid or None if the bids book is empty
+        """
+        return self.bids[-1] if self.bids else None
+
+    def best_ask(self):
+        """
+        :return: object lowest (and oldest at that price) ask or None if the asks book is empty
+        """
+        return self.asks[0] if self.asks else None
+
+    def remove_best_bid(self):
+        """Delete the best bid from the bids book"""
+        self.forget_order(self.bids.pop())
+
+    def remove_best_ask(self):
+        """Delete the best ask from the asks book"""
+        self.forget_order(self.asks.pop(0))
 
     def match_orders(self):
         """
@@ -122,13 +364,13 @@ class LimitOrderBook:
         :return: None
         """
         # First, make sure that neither the bids or asks books are empty
-        if not (self.bids and self.asks):
+        winning_bid = self.best_bid()
+        winning_ask = self.best_ask()
+        if winning_bid is None or winning_ask is None:
             return None
 
         # Then, match highest bid with lowest ask
-        if self.bids[-1].price >= self.asks[0].price:
-            winning_bid = self.bids[-1]
-            winning_ask = self.asks[0]
+        if winning_bid.price >= winning_ask.price:
             price = winning_ask.price
             # The volume is the minimum of the bid and ask
             min_index, volume = min(enumerate([winning_bid.volume, winning_ask.volume]), key=operator.itemgetter(1))
@@ -138,24 +380,24 @@ class LimitOrderBook:
                 for order in [winning_bid, winning_ask]:
                     order.owner.var.active_orders = []
                 # remove these elements from list
-                del self.bids[-1]
-                del self.asks[0]
+                self.remove_best_bid()
+                self.remove_best_ask()
                 # update current highest bid and lowest ask
                 for order_type in ['bid', 'ask']:
                     self.update_bid_ask_spread(order_type)
             else:
                 # decrease volume for both bid and ask
-                self.asks[0].volume -= volume
-                self.bids[-1].volume -= volume
+                winning_ask.volume -= volume
+                winning_bid.volume -= volume
                 # delete the empty bid or ask
                 if min_index == 0:
-                    self.bids[-1].owner.var.active_orders = []
-                    del self.bids[-1]
+                    winning_bid.owner.var.active_orders = []
+                    self.remove_best_bid()
                     # update current highest bid
                     self.update_bid_ask_spread('bid')
                 else:
-                    self.asks[0].owner.var.active_orders = []
-                    del self.asks[0]
+                    winning_ask.owner.var.active_orders = []
+                    self.remove_best_ask()
                     # update current lowest ask
                     self.update_bid_ask_spread('ask')
             self.transaction_prices.append(price)
@@ -172,14 +414,20 @@ class LimitOrderBook:
         if ('ask' not in order_type) and ('bid' not in order_type):
             raise ValueError("unknown order_type")
 
-        if order_type == 'ask' and self.asks:
-            self.lowest_ask_price_history.append(self.lowest_ask_price)
-            self.highest_bid_price_history.append(self.highest_bid_price)
-            self.lowest_ask_price = self.asks[0].price
-        if order_type == 'bid' and self.bids:
-            self.highest_bid_price_history.append(self.highest_bid_price)
-            self.lowest_ask_price_history.append(self.lowest_ask_price)
-            self.highest_bid_price = self.bids[-1].price
+        if order_type == 'ask':
+            best_ask = self.best_ask()
+            if best_ask is not None:
+                if self.retention == 'full':
+                    self.lowest_ask_price_history.append(self.lowest_ask_price)
+                    self.highest_bid_price_history.append(self.highest_bid_price)
+                self.lowest_ask_price = best_ask.price
+        if order_type == 'bid':
+            best_bid = self.best_bid()
+            if best_bid is not None:
+                if self.retention == 'full':
+                    self.highest_bid_price_history.append(self.highest_bid_price)
+                    self.lowest_ask_price_history.append(self.lowest_ask_price)
+                self.highest_bid_price = best_bid.price
 
     def __repr__(self):
         """
@@ -188,14 +436,295 @@ class LimitOrderBook:
         return "order_book"
 
 
+class PriceLevelOrderBook(LimitOrderBook):
+    """
+    Limit-orderbook with the same interface and price-time priority as LimitOrderBook, but which stores orders in
+    first-in-first-out buckets per price level. The best price levels are kept in heaps and all resting orders are
+    indexed by order id, so that adding an order costs O(log n) and cancelling it O(1).
+    """
+    def __init__(self, last_price, spread_max, max_return_interval, order_expiration, retention='full',
+                 summary_interval=1):
+        """
+        Initialize order-book class
+        :param last_price: float initial price
+        :param spread_max: float initial spread used to initialize highest bid and ask
+        :param max_return_interval: integer length of initial returns series
+        :param order_expiration: integer amount of periods after which orders are deleted from the book
+        :param retention: string 'full' or 'bounded', see LimitOrderBook
+        :param summary_interval: integer number of ticks aggregated in one tick summary
+        """
+        self._bid_levels = {}
+        self._ask_levels = {}
+        self._bid_prices = []
+        self._ask_prices = []
+        self._orders = {}
+        super().__init__(last_price, spread_max, max_return_interval, order_expiration, retention, summary_interval)
+
+    @property
+    def bids(self):
+        """List of bids sorted like LimitOrderBook.bids (price low-high, age young-old)"""
+        return [order for price in sorted(self._bid_levels) for order in reversed(self._bid_levels[price].values())]
+
+    @bids.setter
+    def bids(self, orders):
+        """Replace the bids book by a (price low-high, age young-old) sorted list of bids"""
+        self._clear_side(self._bid_levels, self._bid_prices)
+        for order in reversed(list(orders)):
+            self._insert(order, self._bid_levels, self._bid_prices, -order.price)
+
+    @property
+    def asks(self):
+        """List of asks sorted like LimitOrderBook.asks (price low-high, age old-young)"""
+        return [order for price in sorted(self._ask_levels) for order in self._ask_levels[price].values()]
+
+    @asks.setter
+    def asks(self, orders):
+        """Replace the asks book by a (price low-high, age old-young) sorted list of asks"""
+        self._clear_side(self._ask_levels, self._ask_prices)
+        for order in orders:
+            self._insert(order, self._ask_levels, self._ask_prices, order.price)
+
+    def __len__(self):
+        """:return: integer number of resting orders"""
+        return len(self._orders)
+
+    def _clear_side(self, levels, prices):
+        for level in levels.values():
+            for order in level.values():
+                del self._orders[order.order_id]
+                self.forget_order(order)
+        levels.clear()
+        del prices[:]
+
+    def _insert(self, order, levels, prices, heap_key):
+        """Append an order to the back of the queue at its price level"""
+        if order.order_id is None:
+            order.order_id = next(self.order_ids)
+        level = levels.get(order.price)
+        if level is None:
+            level = levels[order.price] = collections.OrderedDict()
+            heapq.heappush(prices, heap_key)
+        level[order.order_id] = order
+        self._orders[order.order_id] = order
+
+    def _best_level(self, levels, prices, sign):
+        """Return the best non-empty price level, discarding stale heap entries of emptied levels"""
+        while prices:
+            level = levels.get(sign * prices[0])
+            if level:
+                return level
+            heapq.heappop(prices)
+        return None
+
+    def _remove(self, order):
+        """Remove a resting order from its price level"""
+        levels = self._bid_levels if order.order_type == 'b' else self._ask_levels
+        level = levels[order.price]
+        del level[order.order_id]
+        del self._orders[order.order_id]
+        self.forget_order(order)
+        if not level:
+            # the stale heap entry of this price is discarded lazily
+            del levels[order.price]
+            prices = self._bid_prices if order.order_type == 'b' else self._ask_prices
+            if len(prices) > 2 * len(levels) + 64:
+                # compact heaps that hold mostly stale price levels
+                sign = -1 if order.order_type == 'b' else 1
+                prices[:] = [sign * price for price in levels]
+                heapq.heapify(prices)
+
+    def add_bid(self, price, volume, agent):
+        """
+        Add a bid to the bids book
+        :param price: float price of the bid
+        :param volume: integer volume of the bid
+        :param agent: object agent which issues the bid
+        :return: object bid
+        """
+        bid = self.new_order('b', agent, price, volume)
+        self._insert(bid, self._bid_levels, self._bid_prices, -price)
+        self.update_bid_ask_spread('bid')
+        return bid
+
+    def add_ask(self, price, volume, agent):
+        """
+        Add an ask to the asks book
+        :param price: float price of the ask
+        :param volume: integer volume of the ask
+        :param agent: object agent which issues the ask
+        :return: object ask
+        """
+        ask = self.new_order('a', agent, price, volume)
+        self._insert(ask, self._ask_levels, self._ask_prices, price)
+        self.update_bid_ask_spread('ask')
+        return ask
+
+    def cancel_order(self, order):
+        """
+        Removes a particular order from the order book
+        :param order: class Order
+        :return: None
+        """
+        if self._orders.get(order.order_id) is order:
+            self._remove(order)
+
+    def best_bid(self):
+        """
+        :return: object highest (and oldest at that price) bid or None if the bids book is empty
+        """
+        level = self._best_level(self._bid_levels, self._bid_prices, -1)
+        return next(iter(level.values())) if level else None
+
+    def best_ask(self):
+        """
+        :return: object lowest (and oldest at that price) ask or None if the asks book is empty
+        """
+        level = self._best_level(self._ask_levels, self._ask_prices, 1)
+        return next(iter(level.values())) if level else None
+
+    def remove_best_bid(self):
+        """Delete the best bid from the bids book"""
+        self._remove(self.best_bid())
+
+    def remove_best_ask(self):
+        """Delete the best ask from the asks book"""
+        self._remove(self.best_ask())
+
+
+ORDERBOOK_TYPES = {'sorted_list': LimitOrderBook, 'price_level': PriceLevelOrderBook}
+
+
+class RollingReturnMoments:
+    """
+    Keeps prefix sums of returns and squared returns so that the mean and variance of the most recent returns
+    can be read for any horizon in constant time.
+    """
+    def __init__(self, returns=(), maxlen=None):
+        """
+        Initialize the prefix sums
+        :param returns: list of initial returns
+        :param maxlen: integer maximum horizon to support, None keeps the prefix sums of all returns
+        """
+        self.maxlen = maxlen
+        self.reset(returns)
+
+    def reset(self, returns):
+        """
+        Rebuild the prefix sums from a returns series
+        :param returns: list of returns
+        :return: None
+        """
+        if self.maxlen is None:
+            self.sums = [0.0]
+            self.squared_sums = [0.0]
+        else:
+            self.sums = collections.deque([0.0], maxlen=self.maxlen + 1)
+            self.squared_sums = collections.deque([0.0], maxlen=self.maxlen + 1)
+        self.appended = 0
+        for r in returns:
+            self.append(r)
+
+    def append(self, r):
+        """
+        Add a new return
+        :param r: float return
+        :return: None
+        """
+        self.sums.append(self.sums[-1] + r)
+        self.squared_sums.append(self.squared_sums[-1] + r * r)
+        self.appended += 1
+        if self.maxlen is not None and self.appended % (self.maxlen + 1) == 0:
+            self.rebase()
+
+    def rebase(self):
+        """
+        Subtract the oldest prefix sums from the ring buffers, so the sums do not grow without bound
+        :return: None
+        """
+        base, squared_base = self.sums[0], self.squared_sums[0]
+        self.sums = collections.deque([x - base for x in self.sums], maxlen=self.maxlen + 1)
+        self.squared_sums = collections.deque([x - squared_base for x in self.squared_sums], maxlen=self.maxlen + 1)
+
+    def replace_last(self, r):
+        """
+        Overwrite the most recent return
+        :param r: float return
+        :return: None
+        """
+        self.sums[-1] = self.sums[-2] + r
+        self.squared_sums[-1] = self.squared_sums[-2] + r * r
+
+    def __len__(self):
+        return len(self.sums) - 1
+
+    def mean(self, horizon):
+        """
+        Mean of the last `horizon` returns
+        :param horizon: integer number of most recent returns
+        :return: float mean return
+        """
+        n = min(horizon, len(self))
+        return (self.sums[-1] - self.sums[-1 - n]) / n
+
+    def variance(self, horizon, base_historical_variance):
+        """
+        Sample variance (ddof=1) of the last `horizon` returns
+        :param horizon: integer number of most recent returns
+        :param base_historical_variance: float variance returned if the returns are flat
+        :return: float variance
+        """
+        n = min(horizon, len(self))
+        total = self.sums[-1] - self.sums[-1 - n]
+        squared_total = self.squared_sums[-1] - self.squared_sums[-1 - n]
+        variance = (squared_total - total * total / n) / (n - 1)
+        if variance <= 0.:
+            # If the price is stationary, revert to base historical variance
+            return base_historical_variance
+        return variance
+
+    def means(self, horizons):
+        """
+        Mean of the last `horizon` returns for an array of horizons, with the same arithmetic as mean
+        :param horizons: np.Array of integer numbers of most recent returns
+        :return: np.Array of mean returns
+        """
+        n = np.minimum(horizons, len(self))
+        starts = np.array([self.sums[-1 - x] for x in n.tolist()])
+        return (self.sums[-1] - starts) / n
+
+    def variances(self, horizons, base_historical_variance):
+        """
+        Sample variance (ddof=1) of the last `horizon` returns for an array of horizons, with the same arithmetic
+        as variance
+        :param horizons: np.Array of integer numbers of most recent returns
+        :param base_historical_variance: float variance returned if the returns are flat
+        :return: np.Array of variances
+        """
+        n = np.minimum(horizons, len(self))
+        offsets = n.tolist()
+        total = self.sums[-1] - np.array([self.sums[-1 - x] for x in offsets])
+        squared_total = self.squared_sums[-1] - np.array([self.squared_sums[-1 - x] for x in offsets])
+        variance = (squared_total - total * total / n) / (n - 1)
+        return np.where(variance <= 0., base_historical_variance, variance)
+
+
 class Order:
     """The order class can represent both bid or ask type orders"""
-    def __init__(self, order_type, owner, price, volume):
+    def __init__(self, order_type, owner, price, volume, order_id=None, book=None):
         self.order_type = order_type
         self.owner = owner
         self.price = price
         self.volume = volume
-        self.age = 0
+        self.order_id = order_id
+        self.book = book
+        self.placed_at = book.current_tick if book is not None else 0
+
+    @property
+    def age(self):
+        """Number of periods the order has been in the book"""
+        if self.book is None:
+            return 0
+        return self.book.current_tick - self.placed_at
 
     def __lt__(self, other):
         """Allows comparison to other orders based on price"""
@@ -0,0 +1,159 @@
+"""Columnar recorder of per-tick market data and per-trader wealth panels"""
+
+import os
+import numpy as np
+
+MARKET_SERIES = ['close', 'volume', 'trades', 'highest_bid', 'lowest_ask', 'fundamental']
+TRADER_PANELS = ['money', 'stocks', 'wealth', 'real_wealth']
+
+
+class SimulationRecorder:
+    """
+    Records the market series and the trader panels of a simulation into preallocated arrays.
+    Row 0 holds the initial state and row t the state at the end of tick t. Market series have shape (ticks + 1,)
+    and trader panels shape (ticks + 1, n_traders), with wealth valued at the close price of the tick and real wealth
+    at the fundamental value. Optionally, the inequality measures of the wealth are recorded as market series.
+    """
+    def __init__(self, n_traders, ticks, panels=TRADER_PANELS, inequality=None):
+        """
+        Initialize recorder arrays
+        :param n_traders: integer number of traders
+        :param ticks: integer number of ticks that will be simulated
+        :param panels: list of trader panels to record, a subset of TRADER_PANELS
+        :param inequality: object IncrementalInequality with which the inequality measures of the wealth of every
+        tick are recorded, or None
+        """
+        self.tick = -1
+        self.ticks = ticks
+        self.inequality = inequality
+        self.series = {name: np.full(ticks + 1, np.nan) for name in MARKET_SERIES}
+        self.series['volume'] = np.zeros(ticks + 1, dtype=np.int64)
+        self.series['trades'] = np.zeros(ticks + 1, dtype=np.int64)
+        self.panels = {name: np.zeros((ticks + 1, n_traders)) for name in panels}
+
+    def record_tick(self, traders, orderbook, fundamental, volume=0, trades=0):
+        """
+        Record the current state of the market and the traders in the next row
+        :param traders: list of Agent objects
+        :param orderbook: object Order book
+        :param fundamental: float fundamental value
+        :param volume: integer traded volume in the tick
+        :param trades: integer number of transactions in the tick
+        :return: None
+        """
+        self.tick += 1
+        t = self.tick
+        close = orderbook.tick_close_price[-1]
+        self.series['close'][t] = close
+        self.series['volume'][t] = volume
+        self.series['trades'][t] = trades
+        self.series['highest_bid'][t] = orderbook.highest_bid_price
+        self.series['lowest_ask'][t] = orderbook.lowest_ask_price
+        self.series['fundamental'][t] = fundamental
+
+        population = getattr(traders[0].var, 'population', None)
+        if population is not None:
+            money = population.money[:, population.tick]
+            stocks = population.stocks[:, population.tick]
+        else:
+            money = np.array([trader.var.money[-1] for trader in traders])
+            stocks = np.array([trader.var.stocks[-1] for trader in traders])
+        self._record_panels(t, money, stocks, close, fundamental)
+
+    def record_history(self, traders, orderbook):
+        """
+        Fill the rows of all simulated ticks at once, from the tick summaries of an order book and the histories of
+        traders which have already been simulated
+        :param traders: list of simulated Agent objects
+        :param orderbook: object simulated Order book
+        :return: None
+        """
+        if orderbook.summary_interval != 1:
+            raise ValueError("recording a history requires a tick summary of every tick")
+        summaries = orderbook.tick_summaries()
+        population = getattr(traders[0].var, 'population', None)
+        for row in summaries:
+            t = int(row['tick'])
+            self.series['close'][t] = row['close']
+            self.series['volume'][t] = row['volume']
+            self.series['trades'][t] = row['trades']
+            self.series['highest_bid'][t] = row['highest_bid']
+            self.series['lowest_ask'][t] = row['lowest_ask']
+            self.series['fundamental'][t] = orderbook.fundamental[t]
+            if population is not None:
+                money, stocks = population.money[:, t], population.stocks[:, t]
+            else:
+                money = np.array([trader.var.money[t] for trader in traders])
+                stocks = np.array([trader.var.stocks[t] for trader in traders])
+            self._record_panels(t, money, stocks, row['close'], orderbook.fundamental[t])
+            self.tick = max(self.tick, t)
+
+    def _record_panels(self, t, money, stocks, close, fundamental):
+        for name, values in [('money', money), ('stocks', stocks)]:
+            if name in self.panels:
+                self.panels[name][t] = values
+        if 'wealth' in self.panels:
+            self.panels['wealth'][t] = money + stocks * close
+        if 'real_wealth' in self.panels:
+            self.panels['real_wealth'][t] = money + stocks * fundamental
+        if self.inequality is not None:
+            for name, value in self.inequality.update(money + stocks * close).items():
+                if name not in self.series:
+                    self.series[name] = np.full(self.ticks + 1, np.nan)
+                self.series[name][t] = value
+
+    def columns(self):
+        """
+        :return: dictionary of all recorded arrays, truncated to the recorded ticks
+        """
+        columns = {name: values[:self.tick + 1] for name, values in self.series.items()}
+        columns.update({name: values[:self.tick + 1] for name, values in self.panels.items()})
+        return columns
+
+    def to_npz(self, path):
+        """
+        Export the recorded arrays to an uncompressed .npz archive
+        :param path: string file name
+        :return: None
+        """
+        np.savez(path, **self.columns())
+
+    def to_npy_dir(self, directory):
+        """
+        Export every recorded array to its own .npy file, so that they can be memory-mapped by load_recording
+        :param directory: string directory name
+        :return: None
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name, values in self.columns().items():
+            np.save(os.path.join(directory, name + '.npy'), values)
+
+    def to_parquet(self, directory):
+        """
+        Export the market series to market.parquet and every trader panel to <panel>.parquet with a column per trader.
+        Requires pandas with a parquet engine such as pyarrow.
+        :param directory: string directory name
+        :return: None
+        """
+        import pandas as pd
+        os.makedirs(directory, exist_ok=True)
+        columns = self.columns()
+        pd.DataFrame({name: columns[name] for name in self.series}).to_parquet(
+            os.path.join(directory, 'market.parquet'))
+        for name in self.panels:
+            pd.DataFrame(columns[name], columns=[str(idx) for idx in range(columns[name].shape[1])]).to_parquet(
+                os.path.join(directory, name + '.parquet'))
+
+
+def load_recording(path, mmap_mode='r'):
+    """
+    Load a recording exported by SimulationRecorder
+    :param path: string .npz file or directory of .npy files
+    :param mmap_mode: memory-map mode used for .npy files, None loads them into memory
+    :return: dictionary of recorded arrays
+    """
+    if os.path.isdir(path):
+        return {name[:-4]: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+                for name in sorted(os.listdir(path)) if name.endswith('.npy')}
+    with np.load(path) as archive:
+        return {name: archive[name] for name in archive.files}
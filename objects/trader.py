@@ -78,21 +78,254 @@ class TraderVariables:
         self.hypothetical_wealth = [money + stocks * init_price]
 
 
+class TraderPopulation:
+    """
+    Holds the state variables of a whole population of traders in preallocated arrays of shape (n_traders, ticks + 1),
+    so that the per-tick bookkeeping of all traders can be done in single vectorized operations.
+    """
+    def __init__(self, n_traders, ticks):
+        """
+        Initializes the population arrays
+        :param n_traders: integer number of traders
+        :param ticks: integer number of ticks that will be simulated
+        """
+        self.tick = 0
+        self.money = np.zeros((n_traders, ticks + 1))
+        self.stocks = np.zeros((n_traders, ticks + 1), dtype=np.int64)
+        self.wealth = np.zeros((n_traders, ticks + 1))
+        self.real_wealth = np.zeros((n_traders, ticks + 1))
+        self.weight_fundamentalist = np.zeros((n_traders, 1))
+        self.weight_chartist = np.zeros((n_traders, 1))
+        self.weight_random = np.zeros((n_traders, 1))
+
+    def trader_variables(self, idx, weight_fundamentalist, weight_chartist, weight_random, c_share_strat,
+                         money, stocks, covariance_matrix, init_price):
+        """
+        Fill in the initial variables of a trader and return a view on them
+        :param idx: integer row of the trader in the population arrays
+        :return: object PopulationTraderVariables
+        """
+        self.weight_fundamentalist[idx] = weight_fundamentalist
+        self.weight_chartist[idx] = weight_chartist
+        self.weight_random[idx] = weight_random
+        self.money[idx, 0] = money
+        self.stocks[idx, 0] = stocks
+        self.wealth[idx, 0] = money + stocks * init_price
+        self.real_wealth[idx, 0] = money + stocks * init_price
+        return PopulationTraderVariables(self, idx, c_share_strat, covariance_matrix, money, stocks, init_price)
+
+    def initialize(self, weight_fundamentalist, weight_chartist, weight_random, money, stocks, init_price):
+        """
+        Fill in the initial variables of all traders at once
+        :param weight_fundamentalist: np.Array of fundamentalist expectation components
+        :param weight_chartist: np.Array of chartist expectation components
+        :param weight_random: np.Array of random expectation components
+        :param money: np.Array of initial money
+        :param stocks: np.Array of initial stocks
+        :param init_price: float initial price
+        :return: None
+        """
+        self.weight_fundamentalist[:, 0] = weight_fundamentalist
+        self.weight_chartist[:, 0] = weight_chartist
+        self.weight_random[:, 0] = weight_random
+        self.money[:, 0] = money
+        self.stocks[:, 0] = stocks
+        self.wealth[:, 0] = money + stocks * init_price
+        self.real_wealth[:, 0] = money + stocks * init_price
+
+    def carry_forward(self, price, fundamental):
+        """
+        Start a new tick: carry money and stocks forward and value the holdings of all traders
+        :param price: float last close price
+        :param fundamental: float fundamental value
+        :return: None
+        """
+        if self.tick + 1 >= self.money.shape[1]:
+            raise ValueError("population arrays are full, allocate more ticks")
+        self.tick += 1
+        t = self.tick
+        self.money[:, t] = self.money[:, t - 1]
+        self.stocks[:, t] = self.stocks[:, t - 1]
+        self.wealth[:, t] = self.money[:, t] + self.stocks[:, t] * price
+        self.real_wealth[:, t] = self.money[:, t] + self.stocks[:, t] * fundamental
+
+    def settle(self, fills, respect_stocks=True):
+        """
+        Settle a batch of transactions in the current tick, in the order in which they took place
+        :param fills: structured np.Array with price, volume, bid_owner and ask_owner fields (FILL_DTYPE)
+        :param respect_stocks: boolean, if True raise an error, before any holdings change, if a seller has not
+        enough stocks or a buyer not enough money at the moment of a transaction
+        :return: None
+        """
+        if not len(fills):
+            return
+        values = fills['price'] * fills['volume']
+        # per fill, the seller is settled before the buyer
+        owners = np.column_stack([fills['ask_owner'], fills['bid_owner']]).ravel()
+        volumes = np.column_stack([-fills['volume'], fills['volume']]).ravel()
+        values = np.column_stack([values, -values]).ravel()
+        if respect_stocks:
+            stocks = self.running_holdings(self.stocks[:, self.tick], owners, volumes)
+            money = self.running_holdings(self.money[:, self.tick], owners, values)
+            # a seller needs the stocks and a buyer the money before the transaction, the first violation is reported
+            violations = np.flatnonzero(np.where(np.arange(len(owners)) % 2 == 0, stocks < 0, money < 0))
+            if len(violations):
+                if violations[0] % 2 == 0:
+                    raise ValueError("not enough stocks to sell this amount")
+                raise ValueError("not enough money to buy this amount of stocks")
+        np.add.at(self.stocks[:, self.tick], owners, volumes)
+        np.add.at(self.money[:, self.tick], owners, values)
+
+    @staticmethod
+    def running_holdings(holdings, owners, changes):
+        """
+        Holdings of the owner of every change right after it, in the order of the changes. The changes of every owner
+        are accumulated in a row of its own, so the running sums are added up in the same order as one by one.
+        :param holdings: np.Array of the holdings of all traders before the changes
+        :param owners: np.Array of the trader of every change
+        :param changes: np.Array of the changes
+        :return: np.Array of the running holdings
+        """
+        order = np.argsort(owners, kind='stable')
+        traders, first, group = np.unique(owners[order], return_index=True, return_inverse=True)
+        position = np.arange(len(order)) - first[group]
+        rows = np.zeros((len(traders), position.max() + 2), dtype=np.result_type(holdings, changes))
+        rows[:, 0] = holdings[traders]
+        rows[group, position + 1] = changes[order]
+        running = np.empty(len(order), dtype=rows.dtype)
+        running[order] = np.cumsum(rows, axis=1)[group, position + 1]
+        return running
+
+
+class PopulationTraderVariables:
+    """
+    Thin view on the row of a trader in a TraderPopulation, with the same interface as TraderVariables
+    """
+    def __init__(self, population, idx, c_share_strat, covariance_matrix, money, stocks, init_price):
+        self.population = population
+        self.idx = idx
+        self.c_share_strat = c_share_strat
+        self.covariance_matrix = covariance_matrix
+        self.active_orders = []
+
+        # The next parameters are only used for a robustness check
+        self.hypothetical_money = [money]
+        self.hypothetical_stocks = [stocks]
+        self.hypothetical_wealth = [money + stocks * init_price]
+
+    @property
+    def weight_fundamentalist(self):
+        return self.population.weight_fundamentalist[self.idx]
+
+    @property
+    def weight_chartist(self):
+        return self.population.weight_chartist[self.idx]
+
+    @property
+    def weight_random(self):
+        return self.population.weight_random[self.idx]
+
+    @property
+    def money(self):
+        return self.population.money[self.idx, :self.population.tick + 1]
+
+    @property
+    def stocks(self):
+        return self.population.stocks[self.idx, :self.population.tick + 1]
+
+    @property
+    def wealth(self):
+        return self.population.wealth[self.idx, :self.population.tick + 1]
+
+    @property
+    def real_wealth(self):
+        return self.population.real_wealth[self.idx, :self.population.tick + 1]
+
+
+class WealthRanking:
+    """
+    Lazily computed ranking of traders from the richest to the poorest by their latest wealth. The ranking is only
+    computed when it is asked for, at most once per tick. The previous rank order is kept so that every re-rank is a
+    stable sort of nearly sorted wealth, which also keeps tied traders in their previous order.
+    """
+    def __init__(self, traders):
+        """
+        Initialize the ranking
+        :param traders: list of Agent objects
+        """
+        self.traders = traders
+        self.population = getattr(traders[0].var, 'population', None)
+        self.order = None
+        self.ranked_tick = None
+
+    def current_tick(self):
+        """
+        :return: integer index of the latest wealth of the traders
+        """
+        if self.population is not None:
+            return self.population.tick
+        return len(self.traders[0].var.wealth) - 1
+
+    def wealth(self):
+        """
+        :return: numpy array with the latest wealth of every trader
+        """
+        if self.population is not None:
+            return self.population.wealth[:, self.population.tick]
+        return np.array([trader.var.wealth[-1] for trader in self.traders])
+
+    def indices(self):
+        """
+        :return: numpy array of trader indices ordered from the richest to the poorest trader
+        """
+        tick = self.current_tick()
+        if self.ranked_tick != tick:
+            self.rerank(self.wealth())
+            self.ranked_tick = tick
+        return self.order
+
+    def rerank(self, wealth):
+        """
+        Rank the traders by another wealth vector, such as wealth valued at a different price, starting from the
+        previous rank order
+        :param wealth: numpy array with a wealth of every trader
+        :return: numpy array of trader indices ordered from the richest to the poorest trader
+        """
+        negative_wealth = -np.asarray(wealth, dtype=np.float64)
+        if self.order is None or len(self.order) != len(negative_wealth):
+            self.order = np.argsort(negative_wealth, kind='stable')
+        else:
+            self.order = self.order[np.argsort(negative_wealth[self.order], kind='stable')]
+        self.ranked_tick = None
+        return self.order
+
+    def ranking(self):
+        """
+        :return: list of Agent objects ordered from the richest to the poorest trader
+        """
+        return [self.traders[idx] for idx in self.indices()]
+
+
 class TraderParameters:
     """
     Holds the the trader parameters for the distribution model
     """
 
-    def __init__(self, ref_horizon, risk_aversion, max_spread):
+    def __init__(self, ref_horizon, risk_aversion, max_spread, rng=None, spread=None):
         """
         Initializes trader parameters
         :param ref_horizon: integer horizon over which the trader can observe the past
         :param max_spread: Maximum spread at which the trader will submit orders to the book
         :param risk_aversion: float aversion to price volatility
+        :param rng: np.random.Generator from which the spread is drawn, None uses the global numpy random state
+        :param spread: float spread which has already been drawn, if given no spread is drawn
         """
         self.horizon = ref_horizon
         self.risk_aversion = risk_aversion
-        self.spread = max_spread * np.random.rand()
+        if spread is not None:
+            self.spread = spread
+        else:
+            self.spread = max_spread * (rng.random() if rng is not None else np.random.rand())
 
 
 class TraderExpectations:
@@ -1,5 +1,9 @@
 from init_objects import *
 from model import *
+from objects.config import ModelConfig
+from objects.recorder import SimulationRecorder
+from objects.trader import WealthRanking
+from functions.inequality import IncrementalInequality
 import time
 
 start_time = time.time()
@@ -18,12 +22,16 @@ parameters = {'trader_sample_size': 10,
               'fundamentalist_horizon_multiplier': 1.0,
               'strat_share_chartists': 0.90,
               }
+parameters = ModelConfig.from_dict(parameters)
 
 # 2 initialise model objects
 traders, orderbook = init_objects(parameters, seed=0)
 
-# 3 simulate model
-traders, orderbook = exuberance_inequality_model(traders, orderbook, parameters, seed=0)
+# 3 simulate model, recording the inequality of wealth every tick
+recorder = SimulationRecorder(len(traders), parameters['ticks'],
+                              inequality=IncrementalInequality(WealthRanking(traders)))
+traders, orderbook = exuberance_inequality_model(traders, orderbook, parameters, seed=0, recorder=recorder)
+print("The final Gini coefficient of wealth was", recorder.series['gini'][recorder.tick])
 
 
 print("The simulations took", time.time() - start_time, "to run")
\ No newline at end of file
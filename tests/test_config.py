@@ -0,0 +1,63 @@
+"""Parameter dictionaries are validated by ModelConfig, and a dictionary and its ModelConfig address the same results"""
+
+import pytest
+
+from functions.cache import SimulationCache
+from functions.journal import EvaluationJournal
+from objects.config import ModelConfig
+
+PARAMS = {'trader_sample_size': 5, 'n_traders': 50, 'init_stocks': 81, 'ticks': 60,
+          'fundamental_value': 1101.1096156039398, 'std_fundamental': 0.036138325335996965,
+          'base_risk_aversion': 0.7, 'spread_max': 0.004087, 'horizon': 20, 'std_noise': 0.05,
+          'w_random': 0.5, 'mean_reversion': 0.0, 'fundamentalist_horizon_multiplier': 1.0,
+          'strat_share_chartists': 0.3, 'mutation_intensity': 0.0, 'average_learning_ability': 0.0,
+          'trades_per_tick': 1}
+
+
+@pytest.mark.parametrize('changes, message', [
+    ({'n_trader': 50}, 'unknown parameters: n_trader'),
+    ({'ticks': None}, 'parameter ticks must be a number'),
+    ({'ticks': True}, 'parameter ticks must be a number'),
+    ({'ticks': 60.5}, 'parameter ticks must be an integer'),
+    ({'std_noise': float('nan')}, 'parameter std_noise is nan'),
+    ({'horizon': 10}, 'parameter horizon must be at least 11'),
+    ({'w_random': 1.5}, 'parameter w_random must be at most 1.0'),
+    ({'base_risk_aversion': 0.}, 'parameter base_risk_aversion must be positive'),
+    ({'trader_sample_size': 51}, 'trader_sample_size can not be larger than n_traders'),
+])
+def test_invalid_parameters_are_rejected(changes, message):
+    parameters = dict(PARAMS, **changes)
+    with pytest.raises(ValueError, match=message):
+        ModelConfig.from_dict(parameters)
+
+
+def test_missing_parameters_are_rejected_or_filled_in():
+    with pytest.raises(ValueError, match='missing parameter: ticks'):
+        ModelConfig.from_dict({name: value for name, value in PARAMS.items() if name != 'ticks'})
+    config = ModelConfig.from_dict({name: value for name, value in PARAMS.items() if name != 'trades_per_tick'})
+    assert config.trades_per_tick == 1
+
+
+def test_config_is_validated_once():
+    config = ModelConfig.from_dict(PARAMS)
+    assert ModelConfig.from_dict(config) is config
+    assert config.to_dict() == PARAMS
+    assert config.replace(ticks=80)['ticks'] == 80
+    with pytest.raises(ValueError):
+        config.replace(ticks=0)
+
+
+def test_dictionary_and_config_have_the_same_keys(tmp_path):
+    config = ModelConfig.from_dict(PARAMS)
+    # integral floats and omitted defaults are normalized before hashing
+    loose = dict(PARAMS, ticks=60.0)
+    del loose['mean_reversion']
+
+    cache = SimulationCache(str(tmp_path / 'cache'))
+    assert cache.key(PARAMS, 0) == cache.key(config, 0) == cache.key(loose, 0)
+    assert cache.key(PARAMS, 0) != cache.key(config.replace(ticks=61), 0)
+
+    journal = EvaluationJournal(str(tmp_path / 'journal.jsonl'))
+    assert journal.key(PARAMS, [0, 1], early_stopping=True) == journal.key(config, [0, 1], early_stopping=True)
+    assert journal.key(loose, [0, 1]) == journal.key(config, [0, 1])
+    assert journal.key(PARAMS, [0, 1]) != journal.key(config, [1, 0])
@@ -0,0 +1,123 @@
+"""
+Simulations which are certain enough to exceed a threshold are stopped early, and their censored cost leads the
+Nelder-Mead search to the same decisions as their exact cost
+"""
+
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+import calibrate_model_new
+from functions.cache import SimulationCache
+from functions.helpers import quadratic_loss_function, quadratic_loss_lower_bound
+from functions.indirect_calibration import parallelConstrNM
+from functions.journal import EvaluationJournal
+from objects.monitor import CheckpointMonitor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+W = np.load(os.path.join(ROOT, 'distr_weighting_matrix.npy'))
+EMPIRICAL_MOMENTS = np.load(os.path.join(ROOT, 'emp_moments.npy'))
+
+
+def test_lower_bound_is_the_lowest_loss_within_the_box():
+    assert W[0, 1] < 0
+    rng = np.random.default_rng(0)
+    grid = np.linspace(-1., 1., 21)
+    steps = np.array(list(itertools.product(grid, repeat=4)))
+    for _ in range(5):
+        m_sim = EMPIRICAL_MOMENTS + rng.normal(0., [0.05, 0.05, 3., 0.1])
+        standard_errors = np.abs(rng.normal(0., [0.02, 0.02, 1., 0.05]))
+        bound = quadratic_loss_lower_bound(m_sim, standard_errors, EMPIRICAL_MOMENTS, W, z=2.)
+        deviations = m_sim + 2. * standard_errors * steps - EMPIRICAL_MOMENTS
+        brute_force = np.min(np.einsum('ij,jk,ik->i', deviations, W, deviations))
+        assert bound <= brute_force + 1e-9
+        assert bound >= brute_force - 0.05 * max(brute_force, 1.)
+        assert bound <= quadratic_loss_function(m_sim, EMPIRICAL_MOMENTS, W)
+
+
+class Book:
+    def __init__(self, close):
+        self.tick_close_price = list(close)
+
+
+def test_monitor_stops_on_the_partial_loss():
+    bounds = iter([1., 3., 5.])
+    monitor = CheckpointMonitor(threshold=4., bound=lambda orderbook: next(bounds), every=10, min_ticks=20)
+    ticks = next(tick for tick in range(1, 100) if monitor.check(Book([100.]), 100., 1))
+    assert ticks == 40
+    assert monitor.stopped_at == 40 and monitor.reason == 'partial loss'
+    assert monitor.censored_loss() == 5.
+
+
+def test_monitor_records_divergence_without_stopping():
+    monitor = CheckpointMonitor(threshold=4., bound=lambda orderbook: 1., every=10, min_ticks=20)
+    assert not any(monitor.check(Book([5000.]), 100., 0) for _ in range(50))
+    assert monitor.divergence == 'explosive prices' and monitor.diverged_at == 10
+    assert monitor.censored_loss() is None
+
+    monitor = CheckpointMonitor(bound=lambda orderbook: 10., every=10, min_ticks=20)
+    assert not any(monitor.check(Book([100.]), 100., 1) for _ in range(50))
+    assert monitor.partial_loss is None
+
+
+def test_censored_journal_entries_are_replayed_at_lower_thresholds(tmp_path):
+    journal = EvaluationJournal(str(tmp_path / 'journal.jsonl'))
+    params = calibrate_model_new.params
+    exact, censored = journal.key(params, [0]), journal.key(params, [1])
+    journal.record(exact, params, [0], cost=3., censored=False, threshold=np.inf)
+    journal.record(censored, params, [1], cost=6., censored=True, threshold=5.)
+
+    journal = EvaluationJournal(str(tmp_path / 'journal.jsonl'))
+    assert journal.replayable(exact) and journal.replayable(exact, 1.)
+    assert journal.replayable(censored, 5.) and journal.replayable(censored, 4.)
+    assert not journal.replayable(censored, 5.5) and not journal.replayable(censored)
+    assert not journal.replayable(journal.key(params, [2]))
+
+
+def test_undecided_points_rerun_their_stopped_seeds():
+    moments = EMPIRICAL_MOMENTS + 0.01
+    cost = quadratic_loss_function(moments, EMPIRICAL_MOMENTS, W)
+    seed_outputs = [[(moments, 1., None), (None, 1., cost + 10.)],
+                    [(moments, 1., None), (None, 1., cost + 1.)],
+                    [(moments, 1., None), (moments, 1., None)]]
+    # the first point is above its threshold, the second is not decided yet
+    thresholds = [cost + 2., cost + 2., cost + 2.]
+    assert calibrate_model_new.censored_reruns(seed_outputs, thresholds, EMPIRICAL_MOMENTS, W) == [(1, 1)]
+
+
+@pytest.mark.parametrize('speculative', [False, True])
+def test_censored_costs_give_the_same_search(speculative):
+    def cost(x):
+        return float(np.sum((x - np.array([0.3, -0.2, 0.5])) ** 2) + 0.1 * np.sum(x ** 4))
+
+    def exact(points, worst):
+        return [cost(x) for x in points]
+
+    def censored(points, worst):
+        # a stopped evaluation reports a value between its threshold and its exact value
+        return [cost(x) if cost(x) <= threshold else (threshold + cost(x)) / 2. for x, threshold in zip(points, worst)]
+
+    LB, UB, x0 = np.full(3, -1.), np.full(3, 1.), np.array([0.6, 0.6, -0.5])
+    expected = parallelConstrNM(exact, x0, LB, UB, maxiter=60, full_output=1, retall=1, batch=True, thresholds=True,
+                                speculative=speculative)
+    res = parallelConstrNM(censored, x0, LB, UB, maxiter=60, full_output=1, retall=1, batch=True, thresholds=True,
+                           speculative=speculative)
+    np.testing.assert_array_equal(res['xopt'], expected['xopt'])
+    assert res['fopt'] == expected['fopt'] and res['iter'] == expected['iter']
+    np.testing.assert_array_equal(res['allvecs'], expected['allvecs'])
+
+
+def test_stopped_simulation_decides_like_the_full_simulation(tmp_path, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(calibrate_model_new, 'CACHE', SimulationCache(str(tmp_path)))
+    params = calibrate_model_new.params.replace(n_traders=200, ticks=300, std_noise=0.05, w_random=0.1,
+                                                strat_share_chartists=0.5)
+    threshold = 4.
+
+    moments, _, censored_cost = calibrate_model_new.simulate_seed_moments([2, params, threshold])
+    assert moments is None and censored_cost > threshold
+    moments, _, censored_cost = calibrate_model_new.simulate_seed_moments([2, params])
+    assert censored_cost is None
+    assert quadratic_loss_function(moments, EMPIRICAL_MOMENTS, W) > threshold
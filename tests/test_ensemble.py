@@ -0,0 +1,31 @@
+"""Cached ensemble statistics equal simulated ones, and are addressed by the version of the statistics"""
+
+import numpy as np
+
+from functions import ensemble
+from functions.cache import SimulationCache
+
+PARAMS = {'trader_sample_size': 5, 'n_traders': 50, 'init_stocks': 81, 'ticks': 30,
+          'fundamental_value': 1101.1096156039398, 'std_fundamental': 0.036138325335996965,
+          'base_risk_aversion': 0.7, 'spread_max': 0.004087, 'horizon': 20, 'std_noise': 0.05,
+          'w_random': 0.5, 'mean_reversion': 0.0, 'fundamentalist_horizon_multiplier': 1.0,
+          'strat_share_chartists': 0.3, 'mutation_intensity': 0.0, 'average_learning_ability': 0.0,
+          'trades_per_tick': 1}
+
+
+def test_cached_statistics_match_simulated(tmp_path):
+    cache = SimulationCache(str(tmp_path))
+    simulated = ensemble.run_ensemble([PARAMS], [0, 1], workers=1)
+    first = ensemble.run_ensemble([PARAMS], [0, 1], workers=1, cache=cache)
+    cached = ensemble.run_ensemble([PARAMS], [0, 1], workers=1, cache=cache)
+    for name, values in simulated.items():
+        np.testing.assert_array_equal(first[name], values)
+        np.testing.assert_array_equal(cached[name], values)
+
+
+def test_statistics_version_is_part_of_the_key(tmp_path, monkeypatch):
+    cache = SimulationCache(str(tmp_path))
+    key = ensemble.run_key(cache, PARAMS, 0, {}, {})
+    assert ensemble.run_key(cache, PARAMS, 0, {'engine': 'python'}, {}) == key
+    monkeypatch.setattr(ensemble, 'STATISTICS_VERSION', ensemble.STATISTICS_VERSION + '.1')
+    assert ensemble.run_key(cache, PARAMS, 0, {}, {}) != key
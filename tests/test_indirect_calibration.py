@@ -0,0 +1,81 @@
+"""The parallel Nelder-Mead follows the same path as the sequential constrNM, which wraps scipy.optimize.fmin, and the
+surrogate optimizer chooses the point with the lowest emulated value"""
+
+import numpy as np
+import pytest
+
+from functions.indirect_calibration import constrNM, parallelConstrNM, surrogateCalibration
+
+LB = np.full(4, -1.)
+UB = np.full(4, 1.)
+X0 = np.array([0.6, 0.6, -0.5, 0.2])
+
+
+def cost(x):
+    return float(np.sum((x - np.array([0.3, -0.2, 0.5, 0.1])) ** 2) + 0.1 * np.sum(x ** 4))
+
+
+def batch_cost(points):
+    return [cost(x) for x in points]
+
+
+@pytest.mark.parametrize('speculative', [False, True])
+@pytest.mark.parametrize('maxiter', [None, 1, 2, 3, 10, 40])
+@pytest.mark.parametrize('maxfun', [None, 0, 1, 3, 4, 5, 6, 7, 8, 13, 50])
+def test_parallel_search_follows_fmin(maxfun, maxiter, speculative):
+    sequential = constrNM(cost, X0, LB, UB, maxfun=maxfun, maxiter=maxiter, full_output=1)
+    parallel = parallelConstrNM(batch_cost, X0, LB, UB, maxfun=maxfun, maxiter=maxiter, full_output=1, batch=True,
+                                speculative=speculative)
+
+    np.testing.assert_array_equal(parallel['xopt'], sequential['xopt'])
+    assert parallel['fopt'] == sequential['fopt']
+    assert parallel['iter'] == sequential['iter']
+    assert parallel['warnflag'] == sequential['warnflag']
+    if speculative:
+        assert parallel['funcalls'] >= sequential['funcalls']
+    else:
+        assert parallel['funcalls'] == sequential['funcalls']
+
+
+def noisy_quadratic(lucky, diverged=0):
+    """
+    :param lucky: point of which the evaluation is a lucky zero, far from the minimum at (0.3, 0.7)
+    :param diverged: integer number of first evaluations which diverge
+    :return: function which evaluates a batch of points in the unit square with fixed noise
+    """
+    rng = np.random.default_rng(1)
+    evaluations = []
+
+    def evaluate(points):
+        values = []
+        for x in points:
+            evaluations.append(x)
+            if len(evaluations) <= diverged:
+                values.append(np.inf)
+            elif np.array_equal(x, lucky):
+                values.append(0.)
+            else:
+                values.append(float(np.sum((x - np.array([0.3, 0.7])) ** 2) + 0.002 * rng.standard_normal()))
+        return values
+    return evaluate
+
+
+def test_surrogate_chooses_the_emulated_minimum():
+    lucky = np.array([0.6, 0.4])
+    design = list(np.random.default_rng(2).random((8, 2))) + [lucky]
+    res = surrogateCalibration(noisy_quadratic(lucky), design, np.zeros(2), np.ones(2), maxfun=24, batch_size=4,
+                               batch=True, full_output=1)
+    assert res['funcalls'] == 24
+    assert res['warnflag'] == 1
+    # the lucky zero is not taken for the minimum
+    assert np.linalg.norm(res['xopt'] - np.array([0.3, 0.7])) < 0.1
+    assert res['fopt'] > 0.
+
+
+def test_surrogate_starts_over_when_the_design_diverges():
+    design = list(np.random.default_rng(2).random((4, 2)))
+    res = surrogateCalibration(noisy_quadratic(None, diverged=4), design, np.zeros(2), np.ones(2), maxfun=16,
+                               batch_size=4, batch=True, full_output=1)
+    assert res['funcalls'] == 16
+    assert np.isfinite(res['fopt'])
+    assert not any(np.array_equal(res['xopt'], x) for x in design)
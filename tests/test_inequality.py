@@ -0,0 +1,43 @@
+"""The incremental inequality measures recorded every tick equal the vectorized measures of the wealth panel"""
+
+import numpy as np
+import pytest
+
+from functions.inequality import IncrementalInequality, inequality_panel
+from init_objects import init_objects
+from model import exuberance_inequality_model
+from objects.recorder import SimulationRecorder
+from objects.trader import WealthRanking
+
+PARAMS = {'trader_sample_size': 5, 'n_traders': 50, 'init_stocks': 81, 'ticks': 60,
+          'fundamental_value': 1101.1096156039398, 'std_fundamental': 0.036138325335996965,
+          'base_risk_aversion': 0.7, 'spread_max': 0.004087, 'horizon': 20, 'std_noise': 0.05,
+          'w_random': 0.5, 'mean_reversion': 0.0, 'fundamentalist_horizon_multiplier': 1.0,
+          'strat_share_chartists': 0.3, 'mutation_intensity': 0.0, 'average_learning_ability': 0.0,
+          'trades_per_tick': 1}
+
+
+@pytest.mark.parametrize('array_backed', [False, True])
+def test_recorded_inequality_matches_panel(array_backed):
+    traders, orderbook = init_objects(PARAMS, 0, array_backed=array_backed)
+    recorder = SimulationRecorder(len(traders), PARAMS['ticks'],
+                                  inequality=IncrementalInequality(WealthRanking(traders)))
+    exuberance_inequality_model(traders, orderbook, PARAMS, 0, recorder=recorder)
+
+    columns = recorder.columns()
+    expected = inequality_panel(columns['wealth'])
+    for name, values in expected.items():
+        np.testing.assert_allclose(columns[name], values, rtol=1e-12)
+
+
+def test_latest_wealth_ranking():
+    traders, orderbook = init_objects(PARAMS, 1, array_backed=True)
+    exuberance_inequality_model(traders, orderbook, PARAMS, 1)
+    ranking = WealthRanking(traders)
+    inequality = IncrementalInequality(ranking)
+    measures = inequality.update()
+    wealth = np.array([trader.var.wealth[-1] for trader in traders])
+    assert [trader.name for trader in ranking.ranking()] == [traders[idx].name for idx in
+                                                             np.argsort(-wealth, kind='stable')]
+    for name, value in inequality_panel(wealth[None]).items():
+        assert measures[name] == pytest.approx(value[0], rel=1e-12)
@@ -0,0 +1,75 @@
+"""
+Seed for seed equivalence of the numba engine and the pure Python model. The compiled exp and log can differ from
+numpy in the last bit, so prices and money agree to rounding while the fills and stock holdings are identical. Order
+volumes are truncated to whole stocks, so in a few runs a rounding difference lets a trader order one stock more or
+less. Those runs are identical up to the tick of that truncation flip, where one fill moves one stock between two
+traders, and the fills diverge after it.
+"""
+
+import numpy as np
+import pytest
+
+from init_objects import init_objects
+from model import exuberance_inequality_model
+
+numba = pytest.importorskip('numba')
+
+PARAMS = {'trader_sample_size': 5, 'n_traders': 50, 'init_stocks': 81, 'ticks': 60,
+          'fundamental_value': 1101.1096156039398, 'std_fundamental': 0.036138325335996965,
+          'base_risk_aversion': 0.7, 'spread_max': 0.004087, 'horizon': 20, 'std_noise': 0.05,
+          'w_random': 0.5, 'mean_reversion': 0.0, 'fundamentalist_horizon_multiplier': 1.0,
+          'strat_share_chartists': 0.3, 'mutation_intensity': 0.0, 'average_learning_ability': 0.0,
+          'trades_per_tick': 1}
+
+# (order_expiration, seed): (tick of the truncation flip, traders whose stocks differ after it)
+FLIPS = {(None, 1): (44, [0, 48]), (None, 7): (19, [5, 20]), (0, 1): (51, [16, 25]), (0, 3): (56, [39, 46])}
+
+
+def simulate(seed, engine, order_expiration):
+    traders, orderbook = init_objects(PARAMS, seed)
+    if order_expiration is not None:
+        orderbook.order_expiration = order_expiration
+    traders, orderbook = exuberance_inequality_model(traders, orderbook, PARAMS, seed, engine=engine)
+    money = np.array([trader.var.money for trader in traders])
+    stocks = np.array([trader.var.stocks for trader in traders])
+    return orderbook, money, stocks
+
+
+def fills(orderbook):
+    """
+    :return: list of the transaction prices and volumes of every tick, an empty list for a tick without trades
+    """
+    prices = iter(orderbook.transaction_prices_history)
+    return [(next(prices) if len(volumes) else [], volumes) for volumes in orderbook.transaction_volumes_history]
+
+
+@pytest.mark.parametrize('order_expiration', [None, 0, 2])
+@pytest.mark.parametrize('seed', range(8))
+def test_numba_engine_matches_python(seed, order_expiration):
+    python_orderbook, python_money, python_stocks = simulate(seed, 'python', order_expiration)
+    numba_orderbook, numba_money, numba_stocks = simulate(seed, 'numba', order_expiration)
+
+    np.testing.assert_allclose(numba_orderbook.tick_close_price, python_orderbook.tick_close_price, rtol=1e-12)
+    python_fills, numba_fills = fills(python_orderbook), fills(numba_orderbook)
+    assert len(numba_fills) == len(python_fills) == PARAMS['ticks']
+
+    flip, flipped_traders = FLIPS.get((order_expiration, seed), (PARAMS['ticks'], []))
+    # up to the flip the same orders are matched: identical volumes and stocks, prices and money up to rounding
+    for (python_prices, python_volumes), (numba_prices, numba_volumes) in zip(python_fills[:flip], numba_fills[:flip]):
+        assert list(numba_volumes) == list(python_volumes)
+        np.testing.assert_allclose(numba_prices, python_prices, rtol=1e-12)
+    # column t + 1 of the holdings is the end of tick t
+    np.testing.assert_array_equal(numba_stocks[:, :flip + 1], python_stocks[:, :flip + 1])
+    np.testing.assert_allclose(numba_money[:, :flip + 1], python_money[:, :flip + 1], rtol=1e-12)
+    if flip == PARAMS['ticks']:
+        return
+
+    # at the flip the fills of the tick differ by a single stock each, which only changes the stocks of the trader who
+    # ordered one stock more or less and its counterparty, and shifts at most the value of one stock between traders
+    python_volumes, numba_volumes = np.array(python_fills[flip][1]), np.array(numba_fills[flip][1])
+    assert len(numba_volumes) == len(python_volumes)
+    assert np.abs(numba_volumes - python_volumes).max() == 1
+    differs = numba_stocks[:, flip + 1] != python_stocks[:, flip + 1]
+    assert list(np.flatnonzero(differs)) == flipped_traders
+    np.testing.assert_array_equal(np.abs(numba_stocks[differs, flip + 1] - python_stocks[differs, flip + 1]), 1)
+    assert np.abs(numba_money[:, flip + 1] - python_money[:, flip + 1]).max() <= max(python_fills[flip][0]) * (1 + 1e-12)
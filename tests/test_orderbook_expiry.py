@@ -0,0 +1,82 @@
+"""Randomized check that order expiry removes every expired order and nothing else"""
+
+import random
+
+import pytest
+
+from objects.orderbook import LimitOrderBook, PriceLevelOrderBook
+
+
+class Variables:
+    def __init__(self):
+        self.active_orders = []
+
+
+class Owner:
+    def __init__(self, name):
+        self.name = name
+        self.var = Variables()
+
+
+def resting_orders(book):
+    return list(book.bids) + list(book.asks)
+
+
+@pytest.mark.parametrize('book_class', [LimitOrderBook, PriceLevelOrderBook])
+@pytest.mark.parametrize('order_expiration', [0, 1, 3, 10])
+@pytest.mark.parametrize('seed', range(5))
+def test_no_expired_order_survives(book_class, order_expiration, seed):
+    rng = random.Random(seed)
+    book = book_class(last_price=100., spread_max=0.5, max_return_interval=5, order_expiration=order_expiration)
+    owners = [Owner(name) for name in range(20)]
+    placed = []
+
+    for tick in range(60):
+        for _ in range(rng.randint(0, 15)):
+            owner = rng.choice(owners)
+            action = rng.random()
+            if action < 0.15 and owner.var.active_orders:
+                # cancel
+                for order in owner.var.active_orders:
+                    book.cancel_order(order)
+                owner.var.active_orders = []
+            else:
+                price = round(rng.gauss(100., 2.), 1)
+                volume = rng.randint(1, 5)
+                if action < 0.6:
+                    order = book.add_bid(price, volume, owner)
+                else:
+                    order = book.add_ask(price, volume, owner)
+                owner.var.active_orders.append(order)
+                placed.append(order)
+            # match
+            while book.match_orders() is not None:
+                pass
+
+        book.cleanse_book()
+
+        resting = resting_orders(book)
+        resting_ids = {id(order) for order in resting}
+        # no resting order is older than the order expiration
+        assert all(order.age <= order_expiration for order in resting)
+        # every order that should have expired is gone from the book and from the expiry buckets
+        expired = [order for order in placed if order.age > order_expiration]
+        assert not any(id(order) in resting_ids for order in expired)
+        bucketed = {order_id for bucket in book.expiry_buckets.values() for order_id in bucket}
+        assert not any(order.order_id in bucketed for order in expired)
+        # and every resting order is still due to expire
+        assert {order.order_id for order in resting} <= bucketed
+
+
+@pytest.mark.parametrize('book_class', [LimitOrderBook, PriceLevelOrderBook])
+def test_orders_expire_after_order_expiration_ticks(book_class):
+    book = book_class(last_price=100., spread_max=0.5, max_return_interval=5, order_expiration=2)
+    owner = Owner(0)
+    bid = book.add_bid(99., 1, owner)
+    ask = book.add_ask(101., 1, owner)
+    for _ in range(2):
+        book.cleanse_book()
+        assert bid in book.bids and ask in book.asks
+    book.cleanse_book()
+    assert not resting_orders(book)
+    assert not book.expiry_buckets